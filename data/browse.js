@@ -802,18 +802,28 @@ function distance(el1, el2) {
   return dx * dx + dy * dy;
 }
 
+// Returns [file, distance] pairs, where distance is how many pixels the element is
+// outside of the visible part of the container (0 when visible), nearest first
 function files_needing_thumb_in_view(applicable, container) {
-  return _.map(
-    _.filter(applicable, function(x) {
-      var $x = $(x);
-      return (
-        !$x.attr('with_thumb') &&
-        $x.position().top + $x.height() >= 0 &&
-        $x.position().top <= container.height() + 200
-      );
-    }),
-    function(x) {
-      return decode_path($(x).attr('file'));
+  var visible_height = container.height();
+  return _.sortBy(
+    _.map(
+      _.filter(applicable, function(x) {
+        var $x = $(x);
+        return (
+          !$x.attr('with_thumb') &&
+          $x.position().top + $x.height() >= 0 &&
+          $x.position().top <= visible_height + 200
+        );
+      }),
+      function(x) {
+        var top = $(x).position().top;
+        var distance = Math.max(0, top - visible_height, -(top + $(x).height()));
+        return [decode_path($(x).attr('file')), distance];
+      }
+    ),
+    function(pair) {
+      return pair[1];
     }
   );
 }
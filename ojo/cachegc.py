@@ -0,0 +1,270 @@
+"""
+Garbage collection of the thumbnail cache in ~/.config/ojo/cache.
+
+Thumbnail names embed a hash of the source path and mtime, so edited, renamed and deleted images
+leave orphans behind that will never be used again. The collector deletes these, then evicts the
+least recently used thumbnails until the cache fits its byte budget, preferring thumbnails of
+heights that are no longer in use. It walks the cache incrementally and can be paused between
+batches, so it can run in the background while browsing.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import time
+
+from ojo import thumbpack
+from ojo.metastore import meta_store
+from ojo.thumbindex import is_deleted, thumb_index
+
+_THUMB_NAME = re.compile(r"^(.+)_([0-9a-f]{32})\.(jpg|png)$")
+_FOLDERTHUMBS_DIR = re.compile(r"^folderthumbs_(\d+)$")
+
+KIND_THUMB = "thumb"
+KIND_FOLDER = "folder"
+KIND_PACK = "pack"
+
+
+def get_cache_root():
+    return os.path.expanduser("~/.config/ojo/cache")
+
+
+def get_stamp_path():
+    return os.path.join(get_cache_root(), "last_gc")
+
+
+def thumb_hash(source, mtime):
+    """The hash Thumbs puts in thumbnail names, see Thumbs.get_cached_thumbnail_path"""
+    return hashlib.md5((source + "{0:.2f}".format(mtime)).encode("utf-8")).hexdigest()
+
+
+def parse_thumb_path(thumb_path, tree_root):
+    """
+    Recovers the source of a thumbnail from its place in the mirrored directory structure.
+    :return: (source path, hash), or None if thumb_path does not look like one of our thumbnails
+    """
+    match = _THUMB_NAME.match(os.path.basename(thumb_path))
+    if not match:
+        return None
+    relative = os.path.relpath(os.path.dirname(thumb_path), tree_root)
+    folder = os.sep if relative == os.curdir else os.path.join(os.sep, relative)
+    return os.path.join(folder, match.group(1)), match.group(2)
+
+
+def is_orphan(thumb_path, tree_root):
+    parsed = parse_thumb_path(thumb_path, tree_root)
+    if parsed is None:
+        return False  # not ours to judge, leave it to the budget
+    source, hash = parsed
+    try:
+        mtime = os.path.getmtime(source)
+    except OSError:
+        # an unmounted disk or unreachable share will be back, its thumbnails are still good
+        return is_deleted(source)
+    return thumb_hash(source, mtime) != hash
+
+
+def is_due(interval_hours):
+    try:
+        return time.time() - os.path.getmtime(get_stamp_path()) >= interval_hours * 3600
+    except OSError:
+        return True
+
+
+def touch_stamp():
+    path = get_stamp_path()
+    try:
+        with open(path, "a"):
+            pass
+        os.utime(path)
+    except OSError:
+        logging.exception("Could not update %s", path)
+
+
+class CacheCollector:
+    """
+    :param max_bytes: byte budget for the whole cache, None for no budget
+    :param max_age_days: thumbnails unused for longer get deleted, None to keep them
+    :param active_heights: thumb heights currently in use, other heights are evicted first
+    :param batch: number of cache entries to handle between pauses
+    :param pause: seconds to sleep between batches, to stay out of the way of the UI
+    :param should_stop: callable that returns True when collection should be abandoned
+    :param index: the ThumbIndex to prune along, defaults to the global one
+    """
+
+    def __init__(
+        self,
+        root=None,
+        max_bytes=None,
+        max_age_days=None,
+        active_heights=(),
+        batch=200,
+        pause=0.0,
+        should_stop=None,
+        index=None,
+    ):
+        self.root = root or get_cache_root()
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.active_heights = set(active_heights)
+        self.batch = batch
+        self.pause = pause
+        self.should_stop = should_stop or (lambda: False)
+        self.index = index or thumb_index
+        self.emptied = set()  # folders we deleted from, their mtime is no longer telling
+        self.deleted = []  # thumbnail files we deleted
+        self.handled = 0
+        self.stats = {"scanned": 0, "orphans": 0, "expired": 0, "evicted": 0, "freed_bytes": 0}
+
+    def _throttle(self):
+        self.handled += 1
+        if self.pause and self.handled % self.batch == 0:
+            time.sleep(self.pause)
+        return not self.should_stop()
+
+    def trees(self):
+        """:return: (tree root, kind, thumb height) of every cache tree under root"""
+        trees = []
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            return trees
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            if entry.name.isdigit():
+                trees.append((entry.path, KIND_THUMB, int(entry.name)))
+            elif _FOLDERTHUMBS_DIR.match(entry.name):
+                height = int(_FOLDERTHUMBS_DIR.match(entry.name).group(1))
+                trees.append((entry.path, KIND_FOLDER, height))
+            elif entry.name == "packs":
+                try:
+                    pack_dirs = list(os.scandir(entry.path))
+                except OSError:
+                    continue
+                for pack_dir in pack_dirs:
+                    if pack_dir.is_dir(follow_symlinks=False) and pack_dir.name.isdigit():
+                        trees.append((pack_dir.path, KIND_PACK, int(pack_dir.name)))
+        return trees
+
+    def walk(self, tree_root):
+        """Yields (path, stat) of all files in a tree, without following symlinks"""
+        pending = [tree_root]
+        while pending:
+            folder = pending.pop()
+            try:
+                entries = list(os.scandir(folder))
+            except OSError:
+                continue
+            for entry in entries:
+                if not self._throttle():
+                    return
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry.path, entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+
+    def _delete(self, path, size, reason):
+        try:
+            os.unlink(path)
+        except OSError:
+            return
+        self.emptied.add(os.path.dirname(path))
+        self.deleted.append(path)
+        self.stats[reason] += 1
+        self.stats["freed_bytes"] += size
+
+    def run(self):
+        """Runs a full collection, returns the stats dict"""
+        start = time.time()
+        expire_before = start - self.max_age_days * 86400 if self.max_age_days else None
+        kept = []  # (active, last used, size, path)
+        open_packs = thumbpack.open_pack_paths()  # the app may still append to these
+        pinned = 0
+
+        for tree_root, kind, height in self.trees():
+            active = height in self.active_heights
+            for path, stat in self.walk(tree_root):
+                self.stats["scanned"] += 1
+                last_used = max(stat.st_atime, stat.st_mtime)
+                if path in open_packs:
+                    pinned += stat.st_size
+                    continue
+                if kind != KIND_PACK and is_orphan(path, tree_root):
+                    self._delete(path, stat.st_size, "orphans")
+                elif expire_before and last_used < expire_before:
+                    self._delete(path, stat.st_size, "expired")
+                else:
+                    kept.append((active, last_used, stat.st_size, path))
+            if self.should_stop():
+                logging.info("Cache GC: interrupted")
+                # no time for a full prune, but the index must not point to what we deleted
+                self.index.remove_thumbs(self.deleted)
+                return self.stats
+
+        total = pinned + sum(k[2] for k in kept)
+        if self.max_bytes is not None and total > self.max_bytes:
+            # inactive heights first, then least recently used
+            kept.sort(key=lambda k: (k[0], k[1]))
+            for active, last_used, size, path in kept:
+                if total <= self.max_bytes or not self._throttle():
+                    break
+                self._delete(path, size, "evicted")
+                total -= size
+        self.stats["total_bytes"] = total
+
+        # before their folders go, after which prune can't tell them from unreachable ones
+        removed = self.index.remove_thumbs(self.deleted)
+        for tree_root, kind, height in self.trees():
+            self.remove_empty_folders(tree_root, start)
+        self.stats["pruned_records"] = removed + self.index.prune()
+
+        logging.info(
+            "Cache GC: scanned %d files in %.1f s, removed %d orphans, %d expired, %d evicted, "
+            "freed %.1f MB, cache is now %.1f MB",
+            self.stats["scanned"],
+            time.time() - start,
+            self.stats["orphans"],
+            self.stats["expired"],
+            self.stats["evicted"],
+            self.stats["freed_bytes"] / 1024.0 ** 2,
+            total / 1024.0 ** 2,
+        )
+        return self.stats
+
+    def remove_empty_folders(self, tree_root, older_than):
+        """
+        Folders modified after older_than are kept, thumbnails may be on their way into them -
+        unless it was us who modified them.
+        """
+        for folder, subfolders, files in os.walk(tree_root, topdown=False):
+            if folder == tree_root or files:
+                continue
+            try:
+                if folder in self.emptied or os.path.getmtime(folder) < older_than:
+                    os.rmdir(folder)  # fails when subfolders are not empty, that's intended
+                    self.emptied.add(os.path.dirname(folder))
+            except OSError:
+                pass
+
+
+def collect(options, pause=0.0, should_stop=None):
+    """Runs a collection with the limits from the ojo options"""
+    max_mb = options.get("thumbs_cache_max_mb")
+    heights = [options["thumb_height"]] + list(options.get("thumb_pyramid_heights") or [])
+    collector = CacheCollector(
+        max_bytes=max_mb * 1024 * 1024 if max_mb else None,
+        max_age_days=options.get("thumbs_cache_max_age_days") or None,
+        active_heights=heights,
+        pause=pause,
+        should_stop=should_stop,
+    )
+    stats = collector.run()
+    if not (should_stop and should_stop()):
+        stats["pruned_metadata"] = meta_store.prune()
+        touch_stamp()
+    return stats
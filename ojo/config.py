@@ -27,13 +27,40 @@ def load_options():
         "maximized": False,
         "fullscreen": False,
         "enlarge_smaller": False,
+        "progressive_display": True,
+        "pixbuf_cache_mb": 1024,
+        "metadata_cache_entries": 20000,
+        "metadata_exif_cache_mb": 64,
+        "prefetch_ahead": 2,
+        "prefetch_behind": 1,
+        "prefetch_max": 12,
+        "prefetch_workers": 2,
+        "zoom_tiles_min_megapixels": 40,
+        "zoom_tile_cache_mb": 256,
         "font_size": "12pt",
         "thumb_height": 180,
+        # extra thumb heights to create along from the same decode, e.g. [120, 240]; opt-in, each
+        # level is one more file per image in the cache
+        "thumb_pyramid_heights": [],
+        "thumb_reducing_gap": 2.0,
         "sort_by": "name",
         "sort_order": "asc",
         "show_hidden": False,
         "show_captions": True,
         "show_folder_thumbs": False,
+        "thumbs_cache_max_mb": 2048,
+        "thumbs_cache_max_age_days": 365,
+        "thumbs_cache_gc_interval_hours": 24,
+        "thumbs_engine": "process",
+        # "pack" keeps the thumbs of a folder in one pack file per thumb height. Reusing thumbs
+        # by content is off then, and folder thumbnails (one per folder) stay separate files
+        "thumbs_storage": "files",
+        "thumbs_yield_seconds": 1,
+        "thumbs_workers_while_viewing": 0,
+        "reuse_thumbnails_by_content": True,
+        "use_embedded_thumbnails": True,
+        "use_shared_thumbnails": True,
+        "write_shared_thumbnails": False,
         "date_format": "%-d %B %Y",
         "show_groups_for": {
             "date": True,
@@ -0,0 +1,219 @@
+"""
+Finds the JPEG thumbnails and previews that cameras embed in their files - the IFD1 thumbnail in the
+APP1 Exif segment of JPEGs, and the JPEG previews referenced from the IFDs of TIFF-based RAW formats
+(CR2, NEF, DNG, ARW, PEF...). Only the TIFF structures are parsed, nothing gets decoded.
+"""
+
+import logging
+import struct
+
+# JPEG markers which are not followed by a length
+_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+# start-of-frame markers, all but DHT (C4), JPG (C8) and DAC (CC)
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+TAG_NEW_SUBFILE_TYPE = 0x00FE
+TAG_COMPRESSION = 0x0103
+TAG_STRIP_OFFSETS = 0x0111
+TAG_STRIP_BYTE_COUNTS = 0x0117
+TAG_SUB_IFDS = 0x014A
+TAG_JPEG_OFFSET = 0x0201
+TAG_JPEG_LENGTH = 0x0202
+
+_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+
+MAX_IFDS = 32
+HEAD_SIZE = 128 * 1024
+# how much of an embedded JPEG to read first when looking for its SOF segment
+JPEG_HEAD_SIZE = 16 * 1024
+
+
+def jpeg_size(data):
+    """:return: (width, height) from the SOF segment of JPEG data, or None"""
+    if data[:2] != b"\xff\xd8":
+        return None
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker in _STANDALONE_MARKERS:
+            pos += 2
+            continue
+        if marker == 0xD9 or marker == 0xDA:  # EOI or start of scan before any SOF
+            return None
+        (length,) = struct.unpack(">H", data[pos + 2 : pos + 4])
+        if marker in _SOF_MARKERS:
+            if pos + 9 > len(data):
+                return None
+            height, width = struct.unpack(">HH", data[pos + 5 : pos + 9])
+            return width, height
+        pos += 2 + length
+    return None
+
+
+class _Tiff:
+    """Reads IFD entries from a TIFF structure that starts at base in the given reader"""
+
+    def __init__(self, read, base):
+        self.read = read
+        self.base = base
+        order = read(base, 2)
+        if order == b"II":
+            self.endian = "<"
+        elif order == b"MM":
+            self.endian = ">"
+        else:
+            raise ValueError("Not a TIFF structure")
+        (magic, self.first_ifd) = struct.unpack(self.endian + "HI", read(base + 2, 6))
+        if magic != 42:
+            raise ValueError("Unsupported TIFF variant %d" % magic)
+
+    def unpack(self, fmt, offset, size):
+        return struct.unpack(self.endian + fmt, self.read(self.base + offset, size))
+
+    def read_ifd(self, offset):
+        """:return: (dict of tag -> list of int values, offset of the next IFD)"""
+        (count,) = self.unpack("H", offset, 2)
+        if count > 1000:
+            raise ValueError("Implausible IFD entry count %d" % count)
+        entries = {}
+        for i in range(count):
+            tag, kind, n, value = self.unpack("HHI4s", offset + 2 + 12 * i, 12)
+            if kind not in (3, 4, 13) or n == 0:
+                continue  # we only need SHORT, LONG and IFD values
+            size = _TYPE_SIZES[kind] * n
+            if size > 4:
+                (value_offset,) = struct.unpack(self.endian + "I", value)
+                value = self.read(self.base + value_offset, size)
+            fmt = "H" if kind == 3 else "I"
+            entries[tag] = list(struct.unpack(self.endian + fmt * n, value[:size]))
+        (next_ifd,) = self.unpack("I", offset + 2 + 12 * count, 4)
+        return entries, next_ifd
+
+    def embedded_jpegs(self):
+        """:return: list of (offset from base, length) of the JPEGs referenced from the IFDs"""
+        result = []
+        pending = [self.first_ifd]
+        seen = set()
+        while pending and len(seen) < MAX_IFDS:
+            offset = pending.pop(0)
+            if not offset or offset in seen:
+                continue
+            seen.add(offset)
+            entries, next_ifd = self.read_ifd(offset)
+            pending.append(next_ifd)
+            pending.extend(entries.get(TAG_SUB_IFDS, []))
+
+            if TAG_JPEG_OFFSET in entries and TAG_JPEG_LENGTH in entries:
+                result.append((entries[TAG_JPEG_OFFSET][0], entries[TAG_JPEG_LENGTH][0]))
+            elif (
+                entries.get(TAG_COMPRESSION, [0])[0] in (6, 7)
+                and entries.get(TAG_NEW_SUBFILE_TYPE, [0])[0] == 1  # a reduced-size image
+                and len(entries.get(TAG_STRIP_OFFSETS, [])) == 1
+                and len(entries.get(TAG_STRIP_BYTE_COUNTS, [])) == 1
+            ):
+                result.append((entries[TAG_STRIP_OFFSETS][0], entries[TAG_STRIP_BYTE_COUNTS][0]))
+        return result
+
+
+def _find_exif_segment(head):
+    """:return: offset of the TIFF header inside the APP1 Exif segment of a JPEG, or None"""
+    pos = 2
+    while pos + 4 <= len(head):
+        if head[pos] != 0xFF:
+            return None
+        marker = head[pos + 1]
+        if marker in _STANDALONE_MARKERS or marker == 0xFF:
+            pos += 1 if marker == 0xFF else 2
+            continue
+        if marker == 0xDA or marker == 0xD9:
+            return None
+        (length,) = struct.unpack(">H", head[pos + 2 : pos + 4])
+        if marker == 0xE1 and head[pos + 4 : pos + 10] == b"Exif\0\0":
+            return pos + 10
+        pos += 2 + length
+    return None
+
+
+def find_embedded_jpegs(filename):
+    """
+    Only reads as much of each embedded JPEG as it takes to find its dimensions, see
+    read_embedded_jpeg for the data.
+    :return: list of (offset, length, width, height) of the valid JPEGs embedded in the file,
+    possibly empty
+    """
+    with open(filename, "rb") as f:
+        head = f.read(HEAD_SIZE)
+
+        def read(offset, size):
+            if offset + size <= len(head):
+                return head[offset : offset + size]
+            f.seek(offset)
+            data = f.read(size)
+            if len(data) != size:
+                raise ValueError("Offset out of file bounds")
+            return data
+
+        if head[:2] == b"\xff\xd8":
+            base = _find_exif_segment(head)
+            if base is None:
+                return []
+        elif head[:4] in (b"II*\0", b"MM\0*"):
+            base = 0
+        else:
+            return []
+
+        try:
+            tiff = _Tiff(read, base)
+            candidates = tiff.embedded_jpegs()
+        except (ValueError, struct.error):
+            logging.debug("Could not parse the EXIF structure of %s", filename)
+            return []
+
+        result = []
+        for offset, length in candidates:
+            start = base + offset
+            head_size = min(length, JPEG_HEAD_SIZE)
+            try:
+                size = jpeg_size(read(start, head_size))
+                while size is None and head_size < length:
+                    # the SOF may come after large APP segments
+                    head_size = min(length, head_size * 4)
+                    size = jpeg_size(read(start, head_size))
+            except (ValueError, OSError):
+                continue
+            if size:
+                result.append((start, length, size[0], size[1]))
+        return result
+
+
+def read_embedded_jpeg(filename, offset, length):
+    """:return: the bytes of an embedded JPEG as found by find_embedded_jpegs"""
+    with open(filename, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    if len(data) != length:
+        raise ValueError("Offset out of file bounds")
+    return data
+
+
+def get_embedded_jpeg(filename, min_width, min_height, aspect_ratio=None, tolerance=0.02):
+    """
+    Finds the smallest embedded JPEG that is at least min_width x min_height and, if aspect_ratio
+    (width / height) is given, has the same aspect ratio - thumbnails with black bars or of a
+    different crop get rejected. All dimensions are as stored, i.e. before EXIF orientation.
+    :return: the JPEG bytes, or None
+    """
+    best = None
+    for offset, length, width, height in find_embedded_jpegs(filename):
+        if width < min_width or height < min_height:
+            continue
+        if aspect_ratio and abs(float(width) / height - aspect_ratio) > tolerance * aspect_ratio:
+            continue
+        if best is None or width * height < best[2] * best[3]:
+            best = (offset, length, width, height)
+    return read_embedded_jpeg(filename, best[0], best[1]) if best else None
@@ -59,6 +59,7 @@ import codecs
 import json
 import logging
 import os
+import re
 import subprocess
 import sys
 import threading
@@ -215,17 +216,30 @@ class ExifTool(object):
         .. note:: This is considered a low-level method, and should
            rarely be needed by application developers.
         """
+        return self._execute(*params).strip()[: -len(sentinel)].decode('utf-8')
+
+    def execute_raw(self, *params):
+        """Like :py:meth:`execute()`, but returns the output bytes exactly
+        as exiftool wrote them, e.g. binary tag values extracted with ``-b``.
+        """
+        output = self._execute(*params)
+        return output[: output.rindex(sentinel)]
+
+    def _execute(self, *params):
         with self.lock:
             if not self.running:
                 raise ValueError("ExifTool instance not running.")
             params = [(p.encode("utf-8") if isinstance(p, str) else p) for p in params]
             self._process.stdin.write(b"\n".join(params + [b"-execute\n"]))
             self._process.stdin.flush()
-            output = b""
+            chunks = []
+            tail = b""
             fd = self._process.stdout.fileno()
-            while not output[-32:].strip().endswith(sentinel):
-                output += os.read(fd, block_size)
-            return output.strip()[: -len(sentinel)].decode('utf-8')
+            while not tail.strip().endswith(sentinel):
+                chunk = os.read(fd, block_size)
+                chunks.append(chunk)
+                tail = (tail + chunk)[-32:]
+            return b"".join(chunks)
 
     def execute_json(self, *params):
         """Execute the given batch of parameters and parse the JSON output.
@@ -323,13 +337,23 @@ class ExifTool(object):
         """
         return self.get_tag_batch(tag, [filename])[0]
 
-    def extract_previews(self, filename, to_folder):
-        params = [
-            "-a",
-            "-b",
-            "-W",
-            "{}/%f_%t%-c.%s".format(to_folder),
-            "-preview:all",
-            filename,
-        ]
-        self.execute(*params)
+    def list_previews(self, filename):
+        """List the embedded preview images of a file without extracting them.
+
+        The return value is a dictionary mapping preview tag names (e.g.
+        ``PreviewImage``, ``JpgFromRaw``) to their size in bytes.
+        """
+        previews = {}
+        for tag, value in self.execute_json("-preview:all", filename)[0].items():
+            if isinstance(value, dict):
+                value = value.get("val")
+            match = re.match(r"\(Binary data (\d+) bytes", str(value))
+            if match:
+                previews[tag] = int(match.group(1))
+        return previews
+
+    def get_preview(self, filename, tag):
+        """Return the bytes of a single embedded preview, as listed by
+        :py:meth:`list_previews()`, straight from the exiftool pipe.
+        """
+        return self.execute_raw("-b", "-" + tag, fsencode(filename))
@@ -0,0 +1,44 @@
+"""
+One pass over a folder's entries with os.scandir, capturing what listing, sorting, grouping and
+the folder stats need: the type of every entry and the stat of every file. Everything else asks
+the snapshot instead of the file system, which matters a lot on network mounts.
+"""
+
+import os
+import time
+
+
+class FolderSnapshot:
+    def __init__(self, folder):
+        self.folder = folder
+        self.taken = time.time()
+        self.stats = {}  # file path -> os.stat_result
+        self.subfolders = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                try:
+                    # like os.path.isdir/isfile and os.stat, these follow symlinks
+                    if entry.is_dir():
+                        self.subfolders.append(entry.path)
+                    elif entry.is_file():
+                        self.stats[entry.path] = entry.stat()
+                except OSError:
+                    continue  # e.g. a dangling symlink, or deleted meanwhile
+        self.subfolders.sort()
+
+    def files(self, extensions=None):
+        """:return: paths of files, only those with one of the (lower case) extensions if given"""
+        if extensions is None:
+            return list(self.stats)
+        return [f for f in self.stats if os.path.splitext(f)[1].lower() in extensions]
+
+    def stat(self, path):
+        """The captured stat of path, falling back to os.stat for files that are not in here"""
+        stat = self.stats.get(path)
+        return stat if stat is not None else os.stat(path)
+
+    def mtime(self, path):
+        return self.stat(path).st_mtime
+
+    def size(self, path):
+        return self.stat(path).st_size
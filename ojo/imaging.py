@@ -3,15 +3,19 @@ import io
 import logging
 import os
 import random
+import struct
 import tempfile
 import threading
+from functools import reduce
+from math import gcd
 
 import gi
-from gi.repository import GdkPixbuf, Gio, GObject
-from PIL import Image
+from gi.repository import GdkPixbuf, Gio, GLib, GObject
+from PIL import Image, ImageSequence
 
-from ojo import config
+from ojo import config, exifthumb
 from ojo.exiftool import ExifTool
+from ojo.foldersnapshot import FolderSnapshot
 from ojo.metadata import metadata
 from ojo.util import ext
 
@@ -91,6 +95,14 @@ RAW_FORMATS = {
 }
 
 
+# formats GdkPixbuf may hold several frames of
+ANIMATED_FORMATS = {".gif", ".mng", ".png", ".webp"}
+
+# beyond this many bytes of decoded frames, animations are played unscaled from GdkPixbuf
+ANIMATION_MAX_BYTES = 256 * 1024 * 1024
+# the shortest tick scaled animations play at, odd frame delays get rounded to multiples of it
+ANIMATION_MIN_TICK_MS = 20
+
 exiftool = None
 _lock = threading.Lock()
 
@@ -114,33 +126,43 @@ def stop_exiftool_process():
             exiftool = None
 
 
-def get_optimal_preview(filename, to_folder, width=None, height=None):
-    exiftool.extract_previews(filename, to_folder)
-
-    # filter to just jpeg and png previews (tiffs are sometimes present too)
-    previews = [
-        {"path": os.path.join(to_folder, name)}
-        for name in os.listdir(to_folder)
-        if name.endswith((".jpg", ".jpeg", ".png"))
-    ]
+def get_encoded_size(data):
+    """:return: (width, height) of JPEG or PNG preview data, or None for other formats"""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return struct.unpack(">II", data[16:24])
+    return exifthumb.jpeg_size(data)
 
-    for p in previews:
-        w, h = get_size_via_pixbuf(p["path"])
-        p["width"] = w
-        p["height"] = h
-
-    if width is None or height is None:
-        # if no resizing required - use the biggest image
-        preview = max(previews, key=lambda p: p["width"])
-    else:
-        # else use the smallest image that is bigger than the desired size
-        bigger = [p for p in previews if p["width"] >= width and p["height"] >= height]
-        if bigger:
-            preview = min(bigger, key=lambda p: p["width"])
-        else:
-            preview = max(previews, key=lambda p: p["width"])
 
-    return preview["path"]
+def get_optimal_preview(filename, width=None, height=None):
+    """
+    Picks one embedded preview of a RAW file and reads only that one. The previews of TIFF-based
+    RAW files are ranked by the sizes in their headers (see exifthumb): the smallest at least
+    width x height is read, or the biggest if none is that big or no size is given. Other files
+    only have their previews listed by byte length by exiftool, so the biggest is read through the
+    exiftool pipe, without extracting anything to disk.
+    :return: (preview bytes, width, height)
+    """
+    embedded = exifthumb.find_embedded_jpegs(filename)
+    if embedded:
+        area = lambda e: e[2] * e[3]
+        covering = [
+            e
+            for e in embedded
+            if width is not None and height is not None and e[2] >= width and e[3] >= height
+        ]
+        offset, length, preview_width, preview_height = (
+            min(covering, key=area) if covering else max(embedded, key=area)
+        )
+        return exifthumb.read_embedded_jpeg(filename, offset, length), preview_width, preview_height
+
+    previews = exiftool.list_previews(filename)
+    for tag in sorted(previews, key=previews.get, reverse=True):
+        data = exiftool.get_preview(filename, tag)
+        size = get_encoded_size(data)
+        if size:
+            return data, size[0], size[1]
+        # tiffs are sometimes present too, then the next biggest it is
+    raise Exception("No usable preview in %s" % filename)
 
 
 def get_pil(filename, width=None, height=None, fallback_to_preview=False):
@@ -152,14 +174,23 @@ def get_pil(filename, width=None, height=None, fallback_to_preview=False):
     except IOError:
         if not fallback_to_preview:
             raise
-        with tempfile.TemporaryDirectory(prefix="ojo") as to_folder:
-            optimal_preview = get_optimal_preview(filename, to_folder, width, height)
-            pil_image = Image.open(optimal_preview)
+        data, _, _ = get_optimal_preview(filename, width, height)
+        pil_image = Image.open(io.BytesIO(data))
 
     if width is not None:
         # thumbnail, than auto-rotate (so we work rotate a smaller image), than re-thumbnail
         # because the rotation might chnage width/height
-        pil_image.thumbnail((max(width, height), max(width, height)), Image.ANTIALIAS)
+        if orientation_swaps_dimensions(orientation):
+            box = (height, width)
+        else:
+            box = (width, height)
+        gap = config.options.get("thumb_reducing_gap", 2.0)
+        if gap:
+            # let libjpeg decode at 1/2, 1/4 or 1/8 scale (no-op for other formats),
+            # then thumbnail() reduces by integer factors down to gap times the box before the
+            # final ANTIALIAS resample
+            pil_image.draft(None, (int(box[0] * gap), int(box[1] * gap)))
+        pil_image.thumbnail(box, Image.ANTIALIAS, reducing_gap=gap or None)
         pil_image = auto_rotate_pil(orientation, pil_image)
         if pil_image.size[0] > width or pil_image.size[1] > height:
             pil_image.thumbnail((width, height), Image.ANTIALIAS)
@@ -169,6 +200,39 @@ def get_pil(filename, width=None, height=None, fallback_to_preview=False):
     return pil_image
 
 
+def get_embedded_pil(filename, width, height):
+    """
+    Loads the thumbnail or preview the camera embedded in the file, if one is big enough to fill
+    a width x height box the way the full image would, and has the aspect ratio of the full image.
+    :return: auto-rotated PIL image no bigger than the box, or None
+    """
+    meta = metadata.get(filename)
+    orientation = meta["orientation"]
+    image_width, image_height = meta["width"], meta["height"]
+    if not image_width or not image_height:
+        return None
+
+    # the size the full image would be thumbnailed to
+    scale = min(float(width) / image_width, float(height) / image_height, 1)
+    need_width, need_height = int(image_width * scale), int(image_height * scale)
+    aspect_ratio = float(image_width) / image_height
+    if orientation_swaps_dimensions(orientation):
+        # embedded thumbnails are stored unrotated, like the main image
+        need_width, need_height = need_height, need_width
+        aspect_ratio = 1 / aspect_ratio
+
+    data = exifthumb.get_embedded_jpeg(filename, need_width, need_height, aspect_ratio)
+    if data is None:
+        return None
+
+    pil_image = Image.open(io.BytesIO(data))
+    pil_image.draft(None, (need_width, need_height))
+    pil_image = auto_rotate_pil(orientation, pil_image)
+    if pil_image.size[0] > width or pil_image.size[1] > height:
+        pil_image.thumbnail((width, height), Image.ANTIALIAS)
+    return pil_image
+
+
 def get_pixbuf(filename, width=None, height=None):
     meta = metadata.get(filename)
     orientation = meta["orientation"]
@@ -176,9 +240,10 @@ def get_pixbuf(filename, width=None, height=None):
 
     def _from_preview():
         try:
-            with tempfile.TemporaryDirectory(prefix="ojo") as to_folder:
-                optimal_preview = get_optimal_preview(filename, to_folder, width, height)
-                pixbuf = pixbuf_from_file(optimal_preview)
+            data, preview_width, preview_height = get_optimal_preview(filename, width, height)
+            pixbuf = pixbuf_from_data_at_size(
+                data, preview_width, preview_height, width, height, orientation
+            )
             pixbuf = auto_rotate_pixbuf(orientation, pixbuf)
             logging.debug("Loaded from preview")
             return pixbuf
@@ -187,7 +252,7 @@ def get_pixbuf(filename, width=None, height=None):
 
     def _from_gdk_pixbuf():
         try:
-            pixbuf = GdkPixbuf.Pixbuf.new_from_file(filename)
+            pixbuf = pixbuf_from_file_at_size(filename, width, height, orientation)
             pixbuf = auto_rotate_pixbuf(orientation, pixbuf)
             logging.debug("Loaded directly")
             return pixbuf
@@ -196,7 +261,8 @@ def get_pixbuf(filename, width=None, height=None):
 
     def _from_pil():
         try:
-            pixbuf = pil_to_pixbuf(get_pil(filename))
+            # get_pil lets libjpeg decode at reduced size via draft mode when given a box
+            pixbuf = pil_to_pixbuf(get_pil(filename, width, height))
             logging.debug("Loaded with PIL")
             return pixbuf
         except:
@@ -223,37 +289,96 @@ def get_pixbuf(filename, width=None, height=None):
     if width is not None and (width < image_width or height < image_height):
         # scale it
         if float(width) / height < float(image_width) / image_height:
-            pixbuf = pixbuf.scale_simple(
-                width, int(float(width) * image_height / image_width), GdkPixbuf.InterpType.BILINEAR
-            )
+            target = width, int(float(width) * image_height / image_width)
         else:
-            pixbuf = pixbuf.scale_simple(
-                int(float(height) * image_width / image_height),
-                height,
-                GdkPixbuf.InterpType.BILINEAR,
-            )
+            target = int(float(height) * image_width / image_height), height
+        # most loaders above already decoded at (about) this size
+        if abs(pixbuf.get_width() - target[0]) > 1 or abs(pixbuf.get_height() - target[1]) > 1:
+            pixbuf = pixbuf.scale_simple(target[0], target[1], GdkPixbuf.InterpType.BILINEAR)
 
     return pixbuf
 
 
-def thumbnail(filename, thumb_path, width, height):
-    _, tmp_thumb_path = tempfile.mkstemp(prefix="ojo_thumbnail_")
+def _save_atomically(save_fn, path):
+    folder = os.path.dirname(path)
+    if not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix="ojo_thumbnail_", dir=folder)
+    os.close(fd)
+    try:
+        save_fn(tmp_path)
+        os.rename(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _fit_pixbuf(pixbuf, width, height):
+    scale = min(float(width) / pixbuf.get_width(), float(height) / pixbuf.get_height())
+    if scale >= 1:
+        return pixbuf
+    return pixbuf.scale_simple(
+        max(1, int(pixbuf.get_width() * scale)),
+        max(1, int(pixbuf.get_height() * scale)),
+        GdkPixbuf.InterpType.HYPER,
+    )
+
+
+def thumbnail(filename, thumb_path, width, height, pyramid=()):
+    """
+    Creates the thumbnail for filename, and from the same decode of the original also the given
+    pyramid of thumbnails in other sizes.
+    :param pyramid: (thumb path, max width, max height) of each additional size
+    :return: (filename, thumb path)
+    """
+    # biggest first, so every level is downscaled from the previous one
+    levels = sorted([(thumb_path, width, height)] + list(pyramid), key=lambda l: -l[2])
+
+    def use_embedded():
+        pil = get_embedded_pil(filename, width, height)
+        if pil is None:
+            return False
+        # the embedded thumbnail covers the requested size, bigger levels wait for a full decode
+        for path, w, h in levels:
+            if h > height:
+                continue
+            if pil.size[0] > w or pil.size[1] > h:
+                pil.thumbnail((w, h), Image.ANTIALIAS)
+            _save_atomically(lambda tmp: pil.save(tmp, "JPEG"), path)
+        logging.debug("Thumbnailed %s from its embedded thumbnail", filename)
+        return True
 
     def use_pil():
-        pil = get_pil(filename, width, height)
-        try:
-            pil.save(tmp_thumb_path, "JPEG")
-        except Exception:
-            logging.exception("Could not save thumbnail in format %s:" % format)
-            raise
+        pil = get_pil(filename, levels[0][1], levels[0][2])
+        for path, w, h in levels:
+            if pil.size[0] > w or pil.size[1] > h:
+                pil.thumbnail((w, h), Image.ANTIALIAS)
+            try:
+                _save_atomically(lambda tmp: pil.save(tmp, "JPEG"), path)
+            except Exception:
+                logging.exception("Could not save thumbnail in mode %s:" % pil.mode)
+                raise
 
     def use_pixbuf():
-        pixbuf = get_pixbuf(filename, width, height)
-        pixbuf.savev(tmp_thumb_path, "png", [], [])
-
-    cache_dir = os.path.dirname(thumb_path)
-    if not os.path.exists(cache_dir):
-        os.makedirs(cache_dir)
+        pixbuf = get_pixbuf(filename, levels[0][1], levels[0][2])
+        for path, w, h in levels:
+            pixbuf = _fit_pixbuf(pixbuf, w, h)
+            _save_atomically(lambda tmp: pixbuf.savev(tmp, "png", [], []), path)
+
+    if config.options.get("use_embedded_thumbnails", True) and ext(filename) not in {
+        ".gif",
+        ".png",
+        ".svg",
+        ".xpm",
+    }:
+        try:
+            if use_embedded():
+                return filename, thumb_path
+        except Exception:
+            logging.exception("Could not use the embedded thumbnail of %s", filename)
 
     if ext(filename) in {".gif", ".png", ".svg", ".xpm"}.union(RAW_FORMATS):
         try:
@@ -266,8 +391,24 @@ def thumbnail(filename, thumb_path, width, height):
         except Exception:
             use_pixbuf()
 
-    os.rename(tmp_thumb_path, thumb_path)
+    return filename, thumb_path
+
 
+def thumbnail_from_thumbnail(filename, source_thumb, thumb_path, width, height, pyramid=()):
+    """
+    Creates the thumbnail (and the given pyramid of smaller ones) by downscaling an existing bigger
+    thumbnail of the same image, without touching the original.
+    :param source_thumb: path or file object of the bigger thumbnail
+    :return: (filename, thumb path)
+    """
+    levels = sorted([(thumb_path, width, height)] + list(pyramid), key=lambda l: -l[2])
+    pil = Image.open(source_thumb)
+    save_format = "PNG" if pil.format == "PNG" else "JPEG"
+    pil.load()
+    for path, w, h in levels:
+        if pil.size[0] > w or pil.size[1] > h:
+            pil.thumbnail((w, h), Image.ANTIALIAS)
+        _save_atomically(lambda tmp: pil.save(tmp, save_format), path)
     return filename, thumb_path
 
 
@@ -282,7 +423,7 @@ def folder_thumbnail(folder, thumb_path, width, height, kill_event):
     :param thumb_path: thumb path to save thumb to
     :param width: max width of a single image thumbnail (standard non-folder one)
     :param height: height of a single image thumbnail (standard non-folder one, as set in options)
-    :param kill_event: multiprocessing.Event that will be set when app is exiting
+    :param kill_event: thumbs.CancelToken that will be set when app is exiting or the job is stale
     :return: (folder, thumb path), or (folder, None) if folder contains no images
     """
     cache_dir = os.path.dirname(thumb_path)
@@ -294,7 +435,7 @@ def folder_thumbnail(folder, thumb_path, width, height, kill_event):
     if not images:
         return folder, None
 
-    from ojo.thumbs import Thumbs
+    from ojo.thumbs import Thumbs, use_packs
 
     random.seed(1234)
     random.shuffle(images)
@@ -312,10 +453,19 @@ def folder_thumbnail(folder, thumb_path, width, height, kill_event):
             return folder, None
 
         try:
-            fthumb = Thumbs.get_cached_thumbnail_path(f, height)
-            if not os.path.exists(fthumb):
-                _, fthumb = thumbnail(f, fthumb, 3 * height, height)
-            fthumb_image = get_pil(fthumb, MAX_WIDTH, THUMB_HEIGHT)
+            if use_packs():
+                fthumb_image = _packed_thumb_for_folder(f, height, MAX_WIDTH, THUMB_HEIGHT)
+            else:
+                # any existing thumb at least as tall as needed will do, else create the pyramid
+                fthumb = Thumbs.find_thumbnail(f, THUMB_HEIGHT)
+                if not fthumb:
+                    fthumb = Thumbs.get_cached_thumbnail_path(
+                        f, force_cache=True, thumb_height=height
+                    )
+                    _, fthumb = thumbnail(
+                        f, fthumb, 3 * height, height, Thumbs.get_pyramid_levels(f, height)
+                    )
+                fthumb_image = get_pil(fthumb, MAX_WIDTH, THUMB_HEIGHT)
             w, h = fthumb_image.size
             if total_width + MARGIN + w > MAX_WIDTH + 100:
                 break
@@ -333,6 +483,38 @@ def folder_thumbnail(folder, thumb_path, width, height, kill_event):
     return folder, thumb_path
 
 
+def _packed_thumb_for_folder(filename, height, max_width, max_height):
+    """
+    Pack mode's source of a folder thumbnail's image: any packed thumb at least max_height tall,
+    else a new one in a temp file - the thumbnail worker processes don't write to packs.
+    :return: PIL image fitting max_width x max_height
+    """
+    from ojo.thumbs import Thumbs
+
+    data = Thumbs.find_packed_thumbnail(filename, max_height)
+    if data:
+        pil = Image.open(io.BytesIO(data))
+    else:
+        fd, path = tempfile.mkstemp(prefix="ojo_folder_thumbnail_")
+        os.close(fd)
+        try:
+            thumbnail(filename, path, 3 * height, height)
+            pil = Image.open(path)
+            pil.load()
+        finally:
+            os.unlink(path)
+    # thumbs are saved auto-rotated already
+    pil.thumbnail((max_width, max_height), Image.ANTIALIAS)
+    return pil
+
+
+def orientation_swaps_dimensions(orientation):
+    """Whether auto-rotating for this EXIF orientation turns width into height and vice versa"""
+    if isinstance(orientation, str):
+        return "otate 90" in orientation or "otate 270" in orientation
+    return orientation in (5, 6, 7, 8)
+
+
 def auto_rotate_pil(orientation, im):
     """
     From exiftool documentation
@@ -416,17 +598,27 @@ def auto_rotate_pixbuf(orientation, im):
 
 
 def pil_to_pixbuf(pil_image):
-    if pil_image.mode != "RGB":  # Fix IOError: cannot write mode P as PPM
-        pil_image = pil_image.convert("RGB")
-    buff = io.StringIO()
-    pil_image.save(buff, "ppm")
-    contents = buff.getvalue()
-    buff.close()
-    loader = GdkPixbuf.PixbufLoader()
-    loader.write(contents)
-    pixbuf = loader.get_pixbuf()
-    loader.close()
-    return pixbuf
+    """
+    Copies the raw RGB(A) pixels of a PIL image into a GdkPixbuf, with no encoding round trip.
+    This is not zero-copy: tobytes() copies the pixels out of PIL, and GLib.Bytes.new copies them
+    again, as PyGObject has no way to hand a Python buffer over to GLib.
+    """
+    if pil_image.mode not in ("RGB", "RGBA"):
+        has_alpha = "A" in pil_image.mode or "transparency" in pil_image.info
+        pil_image = pil_image.convert("RGBA" if has_alpha else "RGB")
+    has_alpha = pil_image.mode == "RGBA"
+    width, height = pil_image.size
+    # tobytes() gives tightly packed rows, so the rowstride is just the row size
+    rowstride = width * (4 if has_alpha else 3)
+    return GdkPixbuf.Pixbuf.new_from_bytes(
+        GLib.Bytes.new(pil_image.tobytes()),
+        GdkPixbuf.Colorspace.RGB,
+        has_alpha,
+        8,
+        width,
+        height,
+        rowstride,
+    )
 
 
 def pil_to_base64(pil_image):
@@ -442,10 +634,122 @@ def pixbuf_from_data(data):
     return GdkPixbuf.Pixbuf.new_from_stream(input_str, None)
 
 
+def pixbuf_from_data_at_size(
+    data, data_width, data_height, width=None, height=None, orientation=None
+):
+    """
+    Like pixbuf_from_file_at_size, for encoded image data of a known size.
+    :return: the pixbuf, not yet auto-rotated
+    """
+    if width is not None and orientation_swaps_dimensions(orientation):
+        width, height = height, width
+    if width is None or (data_width <= width and data_height <= height):
+        return pixbuf_from_data(data)
+    stream = Gio.MemoryInputStream.new_from_bytes(GLib.Bytes.new(data))
+    return GdkPixbuf.Pixbuf.new_from_stream_at_scale(stream, width, height, True, None)
+
+
 def pixbuf_from_file(filename):
     return GdkPixbuf.Pixbuf.new_from_file(filename)
 
 
+def pixbuf_from_file_at_size(filename, width=None, height=None, orientation=None):
+    """
+    Decodes filename directly at the size that fits into width x height once auto-rotated, so
+    the full resolution is never allocated (the JPEG loader decodes at 1/2, 1/4 or 1/8 scale).
+    Never enlarges. Without a box, decodes at full size.
+    :return: the pixbuf, not yet auto-rotated
+    """
+    if width is None:
+        return GdkPixbuf.Pixbuf.new_from_file(filename)
+    if orientation_swaps_dimensions(orientation):
+        width, height = height, width
+    file_format, file_width, file_height = GdkPixbuf.Pixbuf.get_file_info(filename)
+    if file_format is not None and file_width <= width and file_height <= height:
+        return GdkPixbuf.Pixbuf.new_from_file(filename)
+    return GdkPixbuf.Pixbuf.new_from_file_at_scale(filename, width, height, True)
+
+
+class Animation:
+    """
+    The frames of an animated image, decoded once. Scaled renditions are built from these frames
+    without going back to the file.
+    """
+
+    def __init__(self, frames=None, unscaled=None, unscaled_bytes=0):
+        self.frames = frames  # [(PIL image, duration in ms)]
+        self.unscaled = unscaled  # GdkPixbuf.PixbufAnimation, when frames were too big to keep
+        self.unscaled_bytes = unscaled_bytes  # what GdkPixbuf decodes for unscaled
+        self.scaled = None
+        self.scaled_size = None
+        self.scaled_bytes = 0
+        self.lock = threading.Lock()
+
+    def get_bytes(self):
+        """Pixel bytes of the decoded frames and of the current scaled rendition"""
+        frames = sum(f.size[0] * f.size[1] * 4 for f, _ in self.frames) if self.frames else 0
+        return frames + self.unscaled_bytes + self.scaled_bytes
+
+    def scaled_to(self, width, height):
+        """:return: a looping GdkPixbuf animation of the given size"""
+        if self.frames is None:
+            return self.unscaled
+        with self.lock:
+            if self.scaled_size != (width, height):
+                # PixbufSimpleAnim plays at a fixed rate, so longer frames are added repeatedly;
+                # add_frame only keeps a reference, repeats cost no pixel memory
+                tick = max(
+                    ANIMATION_MIN_TICK_MS, reduce(gcd, [duration for _, duration in self.frames])
+                )
+                anim = GdkPixbuf.PixbufSimpleAnim.new(width, height, 1000.0 / tick)
+                anim.set_loop(True)
+                scaled_bytes = 0
+                for frame, duration in self.frames:
+                    if frame.size != (width, height):
+                        frame = frame.resize((width, height), Image.BILINEAR)
+                    pixbuf = pil_to_pixbuf(frame)
+                    scaled_bytes += pixbuf.get_rowstride() * pixbuf.get_height()
+                    for _ in range(max(1, int(round(float(duration) / tick)))):
+                        anim.add_frame(pixbuf)
+                self.scaled = anim
+                self.scaled_size = width, height
+                self.scaled_bytes = scaled_bytes
+            return self.scaled
+
+
+def load_animation(filename):
+    """
+    Decodes all frames of an animated image.
+    :return: an Animation, or None if filename is a static image
+    """
+    try:
+        im = Image.open(filename)
+        animated = getattr(im, "is_animated", False)
+    except IOError:
+        im = None  # e.g. MNG, which only GdkPixbuf reads
+    if im is None:
+        anim = GdkPixbuf.PixbufAnimation.new_from_file(filename)
+        if anim.is_static_image():
+            return None
+        # the frame count is unknown here, count at least the composited frame
+        return Animation(unscaled=anim, unscaled_bytes=anim.get_width() * anim.get_height() * 4)
+    if not animated:
+        return None
+
+    frame_bytes = im.size[0] * im.size[1] * 4
+    if frame_bytes * im.n_frames > ANIMATION_MAX_BYTES:
+        return Animation(
+            unscaled=GdkPixbuf.PixbufAnimation.new_from_file(filename),
+            unscaled_bytes=frame_bytes * im.n_frames,
+        )
+    frames = []
+    for frame in ImageSequence.Iterator(im):
+        # browsers play frames without a duration, or of 10 ms or less, at 10 fps, so do we
+        duration = int(frame.info.get("duration") or 0)
+        frames.append((frame.convert("RGBA"), duration if duration > 10 else 100))
+    return Animation(frames=frames)
+
+
 def pixbuf_to_b64(pixbuf):
     return pixbuf.save_to_bufferv("png", [], [])[1].encode("base64").replace("\n", "")
 
@@ -482,5 +786,7 @@ def is_image(filename):
         return False
 
 
-def list_images(folder):
-    return list(filter(is_image, [os.path.join(folder, f) for f in os.listdir(folder)]))
+def list_images(folder, snapshot=None):
+    """:param snapshot: a FolderSnapshot of folder, taken here if not given"""
+    snapshot = snapshot or FolderSnapshot(folder)
+    return snapshot.files(get_supported_image_extensions())
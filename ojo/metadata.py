@@ -1,10 +1,16 @@
 import logging
 import os
+import threading
+from collections import OrderedDict
 from datetime import datetime
 
 from ojo.util import ext
 
 from ojo import imaging
+from ojo.metastore import meta_store
+
+# files per exiftool -execute when reading metadata in bulk
+BATCH_SIZE = 200
 
 
 def needs_rotation(meta):
@@ -12,32 +18,211 @@ def needs_rotation(meta):
     return "otate 90" in orientation or "otate 270" in orientation
 
 
+# the EXIF tags the file info line and the EXIF date sorting need, kept in the summary
+SUMMARY_TAGS = (
+    "DateTimeOriginal",
+    "ExposureTime",
+    "FNumber",
+    "ISO",
+    "FocalLength",
+    "Model",
+    "LensType",
+)
+
+
+class MetaSummary:
+    """
+    The fields of a metadata record that browsing needs all the time, in a compact form.
+    The full EXIF is cached apart and may get evicted, see Metadata.get_exif.
+    Fields can also be read like in the records, e.g. meta["width"].
+    """
+
+    __slots__ = (
+        "path",
+        "filename",
+        "needs_rotation",
+        "width",
+        "height",
+        "orientation",
+        "file_date",
+        "file_size",
+        "has_exif",
+        "tags",
+    )
+
+    def __init__(self, path, record):
+        self.path = path
+        self.filename = record["filename"]
+        self.needs_rotation = record["needs_rotation"]
+        self.width = record["width"]
+        self.height = record["height"]
+        self.orientation = record["orientation"]
+        self.file_date = record["file_date"]
+        self.file_size = record["file_size"]
+        exif = record.get("exif") or {}
+        self.has_exif = bool(exif)
+        self.tags = tuple(exif.get(tag, {}).get("val") for tag in SUMMARY_TAGS)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def tag(self, name):
+        """The value of one of the SUMMARY_TAGS, None if the file doesn't have it"""
+        return self.tags[SUMMARY_TAGS.index(name)]
+
+    def get_tags(self):
+        """:return: dict of the SUMMARY_TAGS the file has, to their values"""
+        return {tag: value for tag, value in zip(SUMMARY_TAGS, self.tags) if value is not None}
+
+
+def _exif_size(exif):
+    """Rough estimate of the memory held by an exif dict, each tag is a dict of desc and val"""
+    return sum(
+        250 + len(key) + sum(len(str(v)) for v in value.values())
+        if isinstance(value, dict)
+        else 100 + len(key) + len(str(value))
+        for key, value in exif.items()
+    )
+
+
 class Metadata:
-    def __init__(self):
-        self.cache = {}
+    """
+    Metadata of images, as LRU caches: the summaries bounded by their count, and the much bigger
+    full EXIF dicts bounded by their estimated bytes.
+    """
+
+    def __init__(self, max_entries=20000, max_exif_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_exif_bytes = max_exif_bytes
+        self.cache = OrderedDict()  # path -> MetaSummary, least recently used first
+        self.exif_cache = OrderedDict()  # path -> (exif dict, estimated bytes)
+        self.exif_bytes = 0
+        self.lock = threading.RLock()
+
+    def set_limits(self, max_entries, max_exif_bytes):
+        with self.lock:
+            self.max_entries = max_entries
+            self.max_exif_bytes = max_exif_bytes
+            self._evict()
 
     def clear_cache(self):
-        self.cache.clear()
+        with self.lock:
+            self.cache.clear()
+            self.exif_cache.clear()
+            self.exif_bytes = 0
+
+    def _evict(self):
+        while len(self.cache) > max(1, self.max_entries):
+            self.cache.popitem(last=False)
+        while self.exif_bytes > self.max_exif_bytes and len(self.exif_cache) > 1:
+            _, (exif, size) = self.exif_cache.popitem(last=False)
+            self.exif_bytes -= size
+
+    def _remember(self, filename, record):
+        summary = MetaSummary(filename, record)
+        exif = record.get("exif")
+        with self.lock:
+            self.cache.pop(filename, None)
+            self.cache[filename] = summary
+            if exif:
+                old = self.exif_cache.pop(filename, None)
+                if old:
+                    self.exif_bytes -= old[1]
+                size = _exif_size(exif)
+                self.exif_cache[filename] = exif, size
+                self.exif_bytes += size
+            self._evict()
+        return summary
 
     def get(self, filename):
-        # check cache
-        meta = self.cache.get(filename)
-        if meta:
-            return meta
+        """:return: the MetaSummary of filename"""
+        summary = self.get_cached(filename)
+        if summary:
+            return summary
+        return self._remember(filename, self.load(filename))
+
+    def get_cached(self, filename):
+        with self.lock:
+            summary = self.cache.get(filename)
+            if summary is not None:
+                self.cache.move_to_end(filename)
+            return summary
+
+    def get_exif(self, filename):
+        """The full EXIF dict of filename, read again from the store or exiftool if evicted"""
+        with self.lock:
+            item = self.exif_cache.get(filename)
+            if item is not None:
+                self.exif_cache.move_to_end(filename)
+                return item[0]
+        summary = self.get_cached(filename)
+        if summary is not None and not summary.has_exif:
+            return {}
+        record = self.load(filename)
+        self._remember(filename, record)
+        return record.get("exif") or {}
+
+    def load(self, filename):
+        """Reads the full metadata record of filename, bypassing the in-memory caches"""
+        # first the records persisted by earlier runs
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            stat = None
+        if stat is not None:
+            meta = meta_store.lookup(filename, stat)
+            if meta:
+                return meta
 
         # try to read actual metadata
         meta = self.read(filename)
         if meta:
-            self.cache[filename] = meta
+            if stat is not None:
+                meta_store.put(filename, stat, meta)
             return meta
 
-        # no metadata, fallback to pixbuf method
-        meta = self.read_via_pixbuf(filename)
-        self.cache[filename] = meta
-        return meta
+        # no metadata, fallback to pixbuf method - not persisted, exiftool may do better next time
+        return self.read_via_pixbuf(filename)
 
-    def get_cached(self, filename):
-        return self.cache.get(filename, None)
+    def prefetch(self, filenames, batch_size=BATCH_SIZE):
+        """
+        Loads the metadata of the files that are not cached yet, from the persistent store or
+        else in batches, one exiftool round trip per batch. Files exiftool can't read are left
+        to get().
+        """
+        stats = {}
+        for f in filenames:
+            if f not in self.cache:
+                try:
+                    stats[f] = os.stat(f)
+                except OSError:
+                    pass
+        for filename, record in meta_store.lookup_many(stats).items():
+            self._remember(filename, record)
+
+        if imaging.exiftool is None or not imaging.exiftool.running:
+            return
+        pending = [f for f in stats if f not in self.cache]
+        for i in range(0, len(pending), batch_size):
+            batch = pending[i : i + batch_size]
+            try:
+                found = {
+                    os.path.normpath(meta["SourceFile"]): meta
+                    for meta in imaging.exiftool.get_metadata_batch(batch)
+                }
+            except Exception:
+                logging.exception("Could not read meta-info for a batch of %d files", len(batch))
+                continue
+            for filename in batch:
+                meta = found.get(os.path.normpath(filename))
+                if meta is not None and "Error" not in meta:
+                    result = self.parse(filename, meta)
+                    if result:
+                        self._remember(filename, result)
+                        meta_store.put(filename, stats[filename], result)
 
     def read_via_pixbuf(self, filename):
         w, h = imaging.get_size_via_pixbuf(filename)
@@ -58,8 +243,14 @@ class Metadata:
             if imaging.exiftool is None or not imaging.exiftool.running:
                 return None
 
-            meta = imaging.exiftool.get_metadata(filename)
+            return self.parse(filename, imaging.exiftool.get_metadata(filename))
+        except Exception:
+            logging.exception("Could not parse meta-info for %s" % filename)
+            return None
 
+    def parse(self, filename, meta):
+        """Builds our metadata dict out of exiftool's JSON for filename"""
+        try:
             meta["SourceFile"] = {"desc": "Source File", "val": meta["SourceFile"]}
 
             # also cache the most important part
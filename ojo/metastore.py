@@ -0,0 +1,178 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+
+from ojo.thumbindex import is_deleted
+
+# bump when the shape of Metadata records changes, older records are then read again
+RECORD_VERSION = 1
+
+
+def get_store_path():
+    return os.path.expanduser("~/.config/ojo/cache/metadata.db")
+
+
+class MetaStore:
+    """
+    Persistent SQLite store of parsed metadata records (see Metadata.parse), keyed by path.
+    Records carry the size and mtime_ns of the file they were read from and are only returned
+    while these still match. Writes are queued and committed in batches by a background thread,
+    so reading metadata never waits on the disk.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or get_store_path()
+        self.lock = threading.Lock()
+        self.conn = None
+        self.pending = queue.Queue()
+        self.writer = None
+
+    def _connect(self):
+        if self.conn is None:
+            folder = os.path.dirname(self.db_path)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS metadata ("
+                "  path TEXT PRIMARY KEY,"
+                "  size INTEGER NOT NULL,"
+                "  mtime_ns INTEGER NOT NULL,"
+                "  version INTEGER NOT NULL,"
+                "  record TEXT NOT NULL)"
+            )
+            self.conn.commit()
+        return self.conn
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def lookup(self, path, stat):
+        """:return: the record of path if it is still valid for stat, else None"""
+        return self.lookup_many({path: stat}).get(path)
+
+    def lookup_many(self, stats):
+        """
+        :param stats: dict of path -> os.stat result
+        :return: dict of path -> record, only for the paths with a valid record
+        """
+        found = {}
+        paths = list(stats)
+        try:
+            with self.lock:
+                conn = self._connect()
+                for i in range(0, len(paths), 500):  # stay below SQLite's variable limit
+                    chunk = paths[i : i + 500]
+                    rows = conn.execute(
+                        "SELECT path, size, mtime_ns, version, record FROM metadata "
+                        "WHERE path IN (%s)" % ",".join("?" * len(chunk)),
+                        chunk,
+                    ).fetchall()
+                    for path, size, mtime_ns, version, record in rows:
+                        stat = stats[path]
+                        if (
+                            version == RECORD_VERSION
+                            and size == stat.st_size
+                            and mtime_ns == stat.st_mtime_ns
+                        ):
+                            found[path] = record
+        except sqlite3.Error:
+            logging.exception("MetaStore: could not look up %d files", len(paths))
+            return {}
+
+        result = {}
+        for path, record in found.items():
+            try:
+                result[path] = json.loads(record)
+            except ValueError:
+                continue
+        return result
+
+    def put(self, path, stat, record):
+        """Queues record for writing, returns immediately"""
+        try:
+            data = json.dumps(record)
+        except (TypeError, ValueError):
+            logging.warning("MetaStore: can't store the metadata of %s", path)
+            return
+        self.pending.put((path, stat.st_size, stat.st_mtime_ns, RECORD_VERSION, data))
+        with self.lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._write_pending, daemon=True)
+                self.writer.start()
+
+    def _take_pending(self, timeout):
+        rows = []
+        try:
+            rows.append(self.pending.get(timeout=timeout))
+            while True:
+                rows.append(self.pending.get_nowait())
+        except queue.Empty:
+            pass
+        return rows
+
+    def _write(self, rows):
+        try:
+            self._insert(rows)
+        finally:
+            for _ in rows:
+                self.pending.task_done()
+
+    def _insert(self, rows):
+        try:
+            with self.lock:
+                conn = self._connect()
+                conn.executemany(
+                    "INSERT OR REPLACE INTO metadata (path, size, mtime_ns, version, record) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+                conn.commit()
+        except sqlite3.Error:
+            logging.exception("MetaStore: could not store the metadata of %d files", len(rows))
+
+    def _write_pending(self):
+        # exits after a couple of idle seconds, put() starts it again
+        while True:
+            rows = self._take_pending(timeout=2)
+            if rows:
+                self._write(rows)
+                continue
+            with self.lock:
+                if self.pending.empty():
+                    self.writer = None
+                    return
+
+    def flush(self):
+        """Writes whatever is still queued, returns once the background writes are committed too"""
+        rows = self._take_pending(timeout=0)
+        if rows:
+            self._write(rows)
+        self.pending.join()
+
+    def prune(self):
+        """
+        Removes the records of deleted files, see thumbindex.is_deleted.
+        :return: the number of removed records
+        """
+        with self.lock:
+            paths = [row[0] for row in self._connect().execute("SELECT path FROM metadata")]
+        gone = [(path,) for path in paths if is_deleted(path)]
+        if gone:
+            with self.lock:
+                conn = self._connect()
+                conn.executemany("DELETE FROM metadata WHERE path = ?", gone)
+                conn.commit()
+        return len(gone)
+
+
+meta_store = MetaStore()
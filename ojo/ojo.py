@@ -32,25 +32,28 @@ import json
 import logging
 import optparse
 import os
-import queue
 import signal
 import sys
 import threading
 import time
-from collections import OrderedDict
 
-from ojo import config, imaging, ojoconfig, thumbs, util, webview
+from ojo import cachegc, config, exifthumb, imaging, ojoconfig, thumbs, tiles, util, webview
 from ojo.config import options
+from ojo.foldersnapshot import FolderSnapshot
 from ojo.imaging import folder_thumb_height, get_pixbuf, is_image, list_images
-from ojo.metadata import metadata
+from ojo.metadata import BATCH_SIZE, metadata
+from ojo.metastore import meta_store
+from ojo.pixcache import PixbufCache
+from ojo.pqueue import IndexedPriorityQueue
+from ojo.prefetch import NavigationTracker, prefetch_window
 from ojo.places import Places
-from ojo.thumbs import Thumbs
+from ojo.thumbs import THUMBHEIGHTS, Thumbs
 from ojo.util import _u, get_failed_image, ext
 
 LEVELS = (logging.ERROR, logging.WARNING, logging.INFO, logging.DEBUG)
-THUMBHEIGHTS = [80, 120, 180, 240, 320, 480]
-CACHE_SIZE = 50
 EXIF_DATE_FORMAT = "%Y:%m:%d %H:%M:%S"
+# bigger embedded previews, like the full-size JpgFromRaw of RAW files, are no quick stand-ins
+STANDIN_MAX_PIXELS = 4 * 1000 * 1000
 
 killed = False
 
@@ -116,6 +119,12 @@ class Ojo:
             action="count",
             help="set error_level output to warning, info, and then debug",
         )
+        parser.add_option(
+            "--gc-cache",
+            dest="gc_cache",
+            action="store_true",
+            help="Remove orphaned and old thumbnails to fit the cache size limit, then exit",
+        )
         parser.set_defaults(logging_level=0)
         (self.command_options, self.command_args) = parser.parse_args()
         self.command_args = [os.path.expanduser(p) for p in self.command_args]
@@ -140,6 +149,11 @@ class Ojo:
         self.parse_command_line()
         self.setup_logging()
         config.load_options()
+        metadata.set_limits(
+            options["metadata_cache_entries"], options["metadata_exif_cache_mb"] * 1024 * 1024
+        )
+        if self.command_options.gc_cache:
+            self.gc_cache_and_exit()
         imaging.start_exiftool_process(show_version=True)
 
         if len(self.command_args) >= 1 and os.path.exists(self.command_args[0]):
@@ -165,7 +179,13 @@ class Ojo:
         self.scroll_window = Gtk.ScrolledWindow()
         self.image = Gtk.Image()
         self.image.set_visible(True)
-        self.scroll_window.add_with_viewport(self.image)
+        # zoomed huge images are shown tiled instead of in self.image
+        self.tiled_view = tiles.TiledView(self, options["zoom_tile_cache_mb"] * 1024 * 1024)
+        self.image_box = Gtk.VBox()
+        self.image_box.pack_start(self.image, True, True, 0)
+        self.image_box.pack_start(self.tiled_view, False, False, 0)
+        self.image_box.set_visible(True)
+        self.scroll_window.add_with_viewport(self.image_box)
         util.make_transparent(self.scroll_window)
         util.make_transparent(self.scroll_window.get_child())
         self.scroll_window.set_visible(True)
@@ -189,11 +209,24 @@ class Ojo:
         if options["maximized"]:
             self.window.maximize()
 
-        self.pix_cache = {
-            False: OrderedDict(),
-            True: OrderedDict(),
-        }  # keyed by "zoomed" property
-        self.current_preparing = None
+        # keyed by ("zoomed" property, filename)
+        self.pix_cache = PixbufCache(
+            options["pixbuf_cache_mb"] * 1024 * 1024,
+            size_of=self.get_pix_cache_entry_bytes,
+            distance=self.get_image_distance,
+            # the zoom and fit entries of an animated image share its frames
+            shared_of=self.get_pix_cache_entry_animation,
+        )
+        self.image_positions = {}
+        self.preparing = set()  # (path, zoom) being decoded by the prefetch workers
+        self.preparing_condition = threading.Condition()
+        self.prefetch_queue = IndexedPriorityQueue()
+        self.prefetch_event = threading.Event()
+        self.prefetch_wanted = set()
+        self.navigation = NavigationTracker()
+        self.folder_snapshot = None
+        self.progressive_request = None
+        self.progressive_event = None
         self.manually_resized = False
 
         self.set_zoom(False, 0.5, 0.5)
@@ -310,12 +343,48 @@ class Ojo:
         else:
             raise Exception("Cannot open " + filename)
 
-    def refresh_image(self, filename=None):
+    def refresh_image(self, filename=None, resizing=False):
         shown = filename or self.shown
 
         if shown:
+            self.progressive_request = None
+            zoom = self.zoom
+            if self.zoom and self.should_tile(shown):
+                try:
+                    self.tiled_view.set_image(shown)
+                    self.image.clear()
+                    self.image.set_visible(False)
+                    self.tiled_view.set_visible(True)
+                    self.box.set_visible(True)
+                    return
+                except Exception:
+                    logging.exception("Could not show %s tiled", shown)
+                    # never as one full-size pixbuf, which is what tiling is there to avoid
+                    zoom = False
+            if self.tiled_view.get_visible():
+                self.tiled_view.clear()
+                self.tiled_view.set_visible(False)
+                self.image.set_visible(True)
+
+            if (
+                options["progressive_display"]
+                and self.progressive_event
+                and not self.zoom
+                and not self.is_pixbuf_cached(shown)
+            ):
+                standin = self.get_standin_pixbuf(shown)
+                if standin:
+                    self.pixbuf = standin
+                    self.increase_size()
+                    self.image.set_from_pixbuf(self.pixbuf)
+                    self.box.set_visible(True)
+                    # the full rendition replaces it when ready, unless the user moved on
+                    self.progressive_request = shown
+                    self.progressive_event.set()
+                    return
+
             try:
-                self.pixbuf = self.get_pixbuf(shown)
+                self.pixbuf = self.get_pixbuf(shown, zoom=zoom, quick=resizing)
             except Exception:
                 logging.exception("Failed to render %s", shown)
                 fallback = get_failed_image()
@@ -324,19 +393,143 @@ class Ojo:
                 else:
                     raise
 
+            self.display_pixbuf(shown)
+
+    def display_pixbuf(self, shown):
+        if shown:
             self.increase_size()
-            if ext(shown) in (".gif", ".mng", ".png"):
-                anim = GdkPixbuf.PixbufAnimation.new_from_file(shown)
-                if anim.is_static_image():
-                    self.image.set_from_pixbuf(self.pixbuf)
+            cached = self.pix_cache.get((self.zoom, shown))
+            animation = cached[3] if cached else None
+            size = self.pixbuf.get_width(), self.pixbuf.get_height()
+            if animation and (animation.frames is None or animation.scaled_size == size):
+                self.image.set_from_animation(animation.scaled_to(*size))
+            elif animation:
+                # keep showing the previous size until the frames are scaled off the UI thread
+                if animation.scaled is not None:
+                    self.image.set_from_animation(animation.scaled)
                 else:
-                    self.image.set_from_animation(anim)
+                    self.image.set_from_pixbuf(self.pixbuf)
+                self.schedule_animation_rescale(shown, animation, size)
             else:
                 self.image.set_from_pixbuf(self.pixbuf)
             self.box.set_visible(True)
 
+    @staticmethod
+    def should_tile(filename):
+        """Whether filename is too big to zoom into as a single pixbuf"""
+        if ext(filename) not in imaging.NON_RAW_FORMATS:
+            return False
+        meta = metadata.get(filename)
+        if meta["orientation"] not in (None, 1, "Horizontal (normal)"):
+            return False  # tiles are cut from the image as stored
+        pixels = (meta["width"] or 0) * (meta["height"] or 0)
+        return pixels >= options["zoom_tiles_min_megapixels"] * 1000 * 1000
+
+    def is_pixbuf_cached(self, filename, zoom=None):
+        zoom = self.zoom if zoom is None else zoom
+        cached = self.pix_cache.get((zoom, filename))
+        return cached is not None and self.covers(
+            filename, cached, zoom, self.get_max_image_width(), self.get_max_image_height()
+        )
+
+    def get_display_size(self, filename):
+        """The size Ojo.get_pixbuf will render filename at when not zoomed"""
+        meta = metadata.get(filename)
+        image_width, image_height = meta["width"], meta["height"]
+        width, height = self.get_max_image_width(), self.get_max_image_height()
+        if not options["enlarge_smaller"]:
+            width, height = min(width, image_width), min(height, image_height)
+        if width >= image_width and height >= image_height:
+            return image_width, image_height
+        if float(width) / height < float(image_width) / image_height:
+            return width, int(float(width) * image_height / image_width)
+        return int(float(height) * image_width / image_height), height
+
+    def get_standin_pixbuf(self, filename):
+        """
+        A quick rendition to show while the real one decodes, scaled to the display size: a cached
+        rendition of another size (e.g. before a resize), else the tallest cached thumbnail, else
+        the smallest preview embedded in the file that covers the display size (the biggest if none
+        does), among those of up to STANDIN_MAX_PIXELS.
+        :return: the pixbuf, or None if there is no stand-in
+        """
+        try:
+            width, height = self.get_display_size(filename)
+            cached = self.pix_cache.get((False, filename)) or self.pix_cache.get((True, filename))
+            thumb = None if cached else Thumbs.load_largest_thumbnail(filename)
+            if cached:
+                pixbuf = cached[0]
+            elif thumb:
+                pixbuf = thumb
+            else:
+                embedded = [
+                    e
+                    for e in exifthumb.find_embedded_jpegs(filename)
+                    if e[2] * e[3] <= STANDIN_MAX_PIXELS
+                ]
+                if not embedded:
+                    return None
+                orientation = metadata.get(filename)["orientation"]
+                # embedded previews are stored unrotated
+                need_width, need_height = width, height
+                if imaging.orientation_swaps_dimensions(orientation):
+                    need_width, need_height = height, width
+                covering = [e for e in embedded if e[2] >= need_width and e[3] >= need_height]
+                area = lambda e: e[2] * e[3]
+                offset, length, data_width, data_height = (
+                    min(covering, key=area) if covering else max(embedded, key=area)
+                )
+                data = exifthumb.read_embedded_jpeg(filename, offset, length)
+                pixbuf = imaging.pixbuf_from_data_at_size(
+                    data, data_width, data_height, width, height, orientation
+                )
+                pixbuf = imaging.auto_rotate_pixbuf(orientation, pixbuf)
+            return pixbuf.scale_simple(width, height, GdkPixbuf.InterpType.BILINEAR)
+        except Exception:
+            logging.exception("Could not prepare a stand-in for %s", filename)
+            return None
+
+    def start_progressive_thread(self):
+        self.progressive_event = threading.Event()
+
+        def _swap(shown, pixbuf):
+            # the user may have moved on, zoomed or resized meanwhile
+            if shown == self.shown == self.progressive_request and not self.zoom:
+                self.progressive_request = None
+                self.pixbuf = pixbuf
+                self.display_pixbuf(shown)
+
+        def _progressive_thread():
+            while not self.killed:
+                self.progressive_event.wait()
+                self.progressive_event.clear()
+                shown = self.progressive_request
+                if self.killed:
+                    return
+                if shown is None or shown != self.shown:
+                    continue
+                try:
+                    pixbuf = self.get_pixbuf(shown, zoom=False)
+                except Exception:
+                    logging.exception("Failed to render %s", shown)
+                    try:
+                        pixbuf = self.get_pixbuf(get_failed_image(), zoom=False)
+                    except Exception:
+                        logging.exception("Failed to render the failed image")
+                        continue
+                GObject.idle_add(_swap, shown, pixbuf)
+
+        OjoThread(ojo=self, target=_progressive_thread).start()
+
+    def get_folder_snapshot(self):
+        """One scan of the current folder shared by listing, sorting, grouping and stats"""
+        if self.folder_snapshot is None or self.folder_snapshot.folder != self.folder:
+            self.folder_snapshot = FolderSnapshot(self.folder)
+        return self.folder_snapshot
+
     def get_image_list(self):
-        images = list_images(self.folder)
+        self.folder_snapshot = FolderSnapshot(self.folder)
+        images = list_images(self.folder, self.folder_snapshot)
         dates = {}
         if not options["show_hidden"]:
             images = [f for f in images if not os.path.basename(f).startswith(".")]
@@ -346,14 +539,15 @@ class Ojo:
         elif options["sort_by"] == "name":
             key = lambda f: os.path.basename(f).lower()
         elif options["sort_by"] == "date":
-            key = lambda f: os.stat(f).st_mtime
+            key = self.folder_snapshot.mtime
         elif options["sort_by"] == "exif_date":
+            metadata.prefetch(images)
             dates = {
                 image: self._exif_timestamp_fallback_mtime(image) for image in images
             }
             key = lambda f: dates[f]
         elif options["sort_by"] == "size":
-            key = lambda f: os.stat(f).st_size
+            key = self.folder_snapshot.size
         else:
             key = lambda f: f
 
@@ -371,7 +565,7 @@ class Ojo:
             ext = os.path.splitext(image)[1][1:].upper()
             return ext if ext else "No extension"
         elif sort_by == "date":
-            ts = os.stat(image).st_mtime
+            ts = self.get_folder_snapshot().mtime(image)
             return self._format_date(ts)
         elif sort_by == "exif_date":
             exif_timestamp = self._exif_timestamp_fallback_mtime(image)
@@ -379,7 +573,7 @@ class Ojo:
         elif sort_by == "name":
             return os.path.basename(image)[0].upper()
         elif sort_by == "size":
-            size = os.stat(image).st_size
+            size = self.get_folder_snapshot().size(image)
             buckets = options["group_by_size_buckets"]
             return next(b[1] for b in buckets if b[0] > size)
         else:
@@ -388,8 +582,7 @@ class Ojo:
     def _exif_timestamp_fallback_mtime(self, filename):
         exif_date = None
         try:
-            m = metadata.get(filename)
-            exif_date = m["exif"].get("DateTimeOriginal", {"val": None})["val"]
+            exif_date = metadata.get(filename).tag("DateTimeOriginal")
         except:
             pass
         if exif_date:
@@ -397,7 +590,7 @@ class Ojo:
                 return datetime.strptime(exif_date, EXIF_DATE_FORMAT).timestamp()
             except:
                 logging.exception("Could not parse EXIF date")
-        return os.stat(filename).st_mtime
+        return self.get_folder_snapshot().mtime(filename)
 
     def _format_date(self, ts):
         return datetime.fromtimestamp(ts).strftime(options["date_format"])
@@ -459,6 +652,10 @@ class Ojo:
             self.folder_history_position = modify_history_position
         self.recent = ([path] + [r for r in self.recent if r != path])[:50]
         self.images = self.get_image_list()
+        self.image_positions = {img: i for i, img in enumerate(self.images)}
+        self.navigation = NavigationTracker()
+        self.prefetch_wanted = set()
+        self.prefetch_queue.clear()
         self.search_text = ""
         self.toggle_search(False, bypass_search)
         self.js('show_error("")')
@@ -508,10 +705,8 @@ class Ojo:
         def _go():
             self.thumbs.reset_queues()
             self.folder_thumbs.reset_queues()
-            self.pix_cache[False].clear()
-            self.pix_cache[True].clear()
-
-            # TODO: we may want to call metadata.clear_cache() here, or use a LRU policy for it
+            logging.info("Pixbuf cache stats: %s", self.pix_cache.stats())
+            self.pix_cache.clear()
 
             collected = gc.collect()
             logging.debug("GC collected: %d" % collected)
@@ -560,7 +755,7 @@ class Ojo:
             last_x,
             last_y,
         ):
-            GObject.idle_add(self.refresh_image)
+            GObject.idle_add(self.refresh_image, None, True)
             if time.time() - self.last_automatic_resize > 0.5:
                 logging.debug("Manually resized, stop automatic resizing")
                 self.manually_resized = True
@@ -634,9 +829,50 @@ class Ojo:
             self.folder_thumbs = thumbs.Thumbs(ojo=self)
             self.folder_thumbs.start(self)
             self.start_cache_thread()
+            self.start_progressive_thread()
+            self.tiled_view.start()
+            self.start_cache_gc_thread()
             if self.mode == "image":
                 self.cache_around()
 
+    @staticmethod
+    def gc_cache_and_exit():
+        stats = cachegc.collect(options)
+        print(
+            "Scanned %d files, removed %d orphans, %d expired and %d evicted thumbnails, "
+            "freed %.1f MB"
+            % (
+                stats["scanned"],
+                stats["orphans"],
+                stats["expired"],
+                stats["evicted"],
+                stats["freed_bytes"] / 1024.0 ** 2,
+            )
+        )
+        sys.exit(0)
+
+    def start_cache_gc_thread(self):
+        def _gc_thread():
+            # stay out of the way while the first folder gets listed and thumbnailed
+            start_time = time.time()
+            while time.time() - start_time < 60:
+                if self.killed:
+                    return
+                time.sleep(0.5)
+            if not cachegc.is_due(options["thumbs_cache_gc_interval_hours"]):
+                return
+            try:
+                # on Linux niceness is per thread
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+            except (AttributeError, OSError):
+                pass
+            try:
+                cachegc.collect(options, pause=0.05, should_stop=lambda: self.killed)
+            except Exception:
+                logging.exception("Cache GC failed")
+
+        OjoThread(ojo=self, target=_gc_thread).start()
+
     def show_loading_folder_msg(self):
         if options["sort_by"] == "exif_date":
             self.js('show_spinner("Sorting by EXIF date, please wait...")')
@@ -650,51 +886,59 @@ class Ojo:
             else [f for f in files if not os.path.basename(f).startswith(".")]
         )
 
-    def get_file_info(self, meta):
+    def get_file_info(self, meta, include_exif=False):
+        """
+        :param include_exif: whether to add the full EXIF, for the info panel of the selected
+        image only, it's big and may have to be read again
+        """
         file_date = self._format_date(meta["file_date"])
 
         try:
-            exif = meta["exif"]
-            exif_info = "{} s|F{}|ISO {}".format(
-                exif["ExposureTime"]["val"], exif["FNumber"]["val"], exif["ISO"]["val"]
-            )
+            exif = meta.get_tags()
+            exif_info = "{} s|F{}|ISO {}".format(exif["ExposureTime"], exif["FNumber"], exif["ISO"])
             if "FocalLength" in exif:
-                exif_info += "|Focal len " + exif["FocalLength"]["val"]
+                exif_info += "|Focal len " + exif["FocalLength"]
             window_width = self.window.get_window().get_width()
             if window_width >= 1400 and "Model" in exif:
-                exif_info += "|" + exif["Model"]["val"]
+                exif_info += "|" + exif["Model"]
             if window_width >= 1400 and "LensType" in exif:
-                exif_info += "|" + exif["LensType"]["val"]
+                exif_info += "|" + exif["LensType"]
         except:
             exif_info = "No EXIF info"
-        return {
+        info = {
             "filename": meta["filename"],
             "dimensions": "%d x %d" % (meta["width"], meta["height"]),
             "file_date": file_date,
             "file_size": util.human_size(meta["file_size"]),
             "exif_info": exif_info,
-            "exif": meta["exif"],
         }
+        if include_exif:
+            info["exif"] = metadata.get_exif(meta.path)
+        return info
 
     def update_selected_info(self, filename):
         if self.selected != filename or not os.path.isfile(filename):
             return
         meta = metadata.get(filename)
-        info = self.get_file_info(meta)
+        info = self.get_file_info(meta, include_exif=True)
         self.js("set_file_info('%s', %s)" % (util.path2url(filename), json.dumps(info)))
 
     def is_command(self, s):
         return s.startswith("command:")
 
+    @staticmethod
+    def parse_priority_files(argument):
+        # a list of [file url, distance from viewport] pairs, see files_needing_thumb_in_view
+        pairs = json.loads(argument)
+        return [util.url2path(p[0]) for p in pairs], [p[1] for p in pairs]
+
     @util.debounce(0.05)
     def on_priority(self, argument):
-        files = json.loads(argument)
-        self.thumbs.priority_thumbs([util.url2path(f) for f in files])
+        self.thumbs.priority_thumbs(*self.parse_priority_files(argument))
 
     @util.debounce(0.05)
     def on_priority_folders(self, argument):
-        files = json.loads(argument)
-        self.folder_thumbs.priority_thumbs([util.url2path(f) for f in files])
+        self.folder_thumbs.priority_thumbs(*self.parse_priority_files(argument))
 
     def on_browser_action(self, action, argument):
         if action in ("ojo", "ojo-select"):
@@ -974,13 +1218,7 @@ class Ojo:
             return None
 
     def list_subfolders(self):
-        return self.filter_hidden(
-            [
-                os.path.join(self.folder, f)
-                for f in sorted(os.listdir(self.folder))
-                if os.path.isdir(os.path.join(self.folder, f))
-            ]
-        )
+        return self.filter_hidden(self.get_folder_snapshot().subfolders)
 
     def build_bookmarks_category(self):
         bookmark_items = [
@@ -1280,27 +1518,34 @@ class Ojo:
 
             GObject.idle_add(_render_folders)
 
+            snapshot = self.get_folder_snapshot()
+            stats = {img: snapshot.stats[img] for img in self.images if img in snapshot.stats}
+            cached_thumbs = self.thumbs.get_cached_thumbnails(
+                thread_folder, self.images, stats
+            )
+
             pos = (
                 self.images.index(self.selected) if self.selected in self.images else 0
             )
+            pending = [
+                (img, abs(i - pos))
+                for i, img in enumerate(self.images)
+                if img not in cached_thumbs
+            ]
+            uncached = [p[0] for p in pending]
+            uncached_positions = {img: i for i, img in enumerate(uncached)}
             self.thumbs.priority_thumbs(
-                [
-                    x[1]
-                    for x in sorted(
-                        enumerate(self.images), key=lambda i_f: abs(i_f[0] - pos)
-                    )
-                    if not os.path.exists(self.thumbs.get_cached_thumbnail_path(x[1]))
-                ]
+                [p[0] for p in pending], [p[1] for p in pending]
             )
 
             folder_size = (
-                util.human_size(sum(os.stat(img).st_size for img in self.images))
-                if self.images
+                util.human_size(sum(st.st_size for st in stats.values()))
+                if stats
                 else ""
             )
             latest_date = (
-                self._format_date(max(os.stat(img).st_mtime for img in self.images))
-                if self.images
+                self._format_date(max(st.st_mtime for st in stats.values()))
+                if stats
                 else ""
             )
             self.js(
@@ -1335,8 +1580,8 @@ class Ojo:
 
                     time.sleep(0.001)
 
-                    cached = Thumbs.get_cached_thumbnail_path(img)
-                    if os.path.exists(cached):
+                    cached = cached_thumbs.get(img)
+                    if cached:
                         self.js(
                             "add_image_div('%s', '%s', %s, %s, '%s', '%s')"
                             % (
@@ -1345,7 +1590,7 @@ class Ojo:
                                 "true" if img == self.selected else "false",
                                 "true" if options["show_captions"] else "false",
                                 group if group else "",
-                                util.path2url(cached),
+                                Thumbs.thumb_url(cached),
                             )
                         )
 
@@ -1353,9 +1598,14 @@ class Ojo:
                             self.update_selected_info(img)
                     else:
                         info = None
+                        if metadata.get_cached(img) is None:
+                            # read this and the next images' metadata in one exiftool call,
+                            # their divs follow as soon as it's back
+                            i = uncached_positions[img]
+                            metadata.prefetch(uncached[i : i + BATCH_SIZE])
                         try:
                             meta = metadata.get(img)
-                            info = self.get_file_info(meta)
+                            info = self.get_file_info(meta, img == self.selected)
 
                             w, h = meta["width"], meta["height"]
                             thumb_width = float(w) * min(h, thumbh) / h
@@ -1422,62 +1672,77 @@ class Ojo:
     def cache_around(self):
         if not hasattr(self, "images") or not self.images:
             return
-        pos = self.images.index(self.selected) if self.selected in self.images else 0
-        for i in [1, -1]:
-            if pos + i < 0 or pos + i >= len(self.images):
-                continue
-            f = self.images[pos + i]
-            if f not in self.pix_cache[self.zoom]:
-                logging.info("Caching around: file %s, zoomed %s" % (f, self.zoom))
-                self.cache_queue.put((f, self.zoom))
-
-    def start_cache_thread(self):
-        self.cache_queue = queue.Queue()
-        self.preparing_event = threading.Event()
+        pos = self.image_positions.get(self.selected, 0)
+        self.navigation.moved(pos)
+        window = prefetch_window(
+            pos,
+            len(self.images),
+            self.navigation.direction(),
+            self.navigation.rate(),
+            options["prefetch_ahead"],
+            options["prefetch_behind"],
+            options["prefetch_max"],
+        )
 
-        def _reduce_to_latest(cached, count):
-            while len(cached) > count:
-                if self.killed:
-                    return
-                cached.popitem(last=False)
+        wanted = []
+        for i, priority in window:
+            f = self.images[i]
+            if self.zoom and self.should_tile(f):
+                continue  # decoding it whole is what tiles avoid
+            if not self.is_pixbuf_cached(f):
+                wanted.append(((f, self.zoom), priority))
+
+        # cancel what fell out of the window, in-flight decodes just complete
+        for key in self.prefetch_wanted - set(key for key, _ in wanted):
+            self.prefetch_queue.remove(key)
+        self.prefetch_wanted = set(key for key, _ in wanted)
+        if wanted:
+            logging.info(
+                "Caching around: %d files, zoomed %s, direction %d, %.1f images/s",
+                len(wanted),
+                self.zoom,
+                self.navigation.direction(),
+                self.navigation.rate(),
+            )
+            self.prefetch_queue.push_many(wanted)
+            self.prefetch_event.set()
 
-        def _queue_thread():
-            logging.info("Starting cache thread")
+    def start_cache_thread(self):
+        def _prefetch_worker():
             while not self.killed:
-                if len(self.pix_cache[False]) > CACHE_SIZE:
-                    _reduce_to_latest(self.pix_cache[False], CACHE_SIZE / 2)
-                if len(self.pix_cache[True]) > CACHE_SIZE:
-                    _reduce_to_latest(self.pix_cache[True], CACHE_SIZE / 2)
-
-                path, zoom = self.cache_queue.get()
-                if self.killed:
-                    return
-                if path is None:
+                try:
+                    key = self.prefetch_queue.pop()
+                except IndexError:
+                    self.prefetch_event.wait(0.5)
+                    self.prefetch_event.clear()
                     continue
 
+                path, zoom = key
+                with self.preparing_condition:
+                    if key not in self.prefetch_wanted or key in self.preparing:
+                        continue
+                    if self.is_pixbuf_cached(path, zoom):
+                        continue
+                    self.preparing.add(key)
+                logging.debug("Cache thread loads file %s, zoomed %s" % (path, zoom))
                 try:
-                    if path not in self.pix_cache[zoom]:
-                        logging.debug(
-                            "Cache thread loads file %s, zoomed %s" % (path, zoom)
-                        )
-                        self.current_preparing = path, zoom
-                        try:
-                            self.get_pixbuf(path, force=True, zoom=zoom)
-                        except Exception:
-                            logging.exception("Could not cache file " + path)
-                        finally:
-                            self.current_preparing = None
-                            self.preparing_event.set()
+                    self.get_pixbuf(path, force=True, zoom=zoom)
                 except Exception:
-                    logging.exception("Exception in cache thread:")
+                    logging.exception("Could not cache file " + path)
+                finally:
+                    with self.preparing_condition:
+                        self.preparing.discard(key)
+                        self.preparing_condition.notify_all()
 
-        OjoThread(ojo=self, target=_queue_thread).start()
+        logging.info("Starting %d cache threads", options["prefetch_workers"])
+        for _ in range(max(1, options["prefetch_workers"])):
+            OjoThread(ojo=self, target=_prefetch_worker).start()
 
     def thumb_ready(self, img, thumb_path):
         if os.path.isfile(img):
             self.js(
                 "add_image('%s', '%s')"
-                % (util.path2url(img), util.path2url(thumb_path))
+                % (util.path2url(img), Thumbs.thumb_url(thumb_path))
             )
             if img == self.selected:
                 self.select_in_browser(img)
@@ -1614,8 +1879,6 @@ class Ojo:
         options["fullscreen"] = full
         config.save_options()
 
-        self.pix_cache[False].clear()
-
         if not first_run and self.shown:
             width = height = None
             if not options["fullscreen"]:
@@ -1690,7 +1953,7 @@ class Ojo:
 
             self.update_cursor()
             self.scroll_window.set_visible(self.mode == "image")
-            self.image.set_visible(self.mode == "image")
+            self.image.set_visible(self.mode == "image" and not self.tiled_view.get_visible())
             self.browser_wrapper.set_visible(self.mode == "folder")
             self.update_margins()
             self.js("set_mode('%s')" % self.mode)
@@ -1719,10 +1982,13 @@ class Ojo:
                 logging.info("Thumb threads and processes stopped")
 
                 logging.info("Waiting for threads to finish...")
-                self.cache_queue.put((None, None))
+                self.prefetch_event.set()
+                if self.progressive_event:
+                    self.progressive_event.set()
                 while self.threads:
                     time.sleep(0.05)
                 logging.info("Threads finished")
+                meta_store.flush()
 
                 logging.info("Stopping exiftool process...")
                 imaging.stop_exiftool_process()
@@ -1990,22 +2256,32 @@ class Ojo:
 
         self.wheel_timer = GObject.timeout_add(100, _wheel)
 
-    def get_pixbuf(self, filename, force=False, zoom=None, width=None, height=None):
+    def get_pixbuf(self, filename, force=False, zoom=None, width=None, height=None, quick=False):
+        """
+        :param quick: allow stretching a smaller cached rendition instead of decoding again
+        """
         if zoom is None:
             zoom = self.zoom
 
         width = width or self.get_max_image_width()
         height = height or self.get_max_image_height()
 
-        while not force and self.current_preparing == (filename, zoom):
-            logging.info("Waiting on cache")
-            self.preparing_event.wait()
-            self.preparing_event.clear()
-        if filename in self.pix_cache[zoom]:
-            cached = self.pix_cache[zoom][filename]
-            if cached[1] == width:
-                logging.info("Cache hit: " + filename)
-                return cached[0]
+        with self.preparing_condition:
+            while not force and (filename, zoom) in self.preparing and not self.killed:
+                logging.info("Waiting on cache")
+                self.preparing_condition.wait(0.5)
+        cached = self.pix_cache.lookup(
+            (zoom, filename), lambda entry: self.covers(filename, entry, zoom, width, height)
+        )
+        if cached:
+            return self.rescale_cached(filename, cached, zoom, width, height)
+
+        if quick and not zoom:
+            cached = self.pix_cache.get((zoom, filename))
+            if cached:
+                # stretch what we have while resizing, decode properly once the size settles
+                self.schedule_high_quality_refresh()
+                return self.rescale_cached(filename, cached, zoom, width, height)
 
         meta = metadata.get(filename)
         image_width, image_height = meta["width"], meta["height"]
@@ -2018,15 +2294,125 @@ class Ojo:
             target_width = target_height = None
 
         pixbuf = get_pixbuf(filename, target_width, target_height)
+        animation = self.get_animation(filename)
+        if animation:
+            # scale the frames now, off the UI thread when we are caching ahead
+            animation.scaled_to(pixbuf.get_width(), pixbuf.get_height())
 
-        if filename in self.pix_cache[zoom]:
-            del self.pix_cache[zoom][
-                filename
-            ]  # we use OrderedDict for LRU, this makes sure filename will now be last
-        self.pix_cache[zoom][filename] = pixbuf, width, time.time()
+        self.pix_cache.put((zoom, filename), (pixbuf, width, time.time(), animation))
 
         return pixbuf
 
+    def get_rescaled_size(self, filename, pixbuf, width, height):
+        """The size of filename's rendition for a width x height box, given a cached rendition"""
+        pixbuf_width, pixbuf_height = pixbuf.get_width(), pixbuf.get_height()
+        scale = min(float(width) / pixbuf_width, float(height) / pixbuf_height)
+        if not options["enlarge_smaller"]:
+            # metadata dimensions are already in display orientation
+            full_width = metadata.get(filename)["width"]
+            if full_width:
+                scale = min(scale, float(full_width) / pixbuf_width)
+        return (
+            max(1, int(round(pixbuf_width * scale))),
+            max(1, int(round(pixbuf_height * scale))),
+        )
+
+    def covers(self, filename, entry, zoom, width, height):
+        """Whether a pix_cache entry has the pixels for a width x height box"""
+        if zoom:
+            return True  # always the full size
+        pixbuf = entry[0]
+        target_width, target_height = self.get_rescaled_size(filename, pixbuf, width, height)
+        return target_width <= pixbuf.get_width() + 1 and target_height <= pixbuf.get_height() + 1
+
+    def rescale_cached(self, filename, entry, zoom, width, height):
+        pixbuf = entry[0]
+        if zoom:
+            logging.info("Cache hit: " + filename)
+            return pixbuf
+        target_width, target_height = self.get_rescaled_size(filename, pixbuf, width, height)
+        if (
+            abs(target_width - pixbuf.get_width()) <= 1
+            and abs(target_height - pixbuf.get_height()) <= 1
+        ):
+            logging.info("Cache hit: " + filename)
+            return pixbuf
+        logging.info("Cache hit: %s, rescaled to %dx%d", filename, target_width, target_height)
+        return pixbuf.scale_simple(target_width, target_height, GdkPixbuf.InterpType.BILINEAR)
+
+    def schedule_animation_rescale(self, shown, animation, size):
+        """Scales the frames of the shown animation once resizing settles, in a worker thread"""
+        timer = getattr(self, "animation_timer", None)
+        if timer:
+            GObject.source_remove(timer)
+        zoom = self.zoom
+
+        def _show(scaled):
+            if shown == self.shown and zoom == self.zoom and self.pixbuf:
+                if (self.pixbuf.get_width(), self.pixbuf.get_height()) == size:
+                    self.image.set_from_animation(scaled)
+            return False
+
+        def _rescale():
+            scaled = animation.scaled_to(*size)
+            # scaling to another size changes what the frames weigh
+            self.pix_cache.update((zoom, shown))
+            GObject.idle_add(_show, scaled)
+
+        def _start():
+            self.animation_timer = None
+            OjoThread(ojo=self, target=_rescale).start()
+            return False
+
+        self.animation_timer = GObject.timeout_add(300, _start)
+
+    def schedule_high_quality_refresh(self):
+        timer = getattr(self, "high_quality_timer", None)
+        if timer:
+            GObject.source_remove(timer)
+
+        def _refresh():
+            self.high_quality_timer = None
+            self.refresh_image()
+            return False
+
+        self.high_quality_timer = GObject.timeout_add(300, _refresh)
+
+    @staticmethod
+    def get_pix_cache_entry_bytes(entry):
+        pixbuf = entry[0]
+        return pixbuf.get_rowstride() * pixbuf.get_height()
+
+    @staticmethod
+    def get_pix_cache_entry_animation(entry):
+        animation = entry[3]
+        return (animation, animation.get_bytes()) if animation else None
+
+    def get_image_distance(self, key):
+        """How far the image of a pix_cache key is from the selected one in the image list"""
+        position = self.image_positions.get(key[1])
+        current = self.image_positions.get(getattr(self, "selected", None))
+        if position is None or current is None:
+            return float("inf")
+        return abs(position - current)
+
+    def get_animation(self, filename):
+        """
+        The decoded frames of filename, None if it is not animated. An entry of filename in
+        pix_cache already knows, for another size or zoom mode.
+        """
+        if ext(filename) not in imaging.ANIMATED_FORMATS:
+            return None
+        for zoom in (False, True):
+            cached = self.pix_cache.get((zoom, filename))
+            if cached:
+                return cached[3]
+        try:
+            return imaging.load_animation(filename)
+        except Exception:
+            logging.exception("Could not decode the frames of %s", filename)
+            return None
+
 
 if __name__ == "__main__":
     Ojo()
@@ -0,0 +1,135 @@
+"""
+Cache of decoded image renditions, bounded by the bytes of their pixels rather than by a count:
+a handful of 4K renditions weigh as much as hundreds of small ones.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class PixbufCache:
+    """
+    Entries are evicted synchronously as soon as an insert goes over budget - those farthest from
+    the current position in the image list first, least recently used first among equals. The
+    entry just inserted is ranked like all others, so an insert farther away than everything else
+    is the one that goes; only the nearest entry stays even when it alone is over budget.
+    Without a distance, the entry just inserted is never evicted.
+
+    :param max_bytes: the budget
+    :param size_of: callable returning the bytes of an entry
+    :param distance: callable returning how far a key is from the current position, None to
+    evict by recency only
+    :param shared_of: optional callable returning (part, bytes) of an object that entries may
+    share, e.g. the frames of an animation cached for both zoom modes, or None. A part is counted
+    once, for as long as any entry holds it.
+    """
+
+    def __init__(self, max_bytes, size_of, distance=None, shared_of=None):
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        self.distance = distance
+        self.shared_of = shared_of
+        # key -> (entry, bytes, shared part), least recently used first
+        self.entries = OrderedDict()
+        self.shared = {}  # id(part) -> [part, number of entries holding it, bytes]
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Peeks at an entry, without counting a hit or miss or refreshing its recency"""
+        item = self.entries.get(key)
+        return item[0] if item else None
+
+    def lookup(self, key, valid=None):
+        """
+        Gets an entry and marks it as recently used.
+        :param valid: optional callable telling whether the entry is still usable
+        :return: the entry, or None - both counted in the hit/miss stats
+        """
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None or (valid and not valid(item[0])):
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, entry):
+        with self.lock:
+            self._remove(key)
+            size = self.size_of(entry)
+            part = self.shared_of(entry) if self.shared_of else None
+            if part:
+                part, part_bytes = part
+                shared = self.shared.setdefault(id(part), [part, 0, 0])
+                shared[1] += 1
+                # parts change, e.g. an animation scaled to another size: count what it is now
+                self.bytes += part_bytes - shared[2]
+                shared[2] = part_bytes
+            self.entries[key] = entry, size, part
+            self.bytes += size
+            if self.bytes > self.max_bytes:
+                self._evict(keep=key)
+
+    def update(self, key):
+        """Counts the bytes of an entry (and of its shared part) again, after it has changed"""
+        with self.lock:
+            item = self.entries.get(key)
+            if item:
+                self.put(key, item[0])
+
+    def discard(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def clear(self, matching=None):
+        """Removes all entries, or those whose key the matching callable accepts"""
+        with self.lock:
+            for key in list(self.entries):
+                if matching is None or matching(key):
+                    self._remove(key)
+
+    def _remove(self, key):
+        item = self.entries.pop(key, None)
+        if item:
+            self.bytes -= item[1]
+            if item[2] is not None:
+                shared = self.shared[id(item[2])]
+                shared[1] -= 1
+                if not shared[1]:
+                    del self.shared[id(item[2])]
+                    self.bytes -= shared[2]
+
+    def _evict(self, keep):
+        if self.distance:
+            # farthest first; the sort is stable, so ties stay least recently used first and the
+            # insert, being the most recent, goes last among its equals
+            candidates = sorted(self.entries, key=self.distance, reverse=True)[:-1]
+        else:
+            candidates = [key for key in self.entries if key != keep]
+        for key in candidates:
+            if self.bytes <= self.max_bytes:
+                break
+            self._remove(key)
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
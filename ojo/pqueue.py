@@ -0,0 +1,87 @@
+import heapq
+import itertools
+import threading
+
+_REMOVED = object()
+
+
+class IndexedPriorityQueue:
+    """
+    Thread-safe min-priority queue of unique items.
+    Membership checks are O(1), pushing and reprioritising an item are O(log n): a reprioritised
+    item's old heap entry is only marked as removed and skipped when it surfaces.
+    Items with equal priorities are popped in insertion order.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.entries = {}
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def _push(self, item, priority):
+        old = self.entries.get(item)
+        if old is not None:
+            old[-1] = _REMOVED
+        entry = [priority, next(self.counter), item]
+        self.entries[item] = entry
+        heapq.heappush(self.heap, entry)
+
+    def _compact(self):
+        # drop removed entries once they make up most of the heap
+        if len(self.heap) > 64 and len(self.heap) > 2 * len(self.entries):
+            self.heap = [e for e in self.heap if e[-1] is not _REMOVED]
+            heapq.heapify(self.heap)
+
+    def push(self, item, priority):
+        """Adds item, or changes its priority if already queued"""
+        with self.lock:
+            self._push(item, priority)
+            self._compact()
+
+    def push_many(self, items_priorities, keep_existing=False):
+        """
+        Pushes many (item, priority) pairs at once.
+        :param keep_existing: if True, items that are already queued keep their current priority
+        """
+        with self.lock:
+            for item, priority in items_priorities:
+                if keep_existing and item in self.entries:
+                    continue
+                self._push(item, priority)
+            self._compact()
+
+    def remove(self, item):
+        with self.lock:
+            entry = self.entries.pop(item, None)
+            if entry is not None:
+                entry[-1] = _REMOVED
+
+    def pop(self):
+        """Removes and returns the item with the lowest priority. Raises IndexError if empty."""
+        with self.lock:
+            while self.heap:
+                priority, count, item = heapq.heappop(self.heap)
+                if item is not _REMOVED:
+                    del self.entries[item]
+                    return item
+            raise IndexError("pop from an empty IndexedPriorityQueue")
+
+    def priority(self, item):
+        with self.lock:
+            entry = self.entries.get(item)
+            return entry[0] if entry is not None else None
+
+    def clear(self):
+        with self.lock:
+            self.heap = []
+            self.entries = {}
+
+    def __contains__(self, item):
+        return item in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __bool__(self):
+        return bool(self.entries)
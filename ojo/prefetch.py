@@ -0,0 +1,70 @@
+"""
+Deciding which images to decode ahead of time in image mode. The window of prefetched positions
+leans toward the direction of travel and grows with the navigation rate, so that paging quickly
+or holding an arrow key doesn't outrun the cache.
+"""
+
+import math
+import time
+from collections import deque
+
+# how far ahead in time the window should reach at the current navigation rate
+LOOKAHEAD_SECONDS = 1.5
+
+
+class NavigationTracker:
+    """Direction and rate of travel through the image list, from the recent position changes"""
+
+    def __init__(self, window_seconds=2.0):
+        self.window_seconds = window_seconds
+        self.moves = deque()  # (time, step)
+        self.position = None
+
+    def moved(self, position, now=None):
+        now = time.time() if now is None else now
+        previous, self.position = self.position, position
+        if previous is None or position == previous:
+            return
+        step = position - previous
+        if abs(step) > 1 and self.moves and (step > 0) != (self.moves[-1][1] > 0):
+            # e.g. a jump back to the start: the old direction is void, the jump is no travel
+            self.moves.clear()
+            return
+        self.moves.append((now, step))
+        self._expire(now)
+
+    def _expire(self, now):
+        while self.moves and self.moves[0][0] < now - self.window_seconds:
+            self.moves.popleft()
+
+    def direction(self, now=None):
+        """:return: 1 forward, -1 backward, 0 when unknown"""
+        self._expire(time.time() if now is None else now)
+        total = sum(step for _, step in self.moves)
+        return (total > 0) - (total < 0)
+
+    def rate(self, now=None):
+        """:return: images per second over the recent moves"""
+        self._expire(time.time() if now is None else now)
+        return sum(abs(step) for _, step in self.moves) / self.window_seconds
+
+
+def prefetch_window(position, count, direction, rate, ahead, behind, limit):
+    """
+    :param position: the current position in a list of count images
+    :param direction: as NavigationTracker.direction, unknown counts as forward
+    :param rate: as NavigationTracker.rate
+    :param ahead: images to prefetch in the direction of travel when navigating slowly
+    :param behind: images to prefetch in the opposite direction
+    :param limit: the most images to prefetch in the direction of travel
+    :return: [(position, priority)] of the window around position, lower priorities come first
+    """
+    step = -1 if direction < 0 else 1
+    forward = min(limit, max(ahead, int(math.ceil(rate * LOOKAHEAD_SECONDS))))
+    window = []
+    for i in range(1, forward + 1):
+        window.append((position + step * i, i))
+    for i in range(1, behind + 1):
+        # the way back is less likely than the next couple of images ahead
+        window.append((position - step * i, 2 * i))
+    return [(p, priority) for p, priority in window if 0 <= p < count]
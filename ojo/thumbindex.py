@@ -0,0 +1,264 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+
+_COLUMNS = (
+    "path",
+    "thumb_height",
+    "size",
+    "mtime_ns",
+    "thumb_path",
+    "status",
+    "width",
+    "height",
+    "fingerprint",
+)
+
+FINGERPRINT_BLOCK = 64 * 1024
+
+
+def get_index_path():
+    return os.path.expanduser("~/.config/ojo/cache/index.db")
+
+
+def is_deleted(path):
+    """
+    Whether path is known to be gone: only when its folder is still there, as a missing folder
+    may just be on an unmounted disk or an unreachable network share
+    """
+    return not os.path.exists(path) and os.path.isdir(os.path.dirname(path))
+
+
+def is_valid(record, stat):
+    """Checks a record against a fresh os.stat (or os.DirEntry.stat) result of its source"""
+    return (
+        record is not None
+        and stat is not None
+        and record["size"] == stat.st_size
+        and record["mtime_ns"] == stat.st_mtime_ns
+    )
+
+
+def fingerprint(path, size=None):
+    """
+    Cheap content key that survives renames, moves and copies: the file size plus an md5 of its
+    first and last blocks. Camera files differ in their headers (timestamps, counters) and in
+    their tails, so this tells different photos apart without reading them whole.
+    """
+    with open(path, "rb") as f:
+        if size is None:
+            size = os.fstat(f.fileno()).st_size
+        md5 = hashlib.md5(f.read(FINGERPRINT_BLOCK))
+        if size > FINGERPRINT_BLOCK:
+            f.seek(max(FINGERPRINT_BLOCK, size - FINGERPRINT_BLOCK))
+            md5.update(f.read(FINGERPRINT_BLOCK))
+    return "%d:%s" % (size, md5.hexdigest())
+
+
+class ThumbIndex:
+    """
+    Persistent SQLite index of generated thumbnails, keyed by (source path, thumb height).
+    Every record carries the size and mtime_ns of the source it was generated from, so callers can
+    validate it against a single stat of the source instead of hashing paths and probing the cache.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or get_index_path()
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def _connect(self):
+        if self.conn is None:
+            folder = os.path.dirname(self.db_path)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.conn.row_factory = sqlite3.Row
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS thumbs ("
+                "  path TEXT NOT NULL,"
+                "  folder TEXT NOT NULL,"
+                "  thumb_height INTEGER NOT NULL,"
+                "  size INTEGER NOT NULL,"
+                "  mtime_ns INTEGER NOT NULL,"
+                "  thumb_path TEXT,"
+                "  status TEXT NOT NULL,"
+                "  width INTEGER,"
+                "  height INTEGER,"
+                "  fingerprint TEXT,"
+                "  PRIMARY KEY (path, thumb_height))"
+            )
+            columns = [row["name"] for row in self.conn.execute("PRAGMA table_info(thumbs)")]
+            if "fingerprint" not in columns:
+                # index created before content fingerprints were recorded
+                self.conn.execute("ALTER TABLE thumbs ADD COLUMN fingerprint TEXT")
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS thumbs_folder ON thumbs (folder, thumb_height)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS thumbs_fingerprint ON thumbs (fingerprint)"
+            )
+            self.conn.commit()
+        return self.conn
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    @staticmethod
+    def _to_dict(row):
+        return {c: row[c] for c in _COLUMNS}
+
+    def lookup(self, path, thumb_height):
+        with self.lock:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT * FROM thumbs WHERE path = ? AND thumb_height = ?",
+                    (path, thumb_height),
+                )
+                .fetchone()
+            )
+        return self._to_dict(row) if row else None
+
+    def lookup_folder(self, folder, thumb_height):
+        """Returns all records for the images directly in folder, as a dict keyed by path"""
+        with self.lock:
+            rows = (
+                self._connect()
+                .execute(
+                    "SELECT * FROM thumbs WHERE folder = ? AND thumb_height = ?",
+                    (os.path.normpath(folder), thumb_height),
+                )
+                .fetchall()
+            )
+        return {row["path"]: self._to_dict(row) for row in rows}
+
+    def lookup_fingerprint(self, fingerprint):
+        """Returns the successful records of all files with the given content, in any size"""
+        with self.lock:
+            rows = (
+                self._connect()
+                .execute(
+                    "SELECT * FROM thumbs WHERE fingerprint = ? AND status = ?",
+                    (fingerprint, STATUS_OK),
+                )
+                .fetchall()
+            )
+        return [self._to_dict(row) for row in rows]
+
+    def put(
+        self,
+        path,
+        thumb_height,
+        size,
+        mtime_ns,
+        thumb_path,
+        status,
+        width=None,
+        height=None,
+        fingerprint=None,
+    ):
+        self.put_many(
+            [(path, thumb_height, size, mtime_ns, thumb_path, status, width, height, fingerprint)]
+        )
+
+    def put_many(self, records):
+        """
+        Records several thumbs in one transaction.
+        :param records: tuples of the arguments of put, in the same order
+        """
+        try:
+            with self.lock:
+                conn = self._connect()
+                conn.executemany(
+                    "INSERT OR REPLACE INTO thumbs "
+                    "(path, folder, thumb_height, size, mtime_ns, thumb_path, status, width, "
+                    "height, fingerprint) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(r[0], os.path.dirname(r[0])) + tuple(r[1:]) for r in records],
+                )
+                conn.commit()
+        except sqlite3.Error:
+            logging.exception(
+                "ThumbIndex: could not record thumbs for %s", ", ".join(set(r[0] for r in records))
+            )
+
+    def remove(self, path, thumb_height=None):
+        with self.lock:
+            conn = self._connect()
+            if thumb_height is None:
+                conn.execute("DELETE FROM thumbs WHERE path = ?", (path,))
+            else:
+                conn.execute(
+                    "DELETE FROM thumbs WHERE path = ? AND thumb_height = ?", (path, thumb_height)
+                )
+            conn.commit()
+
+    def remove_thumbs(self, thumb_paths):
+        """
+        Removes the records of the given thumbnail files.
+        :return: the number of removed records
+        """
+        thumb_paths = list(thumb_paths)
+        removed = 0
+        with self.lock:
+            conn = self._connect()
+            for i in range(0, len(thumb_paths), 500):  # stay below SQLite's variable limit
+                chunk = thumb_paths[i : i + 500]
+                removed += conn.execute(
+                    "DELETE FROM thumbs WHERE thumb_path IN (%s)" % ",".join("?" * len(chunk)),
+                    chunk,
+                ).rowcount
+            conn.commit()
+        return removed
+
+    def remove_folder(self, folder, thumb_height=None):
+        folder = os.path.normpath(folder)
+        with self.lock:
+            conn = self._connect()
+            if thumb_height is None:
+                conn.execute("DELETE FROM thumbs WHERE folder = ?", (folder,))
+            else:
+                conn.execute(
+                    "DELETE FROM thumbs WHERE folder = ? AND thumb_height = ?",
+                    (folder, thumb_height),
+                )
+            conn.commit()
+
+    def prune(self):
+        """
+        Removes the records whose source is deleted, and the successful ones whose thumbnail file
+        is deleted (e.g. evicted by the cache GC). See is_deleted.
+        :return: the number of removed records
+        """
+        with self.lock:
+            rows = (
+                self._connect()
+                .execute("SELECT path, thumb_height, thumb_path, status FROM thumbs")
+                .fetchall()
+            )
+        stale = [
+            (row["path"], row["thumb_height"])
+            for row in rows
+            if is_deleted(row["path"])
+            or (row["status"] == STATUS_OK and row["thumb_path"] and is_deleted(row["thumb_path"]))
+        ]
+        if stale:
+            with self.lock:
+                conn = self._connect()
+                conn.executemany("DELETE FROM thumbs WHERE path = ? AND thumb_height = ?", stale)
+                conn.commit()
+        return len(stale)
+
+
+thumb_index = ThumbIndex()
@@ -0,0 +1,313 @@
+"""
+Packed per-folder thumbnail storage.
+
+All thumbnails of a folder (for a given thumb height) are appended to a single pack file:
+
+    HEADER | record | record | ... | TABLE record | record | ...
+
+Every record is a fixed header (kind, name length, source size, source mtime_ns, data length),
+followed by the name (basename of the source image) and the data. THMB records carry a thumbnail,
+TABL records carry the JSON offset table of all live THMB records at the time they were written,
+followed by a footer pointing back at the TABL record. Loading a pack reads the last table via the
+footer and then only scans the records appended after it. Reads go through mmap.
+Replaced thumbnails and superseded tables are dead bytes - the pack gets rewritten with only the
+live records once these pile up.
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+
+MAGIC = b"OJOPACK1"
+FOOTER_MAGIC = b"OJOTABLE"
+THUMB = b"THMB"
+TABLE = b"TABL"
+
+_RECORD = struct.Struct("<4sIQqI")  # kind, name length, source size, source mtime_ns, data length
+_FOOTER = struct.Struct("<Q8s")  # offset of the TABL record, footer magic
+
+COMPACT_MIN_BYTES = 1024 * 1024
+COMPACT_DEAD_RATIO = 0.5
+
+
+def get_packs_dir(height):
+    return os.path.expanduser("~/.config/ojo/cache/packs/%d" % height)
+
+
+def get_pack_path(folder, height):
+    folder = os.path.normpath(folder)
+    name = hashlib.md5(folder.encode("utf-8")).hexdigest() + ".pack"
+    return os.path.join(get_packs_dir(height), name)
+
+
+class ThumbPack:
+    """
+    :param folder: the folder of the source images, lets compaction drop the thumbs of deleted
+    images
+    """
+
+    def __init__(self, path, folder=None):
+        self.path = path
+        self.folder = folder
+        self.lock = threading.RLock()
+        self.entries = {}  # name -> (data offset, data length, source size, source mtime_ns)
+        self.end = len(MAGIC)  # where the next record goes
+        self.dead = 0
+        self.table_bytes = 0  # size of the latest TABL record, it becomes dead once superseded
+        self.dirty = False
+        self.mm = None
+        self.file = None
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            self.end = os.path.getsize(self.path)  # so that _mmap maps it all
+            data = self._mmap()
+        except (OSError, ValueError):  # ValueError: empty file, mmap can't map it
+            logging.exception("ThumbPack: could not read %s", self.path)
+            self._close_mmap()
+            self.end = len(MAGIC)
+            return
+
+        if data[: len(MAGIC)] != MAGIC:
+            logging.warning("ThumbPack: %s is not a thumb pack, ignoring it", self.path)
+            self._close_mmap()
+            self.end = len(MAGIC)
+            return
+
+        scan_from = len(MAGIC)
+        if len(data) >= len(MAGIC) + _FOOTER.size:
+            table_offset, footer_magic = _FOOTER.unpack_from(data, len(data) - _FOOTER.size)
+            if footer_magic == FOOTER_MAGIC and table_offset < len(data):
+                try:
+                    self._read_table(data, table_offset)
+                    scan_from = len(data)
+                except Exception:
+                    logging.exception("ThumbPack: corrupt table in %s, rescanning", self.path)
+                    self.entries = {}
+                    self.dead = 0
+
+        self.end = self._scan(data, scan_from)
+
+    def _read_table(self, data, offset):
+        kind, name_len, _, _, data_len = _RECORD.unpack_from(data, offset)
+        if kind != TABLE:
+            raise ValueError("Footer does not point to a table")
+        start = offset + _RECORD.size + name_len
+        table = json.loads(data[start : start + data_len - _FOOTER.size].decode("utf-8"))
+        self.entries = {name: tuple(e) for name, e in table["entries"].items()}
+        self.dead = table["dead"]
+        self.table_bytes = _RECORD.size + name_len + data_len
+
+    def _scan(self, data, pos):
+        while pos + _RECORD.size <= len(data):
+            kind, name_len, size, mtime_ns, data_len = _RECORD.unpack_from(data, pos)
+            start = pos + _RECORD.size + name_len
+            if kind not in (THUMB, TABLE) or start + data_len > len(data):
+                logging.warning("ThumbPack: truncated record in %s at %d", self.path, pos)
+                break
+            if kind == THUMB:
+                name = data[pos + _RECORD.size : start].decode("utf-8")
+                self._set_entry(name, (start, data_len, size, mtime_ns))
+            else:
+                self.dead += self.table_bytes
+                self.table_bytes = _RECORD.size + name_len + data_len
+            pos = start + data_len
+        return pos
+
+    def _set_entry(self, name, entry):
+        old = self.entries.get(name)
+        if old:
+            self.dead += _RECORD.size + len(name.encode("utf-8")) + old[1]
+        self.entries[name] = entry
+
+    def _close_mmap(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _mmap(self):
+        if self.mm is None or len(self.mm) < self.end:
+            self._close_mmap()
+            self.file = open(self.path, "rb")
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.mm
+
+    def close(self):
+        with self.lock:
+            self._close_mmap()
+
+    def has(self, name, stat):
+        entry = self.entries.get(name)
+        return (
+            entry is not None and entry[2] == stat.st_size and entry[3] == stat.st_mtime_ns
+        )
+
+    def get(self, name, stat=None):
+        """Returns the thumbnail bytes for name, or None if missing or stale with respect to stat"""
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None or (stat is not None and not self.has(name, stat)):
+                return None
+            offset, length = entry[0], entry[1]
+            try:
+                return self._mmap()[offset : offset + length]
+            except (OSError, ValueError):
+                logging.exception("ThumbPack: could not read %s from %s", name, self.path)
+                return None
+
+    def _append(self, kind, name, size, mtime_ns, data):
+        name_b = name.encode("utf-8")
+        if not os.path.isfile(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "wb") as f:
+                f.write(MAGIC)
+            self.end = len(MAGIC)
+        with open(self.path, "r+b") as f:
+            f.seek(self.end)
+            f.write(_RECORD.pack(kind, len(name_b), size, mtime_ns, len(data)))
+            f.write(name_b)
+            f.write(data)
+            f.truncate()
+        start = self.end + _RECORD.size + len(name_b)
+        self.end = start + len(data)
+        return start
+
+    def add(self, name, size, mtime_ns, data):
+        with self.lock:
+            start = self._append(THUMB, name, size, mtime_ns, data)
+            self._set_entry(name, (start, len(data), size, mtime_ns))
+            self.dirty = True
+
+    def remove(self, name):
+        with self.lock:
+            entry = self.entries.pop(name, None)
+            if entry:
+                self.dead += _RECORD.size + len(name.encode("utf-8")) + entry[1]
+                self.dirty = True
+
+    def prune(self, known_names=()):
+        """
+        Removes the thumbs of source images that no longer exist. Only the names that are not
+        in known_names are checked on disk.
+        """
+        if not self.folder:
+            return
+        with self.lock:
+            known_names = set(known_names)
+            for name in list(self.entries):
+                if name not in known_names and not os.path.exists(
+                    os.path.join(self.folder, name)
+                ):
+                    self.remove(name)
+
+    def flush(self):
+        """Writes the offset table, compacting the pack first if it has too many dead bytes"""
+        with self.lock:
+            if not self.dirty:
+                return
+            if self.end > COMPACT_MIN_BYTES and self.dead > COMPACT_DEAD_RATIO * self.end:
+                self.compact()
+                return
+            self._write_table()
+
+    def _write_table(self):
+        self.dead += self.table_bytes
+        table = json.dumps({"entries": self.entries, "dead": self.dead}).encode("utf-8")
+        table_offset = self.end
+        self._append(TABLE, "", 0, 0, table + _FOOTER.pack(table_offset, FOOTER_MAGIC))
+        self.table_bytes = self.end - table_offset
+        self.dirty = False
+
+    def compact(self):
+        with self.lock:
+            self.prune()
+            logging.info(
+                "ThumbPack: compacting %s, %d of %d bytes are dead", self.path, self.dead, self.end
+            )
+            live = [(name, self.get(name), e[2], e[3]) for name, e in self.entries.items()]
+            self._close_mmap()
+            tmp_path = self.path + ".tmp"
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            old_path, self.path = self.path, tmp_path
+            self.entries = {}
+            self.dead = 0
+            self.table_bytes = 0
+            try:
+                for name, data, size, mtime_ns in live:
+                    if data is not None:
+                        self.add(name, size, mtime_ns, data)
+                self._write_table()
+            finally:
+                self.path = old_path
+            os.rename(tmp_path, self.path)
+
+
+_packs = {}
+_packs_lock = threading.Lock()
+
+
+def get_pack(folder, height):
+    path = get_pack_path(folder, height)
+    with _packs_lock:
+        pack = _packs.get(path)
+        if pack is None:
+            pack = _packs[path] = ThumbPack(path, os.path.normpath(folder))
+        return pack
+
+
+def read_thumbnail(folder, height, name, stat=None):
+    """
+    Reads one thumb without keeping its pack open: through the open pack if this process writes
+    to it, else straight from the file - e.g. in the thumbnail worker processes, which never write
+    to packs.
+    :return: the thumbnail bytes, or None if missing or stale with respect to stat
+    """
+    path = get_pack_path(folder, height)
+    with _packs_lock:
+        pack = _packs.get(path)
+    if pack is not None:
+        return pack.get(name, stat)
+    if not os.path.isfile(path):
+        return None
+    pack = ThumbPack(path)
+    try:
+        return pack.get(name, stat)
+    finally:
+        pack.close()
+
+
+def open_pack_paths():
+    with _packs_lock:
+        return set(_packs)
+
+
+def flush_packs(close=False):
+    with _packs_lock:
+        for pack in _packs.values():
+            try:
+                pack.flush()
+            except OSError:
+                logging.exception("ThumbPack: could not flush %s", pack.path)
+            if close:
+                pack.close()
+
+
+def delete_pack(folder, height):
+    path = get_pack_path(folder, height)
+    with _packs_lock:
+        pack = _packs.pop(path, None)
+        if pack:
+            pack.close()
+        if os.path.isfile(path):
+            os.unlink(path)
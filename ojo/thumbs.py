@@ -1,22 +1,71 @@
+import base64
 import hashlib
+import io
 import logging
 import multiprocessing
 import os
+import shutil
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.util import Finalize
 
-from ojo import imaging
+from ojo import imaging, thumbpack, xdgthumbs
 from ojo.config import options
-from ojo.util import _bytes, ext, get_failed_image
+from ojo.pqueue import IndexedPriorityQueue
+from ojo.thumbindex import STATUS_FAILED, STATUS_OK, fingerprint, is_valid, thumb_index
+from ojo.util import _bytes, ext, get_failed_image, path2url
 
 POOL_SIZE = max(1, multiprocessing.cpu_count() - 1)
 
+# the thumb heights the user can switch between
+THUMBHEIGHTS = [80, 120, 180, 240, 320, 480]
+
+
+def _init_worker(worker_options, log_level):
+    """Initializer of the thumbnail worker processes: each gets its own ExifTool"""
+    logging.basicConfig(level=log_level, format="%(asctime)s %(levelname)s %(message)s")
+    options.update(worker_options)
+    imaging.start_exiftool_process()
+    Finalize(None, imaging.stop_exiftool_process, exitpriority=10)
+
+
+class CancelToken:
+    """
+    Tells a thumbnail job whether it is still wanted. It is set when the app is exiting, or when
+    the user left the folder the job was submitted for (the shared generation counter moved on).
+    Quacks like the multiprocessing.Event it wraps, and pickles along with its manager proxies.
+    """
+
+    def __init__(self, kill_event, generation, token):
+        self.kill_event = kill_event
+        self.generation = generation
+        self.token = token
+
+    def is_set(self):
+        return self.kill_event.is_set() or self.generation.value != self.token
+
 
 def _safe_thumbnail(filename, cached, width, height, kill_event):
+    """
+    :param kill_event: a CancelToken (or Event), checked between the stages of the job
+    :return: (filename, thumb path, content fingerprint); thumb path is None if the job was
+    cancelled, the fingerprint is None for folders and unreadable files
+    """
+    content = None
+    if not kill_event.is_set() and os.path.isfile(filename):
+        # read here in the worker, once for both the reuse lookup and the index
+        try:
+            content = fingerprint(filename)
+        except OSError:
+            pass
+    return _thumbnail(filename, cached, width, height, kill_event, content) + (content,)
+
+
+def _thumbnail(filename, cached, width, height, kill_event, content):
     try:
         if kill_event.is_set():
-            return filename, cached
+            return filename, None
 
         if os.path.exists(cached):
             return filename, cached
@@ -26,14 +75,63 @@ def _safe_thumbnail(filename, cached, width, height, kill_event):
 
         if os.path.isdir(filename):
             return imaging.folder_thumbnail(filename, cached, width, height, kill_event)
+
+        if options.get("use_shared_thumbnails", True):
+            shared = xdgthumbs.lookup(filename, height)
+            if shared:
+                return filename, shared
+
+        if kill_event.is_set():
+            return filename, None
+
+        if (
+            options.get("reuse_thumbnails_by_content", True)
+            and not use_packs()
+            and Thumbs.reuse_thumbnails(filename, cached, height, content)
+        ):
+            return filename, cached
+
+        pyramid = Thumbs.get_pyramid_levels(filename, height)
+        if use_packs():
+            data = Thumbs.find_packed_thumbnail(filename, height + 1)
+            bigger = io.BytesIO(data) if data else None
         else:
-            return imaging.thumbnail(filename, cached, width, height)
+            bigger = Thumbs.find_thumbnail(filename, height + 1)
+        if bigger:
+            # much cheaper than decoding the original again
+            result = imaging.thumbnail_from_thumbnail(
+                filename,
+                bigger,
+                cached,
+                width,
+                height,
+                [level for level in pyramid if level[2] < height],
+            )
+        else:
+            result = imaging.thumbnail(filename, cached, width, height, pyramid)
+
+        if options.get("write_shared_thumbnails", False) and not kill_event.is_set():
+            try:
+                xdgthumbs.save_from_thumbnail(filename, cached)
+            except Exception:
+                logging.exception("Could not write shared thumbnail for %s", filename)
+
+        return result
     except:
         logging.exception("Error creating thumb for %s, using error image", filename)
         # caller will check whether the file was actually created
         return filename, get_failed_image() if os.path.isfile(filename) else None
 
 
+def use_packs():
+    return options.get("thumbs_storage") == "pack"
+
+
+def _data_uri(data):
+    mime = "image/png" if data.startswith(b"\x89PNG") else "image/jpeg"
+    return "data:%s;base64,%s" % (mime, base64.b64encode(data).decode("ascii"))
+
+
 class Thumbs:
     def __init__(self, ojo):
         self.ojo = ojo
@@ -50,31 +148,83 @@ class Thumbs:
         return os.path.expanduser("~/.config/ojo/cache/folderthumbs_%d" % height)
 
     def reset_queues(self):
-        self.queue = []
+        """
+        Drops all pending work: queued thumbs are forgotten, submitted ones that did not start yet
+        get cancelled, and running ones see their CancelToken set and stop at the next stage.
+        """
+        with self.dispatch_lock:
+            self.queue.clear()
+            self.current_generation += 1
+            self.generation.value = self.current_generation
+            # stale jobs don't count towards the concurrency limit, so the next folder's
+            # thumbnails get submitted right away
+            self.processing.clear()
+            for future in list(self.futures.values()):
+                future.cancel()
+            self.futures.clear()
+            self.log_wasted_work()
+        if use_packs():
+            thumbpack.flush_packs(close=True)
+
+    def log_wasted_work(self):
+        wasted = self.wasted
+        if wasted["cancelled"] or wasted["stale"]:
+            logging.info(
+                "%s: wasted work since the previous navigation: %d jobs cancelled before starting, "
+                "%d finished after their folder was left, taking %.2f s",
+                self,
+                wasted["cancelled"],
+                wasted["stale"],
+                wasted["stale_seconds"],
+            )
+        self.wasted = {"cancelled": 0, "stale": 0, "stale_seconds": 0.0}
 
     def stop(self):
         self.killed = True
         with self.lock:
-            self.queue = []
+            self.queue.clear()
             self.kill_event.set()
-            self.thumbs_event.set()
+            if self.dispatch_timer:
+                self.dispatch_timer.cancel()
             if self.pool:
-                logging.info("%s: Shutting down ThreaPoolExecutor...", self)
+                logging.info("%s: Shutting down %s...", self, type(self.pool).__name__)
                 self.pool.shutdown(wait=True)
                 self.pool = None
                 self.thread.join()
                 logging.info("%s: Stopped", self)
+            thumbpack.flush_packs(close=True)
 
     def init_pool(self):
         with self.lock:
-            self.pool = ThreadPoolExecutor(max_workers=POOL_SIZE)
+            if options.get("thumbs_engine", "process") == "thread":
+                # all workers share the global imaging.exiftool of the main process
+                self.pool = ThreadPoolExecutor(max_workers=POOL_SIZE)
+            else:
+                # GTK is multithreaded, so don't fork it - spawn clean worker processes instead
+                self.pool = ProcessPoolExecutor(
+                    max_workers=POOL_SIZE,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(dict(options), logging.getLogger().getEffectiveLevel()),
+                )
 
     def start(self, ojo):
-        self.queue = []
-        self.processing = set()
+        # priorities are tuples: (0, -epoch, distance) for files reported as in or near the viewport,
+        # newest report first, then (1, sequence) for everything else in the order it was enqueued
+        self.queue = IndexedPriorityQueue()
+        self.priority_epoch = 0
+        self.enqueue_sequence = 0
+        self.processing = {}  # image -> generation it was submitted in
+        self.futures = {}  # image -> future of its thumbnail job
+        self.wasted = {"cancelled": 0, "stale": 0, "stale_seconds": 0.0}
         self.pool = None
-        self.kill_event = multiprocessing.Manager().Event()
-        self.thumbs_event = threading.Event()
+        self.manager = multiprocessing.Manager()
+        self.kill_event = self.manager.Event()
+        # bumped on every folder change, jobs of older generations are stale
+        self.current_generation = 0
+        self.generation = self.manager.Value("i", 0)
+        self.dispatch_lock = threading.RLock()
+        self.dispatch_timer = None
 
         def _thumbs_thread():
             # delay the start to give the caching thread some time to prepare next images
@@ -93,40 +243,8 @@ class Thumbs:
             except Exception:
                 logging.exception("Could not create cache dir %s" % cache_dir)
 
-            logging.info("Starting thumbs thread")
-
-            while True:
-                if self.killed:
-                    return
-                self.thumbs_event.wait(timeout=0.5)
-                self.thumbs_event.clear()
-                if self.killed:
-                    return
-
-                while self.queue:
-                    if self.killed:
-                        return
-
-                    if len(self.processing) >= POOL_SIZE:
-                        break
-
-                    # pause thumbnailing while the user is actively cycling images:
-                    while time.time() - self.ojo.last_action_time < 1 and self.ojo.mode == "image":
-                        if self.killed:
-                            return
-                        time.sleep(0.2)
-
-                    # make the cycle less tight
-                    time.sleep(0.05)
-
-                    try:
-                        img = self.queue.pop(0)
-                        self.add_thumbnail(img)
-                    except IndexError:
-                        # caused by queue being modified, ignore
-                        pass
-                    except Exception:
-                        logging.exception("Exception in thumbs thread:")
+            logging.info("Thumbs pool started")
+            self.dispatch()
 
         from ojo.ojo import OjoThread
 
@@ -134,18 +252,78 @@ class Thumbs:
         if not self.killed:
             self.thread.start()
 
-    def priority_thumbs(self, files):
+    def get_concurrency_limit(self):
+        """
+        The policy for yielding to interactive image viewing: while the user has been cycling
+        images within the last thumbs_yield_seconds, only thumbs_workers_while_viewing thumbnails
+        may be in progress, so decoding the shown images gets the CPU.
+        :return: (max thumbs in progress, seconds after which the limit should be re-evaluated)
+        """
+        if self.ojo.mode == "image":
+            idle_for = time.time() - self.ojo.last_action_time
+            yield_seconds = options.get("thumbs_yield_seconds", 1)
+            if idle_for < yield_seconds:
+                return options.get("thumbs_workers_while_viewing", 0), yield_seconds - idle_for
+        return POOL_SIZE, None
+
+    def dispatch(self):
+        """
+        Submits queued thumbs to the pool until the concurrency limit is reached.
+        Called whenever the queue changes and whenever a thumb finishes, so the pool stays saturated.
+        """
+        with self.dispatch_lock:
+            if self.killed or not self.pool:
+                return
+
+            limit, recheck_in = self.get_concurrency_limit()
+            while len(self.processing) < limit:
+                try:
+                    img = self.queue.pop()
+                except IndexError:
+                    break
+                try:
+                    self.add_thumbnail(img)
+                except Exception:
+                    logging.exception("Exception while dispatching thumb for %s:", img)
+
+            if recheck_in and self.queue and not self.dispatch_timer:
+                self._schedule_dispatch(recheck_in)
+
+    def _schedule_dispatch(self, delay):
+        from ojo.ojo import OjoTimer
+
+        def _dispatch():
+            self.dispatch_timer = None
+            self.dispatch()
+
+        self.dispatch_timer = OjoTimer(ojo=self.ojo, interval=delay, function=_dispatch)
+        self.dispatch_timer.start()
+
+    def priority_thumbs(self, files, distances=None):
+        """
+        Moves files to the front of the queue, ahead of all earlier priority requests.
+        :param files: files to prioritize
+        :param distances: optional distances of the files from the viewport, closer ones go first.
+        By default files are prioritized in the given order.
+        """
         if self.killed:
             return
-        pq = set(files)
-        self.queue = files + [f for f in self.queue if f not in pq]
-        self.thumbs_event.set()
+        self.priority_epoch += 1
+        epoch = self.priority_epoch
+        if distances is None:
+            distances = range(len(files))
+        self.queue.push_many((f, (0, -epoch, d)) for f, d in zip(files, distances))
+        self.dispatch()
 
     def enqueue(self, files):
         if self.killed:
             return
-        self.queue = self.queue + [f for f in files if f not in self.queue]
-        self.thumbs_event.set()
+        start = self.enqueue_sequence
+        self.enqueue_sequence += len(files)
+        self.queue.push_many(
+            ((f, (1, start + i)) for i, f in enumerate(files)), keep_existing=True
+        )
+        self.dispatch()
 
     @staticmethod
     def get_cached_thumbnail_path(filename, force_cache=False, thumb_height=None):
@@ -169,6 +347,138 @@ class Thumbs:
             os.path.basename(filename) + "_" + hash + ".jpg",
         )  # filename + hash of the name & time
 
+    @staticmethod
+    def get_pyramid_heights():
+        return options.get("thumb_pyramid_heights") or []
+
+    @staticmethod
+    def get_pyramid_levels(filename, height):
+        """
+        :return: (thumb path, max width, max height) for each of the pyramid sizes other than
+        height that does not exist yet
+        """
+        levels = []
+        for h in Thumbs.get_pyramid_heights():
+            if h == height:
+                continue
+            path = Thumbs.get_cached_thumbnail_path(filename, force_cache=True, thumb_height=h)
+            if not os.path.exists(path):
+                levels.append((path, 3 * h, h))
+        return levels
+
+    @staticmethod
+    def get_probed_heights():
+        """
+        Heights to look for existing thumbnails at: any size the user switched through left its
+        thumbs behind, whether or not the pyramid is enabled
+        """
+        heights = set(THUMBHEIGHTS)
+        heights.update(Thumbs.get_pyramid_heights())
+        heights.add(options["thumb_height"])
+        return heights
+
+    @staticmethod
+    def find_thumbnail(filename, min_height):
+        """:return: path of the smallest existing thumbnail at least min_height tall, or None"""
+        for h in sorted(Thumbs.get_probed_heights()):
+            if h < min_height:
+                continue
+            path = Thumbs.get_cached_thumbnail_path(filename, force_cache=True, thumb_height=h)
+            if os.path.exists(path):
+                return path
+        return None
+
+    @staticmethod
+    def find_largest_thumbnail(filename):
+        """:return: path of the tallest existing thumbnail of filename, or None"""
+        for h in sorted(Thumbs.get_probed_heights(), reverse=True):
+            path = Thumbs.get_cached_thumbnail_path(filename, force_cache=True, thumb_height=h)
+            if os.path.exists(path):
+                return path
+        return None
+
+    @staticmethod
+    def find_packed_thumbnail(filename, min_height=0, largest=False):
+        """
+        find_thumbnail (or with largest, find_largest_thumbnail) for pack mode.
+        :return: the bytes of the thumbnail, or None
+        """
+        folder, name = os.path.split(filename)
+        stat = os.stat(filename)
+        heights = [h for h in Thumbs.get_probed_heights() if h >= min_height]
+        for h in sorted(heights, reverse=largest):
+            data = thumbpack.read_thumbnail(folder, h, name, stat)
+            if data:
+                return data
+        return None
+
+    @staticmethod
+    def load_largest_thumbnail(filename):
+        """:return: the tallest existing thumbnail of filename as pixbuf, or None"""
+        if use_packs():
+            data = Thumbs.find_packed_thumbnail(filename, largest=True)
+        else:
+            path = Thumbs.find_largest_thumbnail(filename)
+            if not path:
+                return None
+            with open(path, "rb") as f:
+                data = f.read()
+        return imaging.pixbuf_from_data(data) if data else None
+
+    @staticmethod
+    def reuse_thumbnails(filename, cached, height, content):
+        """
+        Looks for thumbnails of a file with the same content fingerprint under another path - the
+        same photo before a rename or move, or a copy of it - and links (or copies) them in place.
+        :param content: the fingerprint of filename
+        :return: True if the thumbnail of the requested height was reused
+        """
+        if not content:
+            return False
+        records = thumb_index.lookup_fingerprint(content)
+
+        heights = set(Thumbs.get_pyramid_heights())
+        heights.add(height)
+        sources = {}
+        for record in records:
+            h = record["thumb_height"]
+            thumb_path = record["thumb_path"]
+            if (
+                h in heights
+                and h not in sources
+                and record["path"] != filename
+                and thumb_path
+                # only our own thumbs, not shared ones or the originals of gifs
+                and thumb_path.startswith(Thumbs.get_thumbs_cache_dir(h) + os.sep)
+                and os.path.isfile(thumb_path)
+            ):
+                sources[h] = thumb_path
+        if height not in sources:
+            return False
+
+        for h, source in sources.items():
+            target = (
+                cached
+                if h == height
+                else Thumbs.get_cached_thumbnail_path(filename, force_cache=True, thumb_height=h)
+            )
+            if os.path.exists(target):
+                continue
+            try:
+                folder = os.path.dirname(target)
+                if not os.path.isdir(folder):
+                    os.makedirs(folder, exist_ok=True)
+                try:
+                    os.link(source, target)
+                except OSError:
+                    imaging._save_atomically(lambda tmp: shutil.copyfile(source, tmp), target)
+            except OSError:
+                logging.exception("Could not reuse thumb %s for %s", source, filename)
+                if h == height:
+                    return False
+        logging.debug("Reused thumbnails of identical content for %s", filename)
+        return True
+
     @staticmethod
     def get_folder_thumbnail_path(folder):
         if not os.path.isdir(folder):
@@ -190,24 +500,159 @@ class Thumbs:
             os.path.basename(folder) + "_" + hash + ".png",
         )  # filename + hash of the name
 
+    def get_cached_thumbnails(self, folder, images, stats=None):
+        """
+        Bulk lookup of the already generated thumbnails of images in folder, using the thumb index.
+        :param folder: the folder containing images
+        :param images: image paths to look up
+        :param stats: optional dict of image path -> os.stat result, to avoid stat-ing again
+        :return: dict of image path -> thumb path, only for images with a valid thumbnail
+        """
+        if use_packs():
+            return self.get_packed_thumbnails(folder, images, stats)
+
+        records = thumb_index.lookup_folder(folder, options["thumb_height"])
+        cached = {}
+        for img in images:
+            record = records.get(img)
+            if record is None or not record["thumb_path"]:
+                continue
+            try:
+                stat = stats[img] if stats is not None else os.stat(img)
+            except (KeyError, OSError):
+                continue
+            if not is_valid(record, stat):
+                continue
+            if not os.path.isfile(record["thumb_path"]):
+                # e.g. collected by the cache GC, or the cache was wiped: have it generated again
+                thumb_index.remove(img, options["thumb_height"])
+                continue
+            cached[img] = record["thumb_path"]
+        return cached
+
+    @staticmethod
+    def get_packed_thumbnails(folder, images, stats=None):
+        pack = thumbpack.get_pack(folder, options["thumb_height"])
+        cached = {}
+        for img in images:
+            try:
+                stat = stats[img] if stats is not None else os.stat(img)
+            except (KeyError, OSError):
+                continue
+            data = pack.get(os.path.basename(img), stat)
+            if data:
+                cached[img] = _data_uri(data)
+        # forget the thumbs of images deleted since, compaction reclaims their space
+        pack.prune(os.path.basename(img) for img in images)
+        return cached
+
+    @staticmethod
+    def pack_thumbnail(img, thumb_path):
+        """
+        Moves a freshly generated thumbnail file, and the pyramid levels made along with it, into
+        the packs of its folder. Returns the thumbnail as data URI.
+        """
+        folder, name = os.path.split(img)
+        stat = os.stat(img)
+        levels = [(options["thumb_height"], thumb_path)]
+        for h in Thumbs.get_pyramid_heights():
+            path = Thumbs.get_cached_thumbnail_path(img, force_cache=True, thumb_height=h)
+            if h != options["thumb_height"] and os.path.isfile(path):
+                levels.append((h, path))
+
+        for h, path in levels:
+            with open(path, "rb") as f:
+                data = f.read()
+            thumbpack.get_pack(folder, h).add(name, stat.st_size, stat.st_mtime_ns, data)
+            if path.startswith(Thumbs.get_thumbs_cache_dir(h) + os.sep):
+                # don't delete thumbs from the shared cache
+                os.unlink(path)
+            if h == options["thumb_height"]:
+                thumb_data = data
+        return _data_uri(thumb_data)
+
+    @staticmethod
+    def thumb_url(thumb):
+        """Thumbs are either paths to image files, or data URIs when served from packs"""
+        return thumb if thumb.startswith("data:") else path2url(thumb)
+
+    @staticmethod
+    def get_thumb_size(path):
+        """:return: (width, height) of a thumb from its header, (None, None) if unknown"""
+        try:
+            with open(path, "rb") as f:
+                size = imaging.get_encoded_size(f.read(64 * 1024))
+            return size if size else imaging.get_size_via_pixbuf(path)
+        except Exception:
+            return None, None
+
+    def record_thumbnail(self, img, thumb_path, status, content=None):
+        """
+        :param thumb_path: None for packed thumbnails, the index then only knows they exist
+        :param content: the fingerprint of img, as computed by the thumbnail job
+        """
+        if os.path.isdir(img):
+            return
+        try:
+            stat = os.stat(img)
+            if status != STATUS_OK:
+                content = None
+            levels = [(options["thumb_height"], thumb_path)]
+            if status == STATUS_OK and thumb_path and thumb_path != img:
+                # also index the other pyramid sizes that were created from the same decode
+                for h in self.get_pyramid_heights():
+                    path = self.get_cached_thumbnail_path(img, force_cache=True, thumb_height=h)
+                    if h != options["thumb_height"] and os.path.isfile(path):
+                        levels.append((h, path))
+
+            records = []
+            for thumb_height, path in levels:
+                width, height = self.get_thumb_size(path)
+                records.append(
+                    (
+                        img,
+                        thumb_height,
+                        stat.st_size,
+                        stat.st_mtime_ns,
+                        path,
+                        status,
+                        width,
+                        height,
+                        content,
+                    )
+                )
+            thumb_index.put_many(records)
+        except OSError:
+            logging.exception("Could not index thumb for %s", img)
+
     def on_thumb_ready(self, img, thumb_path):
-        self.processing.remove(img)
-        self.thumbs_event.set()
+        self.processing.pop(img, None)
+        self.dispatch()
         if thumb_path:
             self.ojo.thumb_ready(img, thumb_path)
 
     def on_thumb_failed(self, img, thumb_path):
-        self.processing.remove(img)
-        self.thumbs_event.set()
+        self.processing.pop(img, None)
+        self.dispatch()
         self.ojo.thumb_failed(img, thumb_path)
 
+    def on_thumb_stale(self, img, generation, seconds):
+        """A job of a folder the user already left was cancelled or finished - nobody needs it"""
+        with self.dispatch_lock:
+            if self.processing.get(img) == generation:
+                del self.processing[img]
+            if seconds is None:
+                self.wasted["cancelled"] += 1
+            else:
+                self.wasted["stale"] += 1
+                self.wasted["stale_seconds"] += seconds
+        self.dispatch()
+
     def add_thumbnail(self, img):
         th = options["thumb_height"]
         self.prepare_thumbnail(img, 3 * th, th)
 
     def prepare_thumbnail(self, filename, width, height):
-        self.processing.add(filename)
-
         is_folder = os.path.isdir(filename)
         cached = (
             self.get_folder_thumbnail_path(filename)
@@ -216,23 +661,62 @@ class Thumbs:
         )
 
         def _thumbnail_ready(future):
-            filename, thumb_path = future.result()
+            with self.dispatch_lock:
+                if self.futures.get(img) is future:
+                    del self.futures[img]
+            if future.cancelled() or generation != self.current_generation:
+                seconds = None if future.cancelled() else time.time() - submitted
+                self.on_thumb_stale(img, generation, seconds)
+                return
+
+            try:
+                filename, thumb_path, content = future.result()
+            except Exception:
+                logging.exception("Thumbnail job failed for %s", img)
+                self.on_thumb_failed(img, "Could not create thumbnail")
+                return
 
             if thumb_path is None:
                 # valid situation for folder thumbs
                 self.on_thumb_ready(filename, None)
             elif not os.path.isfile(thumb_path) or not os.path.getsize(thumb_path):
                 self.on_thumb_failed(filename, "Could not create thumbnail")
+            elif (
+                use_packs()
+                and not is_folder
+                and thumb_path not in (filename, get_failed_image())
+            ):
+                try:
+                    packed = self.pack_thumbnail(filename, thumb_path)
+                    self.record_thumbnail(filename, None, STATUS_OK, content)
+                    self.on_thumb_ready(filename, packed)
+                except Exception:
+                    logging.exception("Could not pack thumb for %s", filename)
+                    self.on_thumb_ready(filename, thumb_path)
             else:
+                self.record_thumbnail(
+                    filename,
+                    thumb_path,
+                    STATUS_FAILED if thumb_path == get_failed_image() else STATUS_OK,
+                    content,
+                )
                 self.on_thumb_ready(filename, thumb_path)
 
         if self.killed:
             return
 
-        future = self.pool.submit(_safe_thumbnail, filename, cached, width, height, self.kill_event)
+        img = filename
+        generation = self.current_generation
+        cancel_token = CancelToken(self.kill_event, self.generation, generation)
+        self.processing[filename] = generation
+        submitted = time.time()
+        future = self.pool.submit(_safe_thumbnail, filename, cached, width, height, cancel_token)
+        self.futures[filename] = future
         future.add_done_callback(_thumbnail_ready)
 
     def clear_thumbnails(self, folder):
+        thumb_index.remove_folder(folder, options["thumb_height"])
+        thumbpack.delete_pack(folder, options["thumb_height"])
         for img in imaging.list_images(folder):
             if self.killed:
                 return
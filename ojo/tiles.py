@@ -0,0 +1,388 @@
+"""
+Tiled rendering of huge images in zoom mode.
+
+Instead of decoding the whole image into one pixbuf, the zoomed view is a DrawingArea of the full
+image size inside the usual scroll window. It only converts the tiles that intersect the viewport,
+prefetches tiles ahead of the pan direction, and keeps tiles in an LRU cache with a byte budget.
+Until a tile is ready, the region is drawn from a low-resolution overview of the whole image.
+"""
+
+import logging
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+from gi.repository import Gdk, GObject, Gtk
+from PIL import Image, ImageFile
+
+from ojo import imaging
+from ojo.pqueue import IndexedPriorityQueue
+
+TILE_SIZE = 512
+OVERVIEW_SIZE = 2048
+OVERVIEW = -1  # tile x of the overview's queue item
+
+# the most the whole image of a format that can't decode partially may be reduced by
+MAX_REDUCTION = 64
+
+
+def _open(filename):
+    """
+    Image.open without its decompression bomb check: the tiled view exists precisely for images
+    beyond that limit, while it stays in place for everything else that opens images
+    """
+    Image.init()
+    with open(filename, "rb") as f:
+        prefix = f.read(16)
+    for format_id in Image.ID:
+        factory, accept = Image.OPEN[format_id]
+        result = not accept or accept(prefix)
+        if not result or isinstance(result, (str, bytes)):
+            continue
+        try:
+            return factory(filename)
+        except (SyntaxError, IndexError, TypeError, struct.error):
+            continue
+    raise IOError("Cannot identify image file %s" % filename)
+
+
+def _decode_tiles(im, box, scale=1.0):
+    """
+    Decodes the strips or tiles of an opened image that intersect box one at a time, and pastes
+    them (scaled by scale) into an image of the box - the whole image is never allocated.
+    """
+    left, top, right, bottom = box
+    region = Image.new(
+        im.mode,
+        (max(1, int(round((right - left) * scale))), max(1, int(round((bottom - top) * scale)))),
+    )
+    for codec, extents, offset, args in im.tile:
+        if not _intersects(extents, box):
+            continue
+        part = Image.new(im.mode, (extents[2] - extents[0], extents[3] - extents[1]))
+        decoder = Image._getdecoder(im.mode, codec, args, im.decoderconfig)
+        try:
+            decoder.setimage(part.im, (0, 0) + part.size)
+            im.fp.seek(offset)
+            if decoder.pulls_fd:
+                decoder.setfd(im.fp)
+                decoder.decode(b"")
+            else:
+                data = b""
+                while True:
+                    chunk = im.fp.read(ImageFile.SAFEBLOCK)
+                    if not chunk:
+                        break  # truncated, keep what we have
+                    data += chunk
+                    consumed, _ = decoder.decode(data)
+                    if consumed < 0:
+                        break
+                    data = data[consumed:]
+        finally:
+            decoder.cleanup()
+
+        x1, y1 = int(round((extents[0] - left) * scale)), int(round((extents[1] - top) * scale))
+        if scale != 1:
+            x2 = int(round((extents[2] - left) * scale))
+            y2 = int(round((extents[3] - top) * scale))
+            part = part.resize((max(1, x2 - x1), max(1, y2 - y1)), Image.BILINEAR)
+        region.paste(part, (x1, y1))
+    return region
+
+
+def _intersects(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def tile_box(size, tx, ty):
+    """:return: (left, top, right, bottom) of a tile of an image of the given size"""
+    x, y = tx * TILE_SIZE, ty * TILE_SIZE
+    return x, y, min(x + TILE_SIZE, size[0]), min(y + TILE_SIZE, size[1])
+
+
+class TileCache:
+    """LRU cache of tile pixbufs, bounded by the bytes of their pixel data"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.tiles = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _size(pixbuf):
+        return pixbuf.get_rowstride() * pixbuf.get_height()
+
+    def get(self, key):
+        with self.lock:
+            pixbuf = self.tiles.get(key)
+            if pixbuf is not None:
+                self.tiles.move_to_end(key)
+            return pixbuf
+
+    def put(self, key, pixbuf):
+        with self.lock:
+            old = self.tiles.pop(key, None)
+            if old is not None:
+                self.bytes -= self._size(old)
+            self.tiles[key] = pixbuf
+            self.bytes += self._size(pixbuf)
+            while self.bytes > self.max_bytes and len(self.tiles) > 1:
+                _, evicted = self.tiles.popitem(last=False)
+                self.bytes -= self._size(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.tiles.clear()
+            self.bytes = 0
+
+
+class RegionDecoder:
+    """
+    Decodes full-resolution regions of an image with PIL. Striped and tiled TIFFs only decode the
+    strips or tiles intersecting the region. Other formats can't decode partially, so the image
+    is decoded once, at the smallest power-of-two reduction whose pixels fit max_full_bytes, and
+    regions are cut from that - scaled back up when it had to be reduced. JPEGs decode straight
+    at the reduced scale, other formats are reduced right after decoding.
+    """
+
+    def __init__(self, filename, max_full_bytes):
+        self.filename = filename
+        self.mtime = os.path.getmtime(filename)
+        with _open(filename) as im:
+            self.size = im.size
+            self.partial = im.format == "TIFF" and len(im.tile) > 1
+            bands = len(im.getbands())
+
+        self.reduction = 1
+        if self.partial:
+            self.full_bytes = 0
+        else:
+            width, height = self.size
+            while (
+                (width // self.reduction) * (height // self.reduction) * bands > max_full_bytes
+                and self.reduction < MAX_REDUCTION
+            ):
+                self.reduction *= 2
+            self.full_bytes = (width // self.reduction) * (height // self.reduction) * bands
+        self.full = None
+        self.lock = threading.Lock()
+
+    def _get_full(self):
+        with self.lock:
+            if self.full is None:
+                im = _open(self.filename)
+                target = (
+                    max(1, self.size[0] // self.reduction),
+                    max(1, self.size[1] // self.reduction),
+                )
+                if self.reduction > 1:
+                    im.draft(im.mode, target)
+                im.load()
+                if im.size[0] >= 2 * target[0] and im.size[1] >= 2 * target[1]:
+                    im = im.reduce(min(im.size[0] // target[0], im.size[1] // target[1]))
+                self.full = im
+            return self.full
+
+    def decode(self, box):
+        if self.partial:
+            with _open(self.filename) as im:
+                region = _decode_tiles(im, box)
+        else:
+            full = self._get_full()
+            if full.size == self.size:
+                region = full.crop(box)
+            else:
+                sx = float(full.size[0]) / self.size[0]
+                sy = float(full.size[1]) / self.size[1]
+                region = full.resize(
+                    (box[2] - box[0], box[3] - box[1]),
+                    Image.BILINEAR,
+                    box=(box[0] * sx, box[1] * sy, box[2] * sx, box[3] * sy),
+                )
+        return imaging.pil_to_pixbuf(region)
+
+    def overview(self, max_size):
+        scale = min(1.0, float(max_size) / max(self.size))
+        if self.partial:
+            with _open(self.filename) as im:
+                return imaging.pil_to_pixbuf(_decode_tiles(im, (0, 0) + self.size, scale))
+        full = self.full
+        if full is not None:
+            size = max(1, int(self.size[0] * scale)), max(1, int(self.size[1] * scale))
+            return imaging.pil_to_pixbuf(full.resize(size, Image.ANTIALIAS))
+        im = _open(self.filename)
+        im.draft(None, (max_size, max_size))
+        im.thumbnail((max_size, max_size), Image.ANTIALIAS)
+        return imaging.pil_to_pixbuf(im)
+
+
+class TiledView(Gtk.DrawingArea):
+    def __init__(self, ojo, cache_bytes):
+        super().__init__()
+        self.ojo = ojo
+        self.cache_bytes = cache_bytes
+        self.cache = TileCache(cache_bytes)
+        self.decoder = None
+        self.overview = None
+        self.generation = 0
+        self.queue = IndexedPriorityQueue()
+        self.queue_event = threading.Event()
+        self.in_flight = None
+        self.last_clip = None
+        self.connect("draw", self.on_draw)
+
+    def start(self):
+        from ojo.ojo import OjoThread
+
+        OjoThread(ojo=self.ojo, target=self._worker).start()
+
+    def set_image(self, filename):
+        """Shows filename, raises if PIL can't open it"""
+        if (
+            self.decoder
+            and self.decoder.filename == filename
+            and self.decoder.mtime == os.path.getmtime(filename)
+        ):
+            return  # e.g. a resize, keep the tiles and the overview
+        # the decoded full image of non-partial formats counts against the same budget as tiles
+        decoder = RegionDecoder(filename, self.cache_bytes // 2)
+        self.generation += 1
+        self.queue.clear()
+        self.cache.clear()
+        self.cache.max_bytes = self.cache_bytes - decoder.full_bytes
+        self.overview = None
+        self.last_clip = None
+        self.decoder = decoder
+        self.set_size_request(*decoder.size)
+        self._request([((self.generation, OVERVIEW, 0), (0, 0))])
+        self.queue_draw()
+
+    def clear(self):
+        self.generation += 1
+        self.queue.clear()
+        self.cache.clear()
+        self.decoder = None
+        self.overview = None
+
+    def _request(self, items):
+        items = [(key, priority) for key, priority in items if key != self.in_flight]
+        if items:
+            self.queue.push_many(items)
+            self.queue_event.set()
+
+    def _grid(self):
+        width, height = self.decoder.size
+        return (width + TILE_SIZE - 1) // TILE_SIZE, (height + TILE_SIZE - 1) // TILE_SIZE
+
+    def on_draw(self, widget, cr):
+        if not self.decoder:
+            return False
+        x1, y1, x2, y2 = cr.clip_extents()
+        columns, rows = self._grid()
+        tx1, ty1 = max(0, int(x1 // TILE_SIZE)), max(0, int(y1 // TILE_SIZE))
+        tx2 = min(columns - 1, int((x2 - 1) // TILE_SIZE))
+        ty2 = min(rows - 1, int((y2 - 1) // TILE_SIZE))
+        center = ((tx1 + tx2) / 2.0, (ty1 + ty2) / 2.0)
+
+        missing = []
+        for ty in range(ty1, ty2 + 1):
+            for tx in range(tx1, tx2 + 1):
+                box = tile_box(self.decoder.size, tx, ty)
+                pixbuf = self.cache.get((self.generation, tx, ty))
+                if pixbuf is not None:
+                    Gdk.cairo_set_source_pixbuf(cr, pixbuf, box[0], box[1])
+                    cr.rectangle(box[0], box[1], box[2] - box[0], box[3] - box[1])
+                    cr.fill()
+                else:
+                    self._draw_overview(cr, box)
+                    distance = abs(tx - center[0]) + abs(ty - center[1])
+                    missing.append(((self.generation, tx, ty), (1, distance)))
+
+        self._request(missing + self._prefetch((tx1, ty1, tx2, ty2), (x1, y1)))
+        return False
+
+    def _prefetch(self, visible, origin):
+        """One row or column of tiles beyond the viewport, on the side we are panning towards"""
+        tx1, ty1, tx2, ty2 = visible
+        columns, rows = self._grid()
+        if self.last_clip is None or self.last_clip == origin:
+            dx = dy = 0
+        else:
+            dx = (origin[0] > self.last_clip[0]) - (origin[0] < self.last_clip[0])
+            dy = (origin[1] > self.last_clip[1]) - (origin[1] < self.last_clip[1])
+        self.last_clip = origin
+
+        wanted = set()
+        if dx:
+            tx = tx2 + 1 if dx > 0 else tx1 - 1
+            wanted.update((tx, ty) for ty in range(ty1, ty2 + 1))
+        if dy:
+            ty = ty2 + 1 if dy > 0 else ty1 - 1
+            wanted.update((tx, ty) for tx in range(tx1, tx2 + 1))
+        if not dx and not dy:
+            # standing still: prepare all around
+            for tx in range(tx1 - 1, tx2 + 2):
+                wanted.update([(tx, ty1 - 1), (tx, ty2 + 1)])
+            for ty in range(ty1, ty2 + 1):
+                wanted.update([(tx1 - 1, ty), (tx2 + 1, ty)])
+
+        return [
+            ((self.generation, tx, ty), (2, 0))
+            for tx, ty in wanted
+            if 0 <= tx < columns
+            and 0 <= ty < rows
+            and self.cache.get((self.generation, tx, ty)) is None
+        ]
+
+    def _draw_overview(self, cr, box):
+        overview = self.overview
+        if overview is None:
+            return
+        scale = float(overview.get_width()) / self.decoder.size[0]
+        cr.save()
+        cr.rectangle(box[0], box[1], box[2] - box[0], box[3] - box[1])
+        cr.clip()
+        cr.scale(1 / scale, 1 / scale)
+        Gdk.cairo_set_source_pixbuf(cr, overview, 0, 0)
+        cr.paint()
+        cr.restore()
+
+    def _worker(self):
+        while not self.ojo.killed:
+            try:
+                key = self.queue.pop()
+            except IndexError:
+                self.queue_event.wait(0.5)
+                self.queue_event.clear()
+                continue
+
+            generation, tx, ty = key
+            decoder = self.decoder
+            if generation != self.generation or decoder is None:
+                continue
+            self.in_flight = key
+            try:
+                if tx == OVERVIEW:
+                    pixbuf = decoder.overview(OVERVIEW_SIZE)
+                else:
+                    pixbuf = decoder.decode(tile_box(decoder.size, tx, ty))
+            except Exception:
+                logging.exception("Could not decode tile %s of %s", key, decoder.filename)
+                continue
+            finally:
+                self.in_flight = None
+
+            if generation != self.generation:
+                continue  # the image changed meanwhile
+            if tx == OVERVIEW:
+                self.overview = pixbuf
+            else:
+                self.cache.put(key, pixbuf)
+            GObject.idle_add(self._redraw, generation)
+
+    def _redraw(self, generation):
+        if generation == self.generation:
+            self.queue_draw()
+        return False
@@ -0,0 +1,170 @@
+"""
+Support for the freedesktop.org shared thumbnail cache (~/.cache/thumbnails), as used by Nautilus
+and most other file managers and viewers:
+https://specifications.freedesktop.org/thumbnail-spec/thumbnail-spec-latest.html
+"""
+
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+import urllib.parse
+import zlib
+
+# flavor folder names and their maximal thumbnail dimension, smallest first
+FLAVORS = [("normal", 128), ("large", 256), ("x-large", 512), ("xx-large", 1024)]
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# the characters GLib's g_filename_to_uri leaves unescaped in paths, so our URIs (and their md5
+# hashes, which are the thumbnail names) match what other applications produce
+_URI_SAFE = "/!$&'()*+,:=@"
+
+
+def get_cache_root():
+    return os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "thumbnails"
+    )
+
+
+def get_uri(filename):
+    return "file://" + urllib.parse.quote(os.path.abspath(filename), safe=_URI_SAFE)
+
+
+def get_thumbnail_path(filename, flavor):
+    name = hashlib.md5(get_uri(filename).encode("utf-8")).hexdigest() + ".png"
+    return os.path.join(get_cache_root(), flavor, name)
+
+
+def read_png_info(path):
+    """
+    Reads the header of a PNG without decoding it.
+    :return: (width, height, dict of tEXt keywords to values), or None if path is not a PNG
+    """
+    with open(path, "rb") as f:
+        if f.read(8) != PNG_SIGNATURE:
+            return None
+        width = height = None
+        text = {}
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            length, kind = struct.unpack(">I4s", header)
+            if kind == b"IDAT" or kind == b"IEND":
+                break
+            data = f.read(length)
+            f.seek(4, os.SEEK_CUR)  # CRC
+            if kind == b"IHDR":
+                width, height = struct.unpack(">II", data[:8])
+            elif kind == b"tEXt" and b"\0" in data:
+                key, value = data.split(b"\0", 1)
+                text[key.decode("latin-1")] = value.decode("latin-1")
+            elif kind == b"zTXt" and b"\0" in data:
+                key, value = data.split(b"\0", 1)
+                text[key.decode("latin-1")] = zlib.decompress(value[1:]).decode("latin-1")
+            elif kind == b"iTXt" and b"\0" in data:
+                key, rest = data.split(b"\0", 1)
+                compressed = rest[0] == 1
+                # skip compression flag and method, language tag and translated keyword
+                value = rest[2:].split(b"\0", 2)[2]
+                text[key.decode("latin-1")] = (
+                    zlib.decompress(value) if compressed else value
+                ).decode("utf-8")
+        return width, height, text
+
+
+def is_valid(thumb_info, filename, stat):
+    width, height, text = thumb_info
+    if text.get("Thumb::URI") != get_uri(filename):
+        return False
+    try:
+        if int(text["Thumb::MTime"]) != int(stat.st_mtime):
+            return False
+        if "Thumb::Size" in text and int(text["Thumb::Size"]) != stat.st_size:
+            return False
+    except (KeyError, ValueError):
+        return False
+    return True
+
+
+def lookup(filename, height, stat=None):
+    """
+    Finds a valid shared thumbnail for filename that is at least height pixels tall (or as tall as
+    the original, when it is smaller than that).
+    :return: path to the thumbnail PNG, or None
+    """
+    try:
+        stat = stat or os.stat(filename)
+    except OSError:
+        return None
+
+    for flavor, size in FLAVORS:
+        if size < height:
+            continue
+        path = get_thumbnail_path(filename, flavor)
+        try:
+            info = read_png_info(path)
+        except (OSError, ValueError, zlib.error, struct.error):
+            continue
+        if not info or not is_valid(info, filename, stat):
+            continue
+        thumb_width, thumb_height, text = info
+        try:
+            original_height = int(text.get("Thumb::Image::Height", 0))
+        except ValueError:
+            original_height = 0
+        if thumb_height >= height or (original_height and thumb_height >= original_height):
+            return path
+    return None
+
+
+def get_write_flavor(thumb_width, thumb_height):
+    """The biggest flavor that can be produced by downscaling a thumbnail of the given size"""
+    fitting = [f for f in FLAVORS if f[1] <= max(thumb_width, thumb_height)]
+    return fitting[-1] if fitting else None
+
+
+def save_from_thumbnail(filename, thumb_path):
+    """
+    Writes a spec-compliant shared thumbnail for filename, downscaled from our own thumbnail.
+    :return: path of the written shared thumbnail, or None if our thumbnail is too small for any
+    of the flavors
+    """
+    from PIL import Image, PngImagePlugin
+
+    stat = os.stat(filename)
+    image = Image.open(thumb_path)
+    flavor = get_write_flavor(*image.size)
+    if not flavor:
+        return None
+
+    name, size = flavor
+    image.thumbnail((size, size), Image.ANTIALIAS)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+
+    info = PngImagePlugin.PngInfo()
+    info.add_text("Thumb::URI", get_uri(filename))
+    info.add_text("Thumb::MTime", str(int(stat.st_mtime)))
+    info.add_text("Thumb::Size", str(stat.st_size))
+    info.add_text("Software", "Ojo")
+
+    path = get_thumbnail_path(filename, name)
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        os.makedirs(folder, mode=0o700)
+
+    fd, tmp_path = tempfile.mkstemp(prefix="ojo_", suffix=".png", dir=folder)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            image.save(f, "PNG", pnginfo=info)
+        os.chmod(tmp_path, 0o600)
+        os.rename(tmp_path, path)
+    except Exception:
+        logging.exception("Could not write shared thumbnail for %s", filename)
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        return None
+    return path
@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+"""
+Compares decode time and peak memory of imaging.get_pil thumbnailing with different values of the
+thumb_reducing_gap option (None means full decode before resampling).
+
+Usage: draft_benchmark.py <image> [<image> ...]
+
+Every measurement runs in a fresh process, so the reported peak RSS belongs to that decode only.
+"""
+
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+GAPS = [None, 3.0, 2.0, 1.0]
+THUMB_HEIGHT = 180
+
+
+def _measure(filename, gap, results):
+    from ojo import config, imaging
+
+    config.load_options()
+    config.options["thumb_reducing_gap"] = gap
+    imaging.start_exiftool_process()
+    imaging.metadata.get(filename)  # exclude the exiftool round trip from the timing
+
+    start = time.time()
+    pil = imaging.get_pil(filename, 3 * THUMB_HEIGHT, THUMB_HEIGHT)
+    elapsed = time.time() - start
+
+    imaging.stop_exiftool_process()
+    results.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, pil.size))
+
+
+def main():
+    ctx = multiprocessing.get_context("spawn")
+    for filename in sys.argv[1:]:
+        print(filename)
+        for gap in GAPS:
+            results = ctx.Queue()
+            p = ctx.Process(target=_measure, args=(filename, gap, results))
+            p.start()
+            elapsed, max_rss_kb, size = results.get()
+            p.join()
+            print(
+                "  reducing gap %-5s %7.1f ms  peak RSS %7.1f MB  result %dx%d"
+                % (gap, elapsed * 1000, max_rss_kb / 1024.0, size[0], size[1])
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+"""
+Compares converting PIL images to GdkPixbuf by copying their raw pixels (imaging.pil_to_pixbuf)
+with the previous approach of encoding to PPM and parsing that back with a PixbufLoader.
+The raw conversion copies the pixels twice (tobytes() and GLib.Bytes.new), so the time of the
+tobytes() copy alone is printed too.
+
+Usage: pil_pixbuf_benchmark.py [<image> ...]
+
+Without arguments synthetic RGB and RGBA images of a few sizes are used.
+"""
+
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from gi.repository import GdkPixbuf  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from ojo import imaging  # noqa: E402
+
+ROUNDS = 10
+
+
+def via_ppm(pil_image):
+    """The previous conversion, with BytesIO instead of the StringIO that fails under Python 3"""
+    if pil_image.mode != "RGB":
+        pil_image = pil_image.convert("RGB")
+    buff = io.BytesIO()
+    pil_image.save(buff, "ppm")
+    loader = GdkPixbuf.PixbufLoader()
+    loader.write(buff.getvalue())
+    loader.close()
+    return loader.get_pixbuf()
+
+
+def measure(fn, pil_image):
+    fn(pil_image)  # warm-up
+    start = time.time()
+    for _ in range(ROUNDS):
+        pixbuf = fn(pil_image)
+    return (time.time() - start) / ROUNDS, pixbuf
+
+
+def main():
+    if len(sys.argv) > 1:
+        images = [(f, Image.open(f)) for f in sys.argv[1:]]
+        for name, image in images:
+            image.load()
+    else:
+        images = [
+            ("%s %dx%d" % (mode, w, h), Image.new(mode, (w, h), "orange"))
+            for mode in ("RGB", "RGBA")
+            for w, h in ((640, 480), (1920, 1080), (6000, 4000))
+        ]
+
+    for name, image in images:
+        ppm_time, ppm_pixbuf = measure(via_ppm, image)
+        raw_time, raw_pixbuf = measure(imaging.pil_to_pixbuf, image)
+        copy_time, _ = measure(lambda im: im.tobytes(), image)
+        assert (raw_pixbuf.get_width(), raw_pixbuf.get_height()) == image.size
+        print(
+            "%-28s PPM round trip %8.2f ms   raw copies %8.2f ms (tobytes %8.2f ms)   %5.1fx"
+            % (name, ppm_time * 1000, raw_time * 1000, copy_time * 1000, ppm_time / raw_time)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+"""
+Measures thumbnails per second of the Thumbs engine on a folder of images.
+
+Usage: thumbs_benchmark.py <folder> [--legacy]
+
+Thumbnails are written into a temporary cache (HOME is redirected), so every run starts cold.
+--legacy is the baseline for a before/after comparison: the old thread pool, dispatched with the
+pacing of the old sleep-polling thumbs thread (a 50 ms sleep before every submission and a 0.5 s
+wait for queue events). Without it, the process pool is dispatched event-driven.
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# the spawned worker processes import this script again, they must share the cache of the run
+if "OJO_BENCHMARK_HOME" not in os.environ:
+    os.environ["OJO_BENCHMARK_HOME"] = tempfile.mkdtemp(prefix="ojo_thumbs_benchmark_")
+os.environ["HOME"] = os.environ["OJO_BENCHMARK_HOME"]
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from ojo import config, imaging, thumbs  # noqa: E402
+
+
+class BenchmarkOjo:
+    mode = "folder"
+    last_action_time = 0
+
+    def __init__(self, total):
+        self.threads = []
+        self.total = total
+        self.done = 0
+        self.all_done = threading.Event()
+
+    def _count(self):
+        self.done += 1
+        if self.done >= self.total:
+            self.all_done.set()
+
+    def thumb_ready(self, img, thumb_path):
+        self._count()
+
+    def thumb_failed(self, img, error_msg):
+        self._count()
+
+
+def legacy_dispatch(t):
+    """The pacing of the previous polling loop, kept here only for comparison"""
+    while not t.killed and t.queue:
+        if len(t.processing) >= thumbs.POOL_SIZE:
+            time.sleep(0.5)
+            continue
+        time.sleep(0.05)
+        try:
+            t.add_thumbnail(t.queue.pop())
+        except IndexError:
+            pass
+
+
+def main():
+    folder = sys.argv[1]
+    legacy = "--legacy" in sys.argv
+    config.load_options()
+    if legacy:
+        config.options["thumbs_engine"] = "thread"
+    imaging.start_exiftool_process()
+
+    images = imaging.list_images(folder)
+    ojo = BenchmarkOjo(len(images))
+    t = thumbs.Thumbs(ojo)
+    t.start(ojo)
+    while not t.pool:
+        time.sleep(0.01)
+
+    start = time.time()
+    if legacy:
+        # completions call dispatch(), which would drain the queue event-driven behind our back
+        t.dispatch = lambda: None
+        t.queue.push_many((img, (1, i)) for i, img in enumerate(images))
+        threading.Thread(target=legacy_dispatch, args=(t,), daemon=True).start()
+    else:
+        t.enqueue(images)
+    ojo.all_done.wait()
+    elapsed = time.time() - start
+
+    print(
+        "%s dispatch, %s with %d workers: %d thumbs in %.2f s, %.1f thumbs/s"
+        % (
+            "legacy" if legacy else "event-driven",
+            type(t.pool).__name__,
+            thumbs.POOL_SIZE,
+            len(images),
+            elapsed,
+            len(images) / elapsed,
+        )
+    )
+    t.stop()
+    imaging.stop_exiftool_process()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from ojo import cachegc
+from ojo.thumbindex import STATUS_OK, ThumbIndex
+
+
+class TestCacheGC(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.dir, "cache")
+        self.pictures = os.path.join(self.dir, "pictures")
+        os.makedirs(self.pictures)
+        self.index = ThumbIndex(os.path.join(self.root, "index.db"))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.dir)
+
+    def make_image(self, name):
+        path = os.path.join(self.pictures, name)
+        with open(path, "wb") as f:
+            f.write(b"image")
+        return path
+
+    def make_thumb(self, height, source, size=100, mtime=None, age=0):
+        if mtime is None:
+            mtime = os.path.getmtime(source)
+        name = os.path.basename(source) + "_" + cachegc.thumb_hash(source, mtime) + ".jpg"
+        path = os.path.join(self.root, str(height), os.path.dirname(source)[1:], name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"t" * size)
+        used = time.time() - age
+        os.utime(path, (used, used))
+        return path
+
+    def collector(self, **kwargs):
+        return cachegc.CacheCollector(root=self.root, index=self.index, **kwargs)
+
+    def test_parse_thumb_path(self):
+        image = self.make_image("a b_c.jpg")
+        thumb = self.make_thumb(180, image)
+        source, hash = cachegc.parse_thumb_path(thumb, os.path.join(self.root, "180"))
+        self.assertEqual(image, source)
+        self.assertFalse(cachegc.is_orphan(thumb, os.path.join(self.root, "180")))
+
+    def test_orphans(self):
+        kept = self.make_thumb(180, self.make_image("kept.jpg"))
+        edited = self.make_thumb(180, self.make_image("edited.jpg"), mtime=1000)
+        deleted_image = self.make_image("deleted.jpg")
+        deleted = self.make_thumb(180, deleted_image)
+        os.unlink(deleted_image)
+
+        stats = self.collector().run()
+        self.assertEqual(2, stats["orphans"])
+        self.assertTrue(os.path.exists(kept))
+        self.assertFalse(os.path.exists(edited))
+        self.assertFalse(os.path.exists(deleted))
+
+    def test_keeps_thumbs_of_unreachable_folders(self):
+        # e.g. an unmounted disk
+        image = os.path.join(self.dir, "unmounted", "a.jpg")
+        thumb = self.make_thumb(180, image, mtime=1000)
+        self.index.put(image, 180, 5, 1000, thumb, STATUS_OK)
+
+        stats = self.collector().run()
+        self.assertEqual(0, stats["orphans"])
+        self.assertEqual(0, stats["pruned_records"])
+        self.assertTrue(os.path.exists(thumb))
+
+    def test_removes_orphaned_trees(self):
+        image = self.make_image("a.jpg")
+        thumb = self.make_thumb(180, image)
+        os.unlink(image)
+        old = time.time() - 3600
+        folder = os.path.dirname(thumb)
+        while folder != os.path.join(self.root, "180"):
+            os.utime(folder, (old, old))
+            folder = os.path.dirname(folder)
+
+        self.collector().run()
+        self.assertEqual([], os.listdir(os.path.join(self.root, "180")))
+
+    def test_budget_evicts_inactive_heights_then_lru(self):
+        images = [self.make_image("%d.jpg" % i) for i in range(4)]
+        inactive = self.make_thumb(100, images[0], age=10)
+        oldest = self.make_thumb(180, images[1], age=1000)
+        older = self.make_thumb(180, images[2], age=500)
+        recent = self.make_thumb(180, images[3], age=10)
+
+        stats = self.collector(max_bytes=250, active_heights=[180]).run()
+        self.assertEqual(2, stats["evicted"])
+        self.assertEqual(200, stats["total_bytes"])
+        self.assertFalse(os.path.exists(inactive))
+        self.assertFalse(os.path.exists(oldest))
+        self.assertTrue(os.path.exists(older))
+        self.assertTrue(os.path.exists(recent))
+
+    def test_max_age(self):
+        images = [self.make_image("%d.jpg" % i) for i in range(2)]
+        stale = self.make_thumb(180, images[0], age=10 * 86400)
+        fresh = self.make_thumb(180, images[1], age=86400)
+
+        stats = self.collector(max_age_days=7).run()
+        self.assertEqual(1, stats["expired"])
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(fresh))
+
+    def test_prunes_index(self):
+        image = self.make_image("a.jpg")
+        thumb = self.make_thumb(180, image, mtime=1000)
+        st = os.stat(image)
+        self.index.put(image, 180, st.st_size, st.st_mtime_ns, thumb, STATUS_OK)
+
+        stats = self.collector().run()
+        self.assertEqual(1, stats["pruned_records"])
+        self.assertIsNone(self.index.lookup(image, 180))
+
+    def test_stop(self):
+        for i in range(10):
+            self.make_thumb(180, self.make_image("%d.jpg" % i), mtime=1000)
+        stats = self.collector(should_stop=lambda: True).run()
+        self.assertEqual(0, stats["orphans"])
+
+    def test_stop_forgets_deleted_thumbs(self):
+        images = [self.make_image("%d.jpg" % i) for i in range(3)]
+        for image in images:
+            thumb = self.make_thumb(180, image, mtime=1000)
+            self.index.put(image, 180, 5, 1000, thumb, STATUS_OK)
+
+        collector = self.collector(should_stop=lambda: collector.stats["orphans"] >= 1)
+        stats = collector.run()
+        self.assertEqual(1, stats["orphans"])
+        self.assertNotIn("pruned_records", stats)
+        remaining = [image for image in images if self.index.lookup(image, 180)]
+        self.assertEqual(2, len(remaining))
+
+
+if __name__ == "__main__":
+    unittest.main()
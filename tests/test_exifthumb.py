@@ -0,0 +1,147 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from ojo import exifthumb
+
+
+def fake_jpeg(width, height, payload=b"\0" * 16):
+    """SOI, a baseline SOF0 segment and EOI - enough for the parsers, not for a decoder"""
+    sof = struct.pack(">BHHB", 8, height, width, 3) + b"\x01\x11\x00\x02\x11\x00\x03\x11\x00"
+    return (
+        b"\xff\xd8"
+        + b"\xff\xe0"
+        + struct.pack(">H", 2 + len(payload))
+        + payload
+        + b"\xff\xc0"
+        + struct.pack(">H", 2 + len(sof))
+        + sof
+        + b"\xff\xd9"
+    )
+
+
+def tiff(endian, ifds):
+    """
+    Builds a TIFF structure whose IFDs are chained in order. Each IFD is a list of
+    (tag, type, values); bytes given as values are appended after the IFDs and the entry gets
+    their offset.
+    """
+    blobs = []
+    for entries in ifds:
+        for tag, kind, values in entries:
+            if isinstance(values, bytes):
+                blobs.append(values)
+
+    header_size = 8
+    ifd_sizes = [2 + 12 * len(entries) + 4 for entries in ifds]
+    ifd_offsets = []
+    offset = header_size
+    for size in ifd_sizes:
+        ifd_offsets.append(offset)
+        offset += size
+    blob_offsets = []
+    for blob in blobs:
+        blob_offsets.append(offset)
+        offset += len(blob)
+
+    out = (b"II" if endian == "<" else b"MM") + struct.pack(endian + "HI", 42, ifd_offsets[0])
+    blob_index = 0
+    for i, entries in enumerate(ifds):
+        out += struct.pack(endian + "H", len(entries))
+        for tag, kind, values in entries:
+            if isinstance(values, bytes):
+                values = [blob_offsets[blob_index]]
+                blob_index += 1
+            fmt = "H" if kind == 3 else "I"
+            value = struct.pack(endian + fmt, *values).ljust(4, b"\0")
+            out += struct.pack(endian + "HHI", tag, kind, 1) + value
+        next_ifd = ifd_offsets[i + 1] if i + 1 < len(ifds) else 0
+        out += struct.pack(endian + "I", next_ifd)
+    return out + b"".join(blobs)
+
+
+def thumbnail_ifd(jpeg):
+    return [
+        (exifthumb.TAG_JPEG_OFFSET, 4, jpeg),
+        (exifthumb.TAG_JPEG_LENGTH, 4, [len(jpeg)]),
+    ]
+
+
+class TestExifThumb(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def camera_jpeg(self, endian, thumb):
+        ifd0 = [(0x0112, 3, [1])]  # Orientation
+        exif = b"Exif\0\0" + tiff(endian, [ifd0, thumbnail_ifd(thumb)])
+        app1 = b"\xff\xe1" + struct.pack(">H", 2 + len(exif)) + exif
+        return b"\xff\xd8" + app1 + fake_jpeg(4000, 3000)[2:]
+
+    def test_jpeg_size(self):
+        self.assertEqual(exifthumb.jpeg_size(fake_jpeg(160, 120)), (160, 120))
+        self.assertIsNone(exifthumb.jpeg_size(b"not a jpeg"))
+        self.assertIsNone(exifthumb.jpeg_size(b"\xff\xd8\xff\xd9"))
+
+    def test_jpeg_exif_thumbnail(self):
+        thumb = fake_jpeg(160, 120)
+        for endian in "<>":
+            path = self.write("photo.jpg", self.camera_jpeg(endian, thumb))
+            [(offset, length, width, height)] = exifthumb.find_embedded_jpegs(path)
+            self.assertEqual((width, height), (160, 120))
+            self.assertEqual(exifthumb.read_embedded_jpeg(path, offset, length), thumb)
+
+    def test_sof_beyond_the_first_read(self):
+        segment = b"\xff\xe2" + struct.pack(">H", 60000) + b"\0" * 59998
+        thumb = b"\xff\xd8" + segment + fake_jpeg(160, 120)[2:]
+        path = self.write("photo.jpg", self.camera_jpeg("<", thumb))
+        found = [(w, h) for _, _, w, h in exifthumb.find_embedded_jpegs(path)]
+        self.assertEqual(found, [(160, 120)])
+
+    def test_raw_previews(self):
+        small, big = fake_jpeg(160, 120), fake_jpeg(1600, 1200)
+        preview_ifd = [
+            (exifthumb.TAG_NEW_SUBFILE_TYPE, 4, [1]),
+            (exifthumb.TAG_COMPRESSION, 3, [6]),
+            (exifthumb.TAG_STRIP_OFFSETS, 4, big),
+            (exifthumb.TAG_STRIP_BYTE_COUNTS, 4, [len(big)]),
+        ]
+        raw_ifd = [
+            (exifthumb.TAG_NEW_SUBFILE_TYPE, 4, [0]),
+            (exifthumb.TAG_COMPRESSION, 3, [7]),
+            (exifthumb.TAG_STRIP_OFFSETS, 4, b"raw data"),
+            (exifthumb.TAG_STRIP_BYTE_COUNTS, 4, [8]),
+        ]
+        data = tiff("<", [thumbnail_ifd(small), preview_ifd, raw_ifd])
+        path = self.write("photo.dng", data)
+        found = sorted((w, h) for _, _, w, h in exifthumb.find_embedded_jpegs(path))
+        self.assertEqual(found, [(160, 120), (1600, 1200)])
+
+        self.assertEqual(exifthumb.get_embedded_jpeg(path, 100, 75, 4 / 3.0), small)
+        self.assertEqual(exifthumb.get_embedded_jpeg(path, 300, 200, 4 / 3.0), big)
+        self.assertIsNone(exifthumb.get_embedded_jpeg(path, 2000, 1500, 4 / 3.0))
+
+    def test_rejects_other_aspect_ratio(self):
+        # a 4:3 thumbnail of a 3:2 image has black bars
+        path = self.write("photo.jpg", self.camera_jpeg("<", fake_jpeg(160, 120)))
+        self.assertIsNone(exifthumb.get_embedded_jpeg(path, 120, 80, 1.5))
+        self.assertIsNotNone(exifthumb.get_embedded_jpeg(path, 120, 80, 4 / 3.0))
+
+    def test_no_embedded_thumbnail(self):
+        self.assertEqual(exifthumb.find_embedded_jpegs(self.write("a.jpg", fake_jpeg(10, 10))), [])
+        self.assertEqual(exifthumb.find_embedded_jpegs(self.write("b.png", b"\x89PNG\r\n")), [])
+        self.assertEqual(exifthumb.find_embedded_jpegs(self.write("c.tif", b"II*\0\xff\xff")), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
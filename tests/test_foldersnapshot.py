@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ojo.foldersnapshot import FolderSnapshot
+
+
+class TestFolderSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for name, size in (("a.jpg", 3), ("b.PNG", 5), ("notes.txt", 1)):
+            with open(os.path.join(self.dir, name), "wb") as f:
+                f.write(b"x" * size)
+        os.utime(os.path.join(self.dir, "a.jpg"), (1000, 1000))
+        os.mkdir(os.path.join(self.dir, "sub2"))
+        os.mkdir(os.path.join(self.dir, "sub1"))
+        os.symlink(os.path.join(self.dir, "missing"), os.path.join(self.dir, "dangling.jpg"))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def test_snapshot(self):
+        snapshot = FolderSnapshot(self.dir)
+        self.assertEqual([self.path("sub1"), self.path("sub2")], snapshot.subfolders)
+        self.assertEqual(
+            sorted([self.path("a.jpg"), self.path("b.PNG"), self.path("notes.txt")]),
+            sorted(snapshot.files()),
+        )
+        self.assertEqual(
+            sorted([self.path("a.jpg"), self.path("b.PNG")]),
+            sorted(snapshot.files({".jpg", ".png"})),
+        )
+        self.assertEqual(5, snapshot.size(self.path("b.PNG")))
+        self.assertEqual(1000, snapshot.mtime(self.path("a.jpg")))
+
+    def test_captured_once(self):
+        snapshot = FolderSnapshot(self.dir)
+        os.utime(self.path("a.jpg"), (2000, 2000))
+        self.assertEqual(1000, snapshot.mtime(self.path("a.jpg")))
+
+        # files that appeared later are stat-ed on demand
+        with open(self.path("c.jpg"), "wb") as f:
+            f.write(b"xx")
+        self.assertNotIn(self.path("c.jpg"), snapshot.files())
+        self.assertEqual(2, snapshot.size(self.path("c.jpg")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+import unittest
+
+LAUNCHER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin", "ojo")
+
+# runs in a fresh interpreter whose main module looks like bin/ojo started from the command line,
+# then starts a spawn pool like Thumbs.init_pool does
+SCRIPT = """
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from tests.test_launcher import describe_worker
+
+sys.modules["__main__"].__file__ = %r
+with ProcessPoolExecutor(2, mp_context=multiprocessing.get_context("spawn")) as pool:
+    for result in pool.map(describe_worker, range(2)):
+        print(result)
+"""
+
+
+def describe_worker(_):
+    main = sys.modules["__mp_main__"]
+    return "%s %s" % (os.path.basename(main.__file__), hasattr(main, "ojo"))
+
+
+class TestLauncher(unittest.TestCase):
+    def test_workers_do_not_start_the_app(self):
+        output = subprocess.check_output(
+            [sys.executable, "-c", SCRIPT % LAUNCHER],
+            cwd=os.path.dirname(os.path.dirname(LAUNCHER)),
+            timeout=60,
+        )
+        # the workers imported the launcher, but did not get as far as importing the app
+        self.assertEqual(["ojo False", "ojo False"], output.decode().split("\n")[:2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ojo.metastore import MetaStore
+
+
+class TestMetaStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = MetaStore(os.path.join(self.dir, "cache", "metadata.db"))
+        self.image = os.path.join(self.dir, "a.jpg")
+        with open(self.image, "wb") as f:
+            f.write(b"image")
+        self.record = {"width": 4000, "height": 3000, "exif": {"Make": {"val": "Ojo"}}}
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir)
+
+    def test_put_and_lookup(self):
+        st = os.stat(self.image)
+        self.store.put(self.image, st, self.record)
+        self.store.flush()
+        self.assertEqual(self.record, self.store.lookup(self.image, st))
+        self.assertEqual({self.image: self.record}, self.store.lookup_many({self.image: st}))
+
+    def test_validated_by_size_and_mtime(self):
+        st = os.stat(self.image)
+        self.store.put(self.image, st, self.record)
+        self.store.flush()
+        with open(self.image, "ab") as f:
+            f.write(b"edited")
+        self.assertIsNone(self.store.lookup(self.image, os.stat(self.image)))
+
+    def test_written_in_background(self):
+        st = os.stat(self.image)
+        self.store.put(self.image, st, self.record)
+        self.store.writer.join(5)
+        self.assertIsNone(self.store.writer)
+        self.assertEqual(self.record, MetaStore(self.store.db_path).lookup(self.image, st))
+
+    def test_prune(self):
+        self.store.put(self.image, os.stat(self.image), self.record)
+        self.store.flush()
+        os.unlink(self.image)
+        self.assertEqual(1, self.store.prune())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import unittest
+
+from ojo.pixcache import PixbufCache
+
+
+class TestPixbufCache(unittest.TestCase):
+    def setUp(self):
+        self.positions = {"a": 0, "b": 1, "c": 2, "d": 3}
+        self.current = 0
+
+    def cache(self, max_bytes, distance=True):
+        return PixbufCache(
+            max_bytes,
+            size_of=len,
+            distance=self.distance if distance else None,
+        )
+
+    def distance(self, key):
+        position = self.positions.get(key)
+        return abs(position - self.current) if position is not None else float("inf")
+
+    def test_byte_budget(self):
+        cache = self.cache(10, distance=False)
+        cache.put("a", "xxxx")
+        cache.put("b", "xxxx")
+        cache.put("c", "xxxx")
+        self.assertNotIn("a", cache)
+        self.assertEqual(8, cache.bytes)
+        self.assertEqual(1, cache.stats()["evictions"])
+
+        # recently used ones stay
+        cache.lookup("b")
+        cache.put("d", "xxxx")
+        self.assertIn("b", cache)
+        self.assertNotIn("c", cache)
+
+    def test_keeps_oversized_insert(self):
+        cache = self.cache(10, distance=False)
+        cache.put("a", "x")
+        cache.put("b", "x" * 20)
+        self.assertEqual(["b"], list(cache.entries))
+
+        # by distance, only the nearest one stays over budget
+        cache = self.cache(10)
+        cache.put("b", "x")
+        cache.put("a", "x" * 20)
+        self.assertEqual(["a"], list(cache.entries))
+
+    def test_refuses_insert_farthest_away(self):
+        cache = self.cache(7)
+        self.current = 1
+        cache.put("a", "xxx")
+        cache.put("b", "xxx")
+        # a prefetch far ahead does not push out the current image or its neighbour
+        cache.put("d", "xxx")
+        self.assertEqual(["a", "b"], sorted(cache.entries))
+        self.assertEqual(1, cache.stats()["evictions"])
+
+    def test_prefers_entries_near_position(self):
+        cache = self.cache(7)
+        self.current = 3
+        cache.put("c", "xxx")
+        cache.put("elsewhere", "xxx")
+        cache.put("a", "xxx")
+        cache.put("d", "xxx")
+        self.assertEqual(["c", "d"], sorted(cache.entries))
+
+    def test_hits_and_misses(self):
+        cache = self.cache(10)
+        cache.put("a", "xx")
+        self.assertEqual("xx", cache.lookup("a"))
+        self.assertIsNone(cache.lookup("a", valid=lambda entry: len(entry) == 3))
+        self.assertIsNone(cache.lookup("b"))
+        self.assertIsNone(cache.get("b"))
+        stats = cache.stats()
+        self.assertEqual((1, 2), (stats["hits"], stats["misses"]))
+
+    def test_clear(self):
+        cache = self.cache(100)
+        cache.put((False, "a"), "xx")
+        cache.put((True, "a"), "xxx")
+        cache.clear(lambda key: not key[0])
+        self.assertEqual([(True, "a")], list(cache.entries))
+        self.assertEqual(3, cache.bytes)
+        cache.clear()
+        self.assertEqual((0, 0), (len(cache), cache.bytes))
+
+    def test_shared_parts_count_once(self):
+        frames = ["x" * 5]
+        cache = PixbufCache(
+            100,
+            size_of=lambda entry: len(entry[0]),
+            shared_of=lambda entry: (entry[1], len(entry[1][0])),
+        )
+        cache.put((False, "a"), ("xx", frames))
+        cache.put((True, "a"), ("xxx", frames))
+        self.assertEqual(10, cache.bytes)
+
+        # e.g. the frames scaled to another size
+        frames[0] = "x" * 8
+        cache.update((True, "a"))
+        self.assertEqual(13, cache.bytes)
+
+        cache.discard((True, "a"))
+        self.assertEqual(10, cache.bytes)
+        cache.discard((False, "a"))
+        self.assertEqual((0, {}), (cache.bytes, cache.shared))
+
+    def test_update_evicts_over_budget(self):
+        entry = ["xx"]
+        cache = PixbufCache(6, size_of=lambda entry: len(entry[0]))
+        cache.put("a", ["xxx"])
+        cache.put("b", entry)
+        entry[0] = "xxxxx"
+        cache.update("b")
+        self.assertEqual(["b"], list(cache.entries))
+        self.assertEqual(5, cache.bytes)
+
+
+if __name__ == "__main__":
+    unittest.main()
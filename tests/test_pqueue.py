@@ -0,0 +1,31 @@
+import unittest
+
+from ojo.pqueue import IndexedPriorityQueue
+
+
+class TestIndexedPriorityQueue(unittest.TestCase):
+    def test_order_and_reprioritise(self):
+        q = IndexedPriorityQueue()
+        q.push_many([("a", 3), ("b", 1), ("c", 2)])
+        q.push("a", 0)
+        self.assertEqual(3, len(q))
+        self.assertIn("a", q)
+        self.assertEqual(["a", "b", "c"], [q.pop() for _ in range(3)])
+        self.assertFalse(q)
+        self.assertRaises(IndexError, q.pop)
+
+    def test_keep_existing_and_fifo_ties(self):
+        q = IndexedPriorityQueue()
+        q.push_many([("a", 1), ("b", 1)])
+        q.push_many([("a", 5), ("c", 0)], keep_existing=True)
+        self.assertEqual(1, q.priority("a"))
+        self.assertEqual(["c", "a", "b"], [q.pop() for _ in range(3)])
+
+    def test_remove_and_compact(self):
+        q = IndexedPriorityQueue()
+        for i in range(200):
+            q.push("x", i)
+        q.push("y", 500)
+        q.remove("x")
+        self.assertLess(len(q.heap), 200)
+        self.assertEqual(["y"], [q.pop()])
@@ -0,0 +1,48 @@
+import unittest
+
+from ojo.prefetch import NavigationTracker, prefetch_window
+
+
+class TestPrefetch(unittest.TestCase):
+    def test_tracker(self):
+        tracker = NavigationTracker(window_seconds=2.0)
+        self.assertEqual(0, tracker.direction(now=0))
+        for i in range(10, 5, -1):
+            tracker.moved(i, now=10 - i * 0.1)
+        self.assertEqual(-1, tracker.direction(now=10))
+        self.assertEqual(2.0, tracker.rate(now=10))
+
+        # old moves expire
+        self.assertEqual(0, tracker.direction(now=20))
+        self.assertEqual(0, tracker.rate(now=20))
+
+    def test_jump_resets_direction(self):
+        tracker = NavigationTracker()
+        for i in range(5):
+            tracker.moved(i, now=i * 0.1)
+        tracker.moved(0, now=0.5)  # Home
+        tracker.moved(1, now=0.6)
+        self.assertEqual(1, tracker.direction(now=0.6))
+
+    def test_window(self):
+        # slow: the base window, leaning forward
+        window = prefetch_window(10, 100, 1, 0.5, ahead=2, behind=1, limit=12)
+        self.assertEqual([(11, 1), (12, 2), (9, 2)], window)
+
+        # backward
+        window = prefetch_window(10, 100, -1, 0.5, ahead=2, behind=1, limit=12)
+        self.assertEqual([(9, 1), (8, 2), (11, 2)], window)
+
+        # fast: reaches further ahead, up to the limit
+        window = prefetch_window(10, 100, 1, 4, ahead=2, behind=1, limit=12)
+        self.assertEqual(list(range(11, 17)), [p for p, _ in window if p > 10])
+        window = prefetch_window(10, 100, 1, 40, ahead=2, behind=1, limit=12)
+        self.assertEqual(22, max(p for p, _ in window))
+
+    def test_window_bounds(self):
+        self.assertEqual([(1, 1)], prefetch_window(0, 2, 1, 0, ahead=2, behind=1, limit=12))
+        self.assertEqual([], prefetch_window(0, 1, 0, 0, ahead=2, behind=1, limit=12))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from ojo.thumbindex import (
+    FINGERPRINT_BLOCK,
+    STATUS_FAILED,
+    STATUS_OK,
+    ThumbIndex,
+    fingerprint,
+    is_valid,
+)
+
+
+class TestThumbIndex(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.index = ThumbIndex(os.path.join(self.dir, "cache", "index.db"))
+        self.image = os.path.join(self.dir, "a.jpg")
+        with open(self.image, "wb") as f:
+            f.write(b"image")
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.dir)
+
+    def test_lookup_folder(self):
+        st = os.stat(self.image)
+        self.index.put(self.image, 180, st.st_size, st.st_mtime_ns, "/thumb.jpg", STATUS_OK, 270, 180)
+        self.index.put(self.image, 240, st.st_size, st.st_mtime_ns, "/thumb2.jpg", STATUS_OK)
+
+        records = self.index.lookup_folder(self.dir, 180)
+        self.assertEqual(["/thumb.jpg"], [r["thumb_path"] for r in records.values()])
+        self.assertEqual(270, records[self.image]["width"])
+        self.assertTrue(is_valid(records[self.image], st))
+
+        self.index.remove_folder(self.dir, 180)
+        self.assertEqual({}, self.index.lookup_folder(self.dir, 180))
+        self.assertIsNotNone(self.index.lookup(self.image, 240))
+
+    def test_stale_record(self):
+        st = os.stat(self.image)
+        self.index.put(self.image, 180, st.st_size, st.st_mtime_ns, "/thumb.jpg", STATUS_OK)
+        with open(self.image, "ab") as f:
+            f.write(b"changed")
+        self.assertFalse(is_valid(self.index.lookup(self.image, 180), os.stat(self.image)))
+
+    def test_put_many(self):
+        st = os.stat(self.image)
+        self.index.put_many(
+            [
+                (self.image, h, st.st_size, st.st_mtime_ns, "/%d.jpg" % h, STATUS_OK, h, h, None)
+                for h in (120, 240)
+            ]
+        )
+        records = self.index.lookup_folder(self.dir, 240)
+        self.assertEqual("/240.jpg", records[self.image]["thumb_path"])
+        self.assertEqual(self.dir, os.path.dirname(records[self.image]["path"]))
+        self.assertEqual(120, self.index.lookup(self.image, 120)["width"])
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_fingerprint(self):
+        data = os.urandom(3 * FINGERPRINT_BLOCK)
+        original = self.write("original.cr2", data)
+        copy = self.write("copy.cr2", data)
+        self.assertEqual(fingerprint(original), fingerprint(copy))
+
+        # differences in the head, tail or size all count
+        for i, changed in enumerate([b"x" + data[1:], data[:-1] + b"x", data + b"x"]):
+            self.assertNotEqual(fingerprint(original), fingerprint(self.write("%d" % i, changed)))
+        self.assertNotEqual(fingerprint(self.write("small", b"ab")), fingerprint(self.image))
+
+    def test_lookup_fingerprint(self):
+        key = fingerprint(self.image)
+        self.index.put(self.image, 180, 5, 1, "/t.jpg", STATUS_OK, fingerprint=key)
+        self.index.put(self.image, 240, 5, 1, "/t.jpg", STATUS_FAILED, fingerprint=key)
+        records = self.index.lookup_fingerprint(key)
+        self.assertEqual([(self.image, 180)], [(r["path"], r["thumb_height"]) for r in records])
+
+    def test_adds_fingerprint_column_to_old_index(self):
+        self.index.close()
+        db_path = os.path.join(self.dir, "old.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute(
+            "CREATE TABLE thumbs (path TEXT NOT NULL, folder TEXT NOT NULL, "
+            "thumb_height INTEGER NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+            "thumb_path TEXT, status TEXT NOT NULL, width INTEGER, height INTEGER, "
+            "PRIMARY KEY (path, thumb_height))"
+        )
+        conn.commit()
+        conn.close()
+
+        self.index = ThumbIndex(db_path)
+        self.index.put(self.image, 180, 1, 1, "/t.jpg", STATUS_OK, fingerprint="1:abc")
+        self.assertEqual("1:abc", self.index.lookup(self.image, 180)["fingerprint"])
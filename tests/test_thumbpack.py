@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from ojo import thumbpack
+from ojo.thumbpack import ThumbPack
+
+
+class Stat:
+    def __init__(self, size, mtime_ns):
+        self.st_size = size
+        self.st_mtime_ns = mtime_ns
+
+
+class TestThumbPack(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "packs", "test.pack")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_add_flush_reload(self):
+        pack = ThumbPack(self.path)
+        pack.add("a.jpg", 10, 1, b"thumb-a")
+        pack.add("b.jpg", 20, 2, b"thumb-b")
+        pack.flush()
+        pack.add("c.jpg", 30, 3, b"thumb-c")  # after the table, found by scanning
+        pack.close()
+
+        pack = ThumbPack(self.path)
+        self.assertEqual(b"thumb-a", pack.get("a.jpg", Stat(10, 1)))
+        self.assertEqual(b"thumb-c", pack.get("c.jpg"))
+        self.assertIsNone(pack.get("b.jpg", Stat(20, 5)))
+        self.assertIsNone(pack.get("d.jpg"))
+        pack.close()
+
+    def test_compact(self):
+        pack = ThumbPack(self.path)
+        for i in range(5):
+            pack.add("a.jpg", 10, i, b"x" * 1000)
+        pack.add("b.jpg", 20, 0, b"thumb-b")
+        size_before = pack.end
+        pack.compact()
+        self.assertLess(pack.end, size_before)
+        self.assertEqual(0, pack.dead)
+        self.assertEqual(b"x" * 1000, pack.get("a.jpg", Stat(10, 4)))
+        pack.close()
+
+        pack = ThumbPack(self.path)
+        self.assertEqual(b"thumb-b", pack.get("b.jpg", Stat(20, 0)))
+        self.assertEqual(os.path.getsize(self.path), pack.end)
+        pack.close()
+
+    def test_prune_deleted_sources(self):
+        folder = os.path.join(self.dir, "pictures")
+        os.makedirs(folder)
+        for name in ("kept.jpg", "hidden.jpg"):
+            with open(os.path.join(folder, name), "wb") as f:
+                f.write(b"image")
+        pack = ThumbPack(self.path, folder)
+        for name in ("kept.jpg", "hidden.jpg", "deleted.jpg"):
+            pack.add(name, 10, 1, b"x" * 1000)
+        pack.prune(["kept.jpg"])
+        self.assertEqual(["hidden.jpg", "kept.jpg"], sorted(pack.entries))
+        self.assertTrue(pack.dirty)
+
+        os.unlink(os.path.join(folder, "hidden.jpg"))
+        pack.compact()
+        self.assertEqual(["kept.jpg"], sorted(pack.entries))
+        pack.close()
+
+    def test_ignores_foreign_and_empty_files(self):
+        os.makedirs(os.path.dirname(self.path))
+        for content in (b"", b"not a pack"):
+            with open(self.path, "wb") as f:
+                f.write(content)
+            pack = ThumbPack(self.path)
+            self.assertEqual({}, pack.entries)
+            pack.add("a.jpg", 10, 1, b"thumb-a")
+            self.assertEqual(b"thumb-a", pack.get("a.jpg"))
+            pack.close()
+
+    def test_read_thumbnail(self):
+        packs_dir = os.path.join(self.dir, "packs", "180")
+        with mock.patch.object(thumbpack, "get_packs_dir", lambda height: packs_dir):
+            self.assertIsNone(thumbpack.read_thumbnail("/photos", 180, "a.jpg"))
+            pack = ThumbPack(thumbpack.get_pack_path("/photos", 180))
+            pack.add("a.jpg", 10, 1, b"thumb-a")
+            pack.close()
+            # e.g. from a worker process, which has no pack open
+            self.assertEqual(b"thumb-a", thumbpack.read_thumbnail("/photos", 180, "a.jpg"))
+            self.assertIsNone(thumbpack.read_thumbnail("/photos", 180, "a.jpg", Stat(10, 2)))
+            self.assertEqual([], list(thumbpack.open_pack_paths()))
+
+    def test_pack_path_per_folder_and_height(self):
+        self.assertNotEqual(
+            thumbpack.get_pack_path("/a", 180), thumbpack.get_pack_path("/a", 240)
+        )
+        self.assertEqual(thumbpack.get_pack_path("/a/", 180), thumbpack.get_pack_path("/a", 180))
@@ -0,0 +1,67 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+
+from ojo import xdgthumbs
+
+
+def png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def write_png(path, width, height, text):
+    chunks = [png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))]
+    for key, value in text.items():
+        chunks.append(png_chunk(b"tEXt", key.encode("latin-1") + b"\0" + value.encode("latin-1")))
+    chunks.append(png_chunk(b"IEND", b""))
+    with open(path, "wb") as f:
+        f.write(xdgthumbs.PNG_SIGNATURE + b"".join(chunks))
+
+
+class TestXdgThumbs(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.old_cache_home = os.environ.get("XDG_CACHE_HOME")
+        os.environ["XDG_CACHE_HOME"] = os.path.join(self.dir, "cache")
+        self.image = os.path.join(self.dir, "photo (1).jpg")
+        with open(self.image, "wb") as f:
+            f.write(b"image")
+
+    def tearDown(self):
+        if self.old_cache_home is None:
+            del os.environ["XDG_CACHE_HOME"]
+        else:
+            os.environ["XDG_CACHE_HOME"] = self.old_cache_home
+        shutil.rmtree(self.dir)
+
+    def test_uri(self):
+        self.assertEqual("file:///a/b/c%20d(1).jpg", xdgthumbs.get_uri("/a/b/c d(1).jpg"))
+
+    def test_lookup(self):
+        stat = os.stat(self.image)
+        path = xdgthumbs.get_thumbnail_path(self.image, "large")
+        os.makedirs(os.path.dirname(path))
+        write_png(
+            path,
+            256,
+            192,
+            {"Thumb::URI": xdgthumbs.get_uri(self.image), "Thumb::MTime": str(int(stat.st_mtime))},
+        )
+
+        self.assertEqual(path, xdgthumbs.lookup(self.image, 180))
+        self.assertIsNone(xdgthumbs.lookup(self.image, 240))  # too small
+
+    def test_lookup_stale(self):
+        path = xdgthumbs.get_thumbnail_path(self.image, "normal")
+        os.makedirs(os.path.dirname(path))
+        write_png(path, 128, 96, {"Thumb::URI": xdgthumbs.get_uri(self.image), "Thumb::MTime": "1"})
+        self.assertIsNone(xdgthumbs.lookup(self.image, 80))
+
+    def test_write_flavor(self):
+        self.assertEqual("normal", xdgthumbs.get_write_flavor(180, 120)[0])
+        self.assertEqual("large", xdgthumbs.get_write_flavor(270, 180)[0])
+        self.assertEqual("x-large", xdgthumbs.get_write_flavor(720, 480)[0])
+        self.assertIsNone(xdgthumbs.get_write_flavor(100, 80))